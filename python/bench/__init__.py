@@ -0,0 +1,2 @@
+# Performance benchmarks for the simulator.  See __main__.py for how to run them and
+# generators.py for the circuits they run on.
@@ -0,0 +1,179 @@
+# Times the simulator on generated circuits and writes the results as JSON, so that one
+# version can be compared with another:
+#
+#   python3 -m bench --output before.json
+#   ...change things...
+#   python3 -m bench --output after.json --compare before.json
+#
+# Run it from the folder with model.py in it.  Rendering is only timed if pygame is installed;
+# it draws to an off-screen surface, so no window appears.
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+from typing import Callable, List
+from model import Interactable, serialize, deserialize, reload, putOnLift, singleStep
+from binformat import serializeBinary
+from eventsim import EventDrivenSimulator
+from codegen import GeneratedCircuit
+from headless import engines
+from bench.generators import generators, makeCircuit
+
+ticksPerCall = 100 # the step benchmark runs this many ticks at a time
+
+# Calls function over and over for at least minTime seconds; returns the number of calls and
+# the average time each one took.
+def measure(function: Callable[[], None], minTime: float):
+    calls = 0
+    batch = 1
+    started = time.perf_counter()
+    while True:
+        for _ in range(batch):
+            function()
+        calls += batch
+        elapsed = time.perf_counter() - started
+        if elapsed >= minTime:
+            return calls, elapsed / calls
+        batch *= 2
+
+# Returns a function that runs ticksPerCall ticks with the engine.  The engine is made here, and
+# its first tick run, so the timing is only of step() and not of compiling the circuit or of the
+# full tick the event-driven simulator starts with.  The compiled and generated engines' states
+# aren't stored back into the blocks.
+def stepFunction(interactables: List[Interactable], engine: str) -> Callable[[], None]:
+    if engine == "classic":
+        def step():
+            for _ in range(ticksPerCall):
+                singleStep(interactables)
+        return step
+    if engine == "event":
+        circuit = EventDrivenSimulator(interactables)
+    elif engine == "compiled":
+        from compiled import CompiledCircuit
+        circuit = CompiledCircuit(interactables)
+    elif engine == "generated":
+        # Not cached on disk: the timing is of step(), and the benchmark's circuits would fill the cache
+        circuit = GeneratedCircuit(interactables)
+    else:
+        raise ValueError("Unknown engine: " + engine)
+    circuit.step(1)
+    return lambda: circuit.step(ticksPerCall)
+
+# Returns (name, function) pairs for the operations to time on one circuit
+def operations(blocks: List[dict], engine: str, render: bool):
+    content = json.dumps(blocks)
+    interactables = deserialize(content)
+    binary = serializeBinary(interactables)
+    yield "deserialize", lambda: deserialize(content)
+    yield "serialize", lambda: serialize(interactables)
+    yield "deserialize-binary", lambda: deserialize(binary)
+    yield "serialize-binary", lambda: serializeBinary(interactables)
+    yield "step", stepFunction(interactables, engine)
+    yield "reload", lambda: reload(interactables)
+    yield "lift", lambda: putOnLift(interactables)
+    if render:
+        yield from renderOperations(interactables)
+
+def renderOperations(interactables: List[Interactable]):
+    # Has to be set before pygame is loaded
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    import smlogic
+    pygame.font.init()
+    smlogic.Assets.labelFont = pygame.font.SysFont(None, 16)
+    screen = pygame.Surface((1280, 720))
+    wireLayer = smlogic.WireLayer()
+
+    def drawFrame(redrawWires: bool):
+        if redrawWires:
+            wireLayer.invalidate()
+        wireLayer.refresh(screen.get_size(), interactables)
+        screen.blit(wireLayer.surface, (0, 0))
+        for box in interactables:
+            smlogic.drawInteractable(screen, box)
+
+    # A frame after the layout changed, and one where only the blocks are drawn
+    yield "render", lambda: drawFrame(True)
+    yield "render-cached", lambda: drawFrame(False)
+
+def canRender() -> bool:
+    try:
+        import pygame
+        return True
+    except ImportError:
+        return False
+
+def compare(results: List[dict], baseline: dict, threshold: float) -> int:
+    before = {(r['circuit'], r['size'], r['operation']): r['seconds'] for r in baseline['results']}
+    regressions = 0
+    for r in results:
+        old = before.get((r['circuit'], r['size'], r['operation']))
+        if old is None or old == 0:
+            continue
+        ratio = r['seconds'] / old
+        flag = ""
+        if ratio > threshold:
+            flag = "  <-- slower"
+            regressions += 1
+        sys.stderr.write("{0:>9} {1:>7} {2:<19} {3:7.2f}x{4}\n".format(r['circuit'], r['size'], r['operation'], ratio, flag))
+    return regressions
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python3 -m bench", description="Times the simulator on generated circuits.")
+    parser.add_argument("--circuits", nargs="+", choices=list(generators.keys()), default=list(generators.keys()), help="the kinds of circuit to time")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000, 100000], help="roughly how many blocks in each circuit")
+    parser.add_argument("--engine", choices=engines, default="classic", help="the simulation engine the step benchmark uses")
+    parser.add_argument("--min-time", type=float, default=0.2, help="the least time to spend on each measurement, in seconds")
+    parser.add_argument("--no-render", action="store_true", help="don't time drawing")
+    parser.add_argument("--label", default="", help="a note to put in the results, e.g. the version being timed")
+    parser.add_argument("--output", metavar="FILE", help="write the results to FILE rather than to stdout")
+    parser.add_argument("--compare", metavar="FILE", help="compare the times with an earlier results file")
+    parser.add_argument("--threshold", type=float, default=1.25, help="with --compare, how many times slower counts as a regression")
+    args = parser.parse_args(argv)
+
+    render = not args.no_render and canRender()
+    results = []
+    for name in args.circuits:
+        for size in args.sizes:
+            blocks = makeCircuit(name, size)
+            for operation, function in operations(blocks, args.engine, render):
+                calls, seconds = measure(function, args.min_time)
+                result = {
+                    'circuit': name,
+                    'size': size,
+                    'blocks': len(blocks),
+                    'operation': operation,
+                    'calls': calls,
+                    'seconds': seconds
+                }
+                if operation == "step":
+                    result['engine'] = args.engine
+                    result['ticksPerSecond'] = ticksPerCall / seconds
+                results.append(result)
+                sys.stderr.write("{0:>9} {1:>7} {2:<19} {3:12.6f}s\n".format(name, size, operation, seconds))
+
+    report = {
+        'label': args.label,
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=4)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        return 1 if compare(results, baseline, args.threshold) > 0 else 0
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())
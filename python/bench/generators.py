@@ -0,0 +1,133 @@
+# Makes circuits of any size for benchmarking.  Each generator returns a list of dictionaries
+# in the same shape that model.serialize writes (so json.dumps of it can be loaded like a saved
+# file), laid out on a grid so they can be drawn too.
+import random
+from typing import Callable, Dict, List
+
+class CircuitBuilder:
+    spacing = 80 # pixels between grid positions
+
+    def __init__(self):
+        self.blocks = []
+
+    # Adds a block at the given grid position and returns its index
+    def add(self, kind: str, column: int, row: int, inputs: List[int] = (), **state) -> int:
+        block = {
+            'kind': kind,
+            'x': 40 + column * CircuitBuilder.spacing,
+            'y': 40 + row * CircuitBuilder.spacing,
+            'inputs': list(inputs)
+        }
+        if kind == 'timer10':
+            block['timerTickStorage'] = [False] * 10
+        elif 'savedState' not in state:
+            block['savedState'] = False
+        block.update(state)
+        self.blocks.append(block)
+        return len(self.blocks) - 1
+
+    def connect(self, source: int, target: int):
+        self.blocks[target]['inputs'].append(source)
+
+# Adds two numbers, one full adder (5 gates and two inputs) per bit.  The carry ripples through
+# one bit every couple of ticks.
+def rippleCarryAdder(bits: int) -> List[dict]:
+    builder = CircuitBuilder()
+    carry = None
+    for bit in range(bits):
+        a = builder.add('input', 0, bit * 2, savedState=bit % 2 == 0)
+        b = builder.add('input', 0, bit * 2 + 1, savedState=bit % 3 == 0)
+        halfSum = builder.add('xor', 1, bit * 2, [a, b])
+        halfCarry = builder.add('and', 1, bit * 2 + 1, [a, b])
+        if carry is None:
+            # The first bit has no carry in
+            builder.add('or', 2, bit * 2, [halfSum])
+            carry = halfCarry
+        else:
+            builder.add('xor', 2, bit * 2, [halfSum, carry])
+            carryThrough = builder.add('and', 2, bit * 2 + 1, [halfSum, carry])
+            carry = builder.add('or', 3, bit * 2 + 1, [halfCarry, carryThrough])
+    return builder.blocks
+
+# A counter's worth of XORs and ANDs.  Each bit is an XOR that toggles when the carry into it is
+# on, with an OR to feed its output back round (a gate can't be wired to itself) and an AND for
+# the carry out.  The gate delays skew the bits, so it doesn't show a tidy count, but it keeps
+# every bit just as busy as a real counter would.
+def binaryCounter(bits: int) -> List[dict]:
+    builder = CircuitBuilder()
+    carry = builder.add('input', 0, 0, savedState=True)
+    for bit in range(bits):
+        toggle = builder.add('xor', 1, bit, [carry])
+        feedback = builder.add('or', 2, bit, [toggle])
+        builder.connect(feedback, toggle)
+        carry = builder.add('and', 3, bit, [toggle, carry])
+    return builder.blocks
+
+# Lots of copies of tutorial/memorybit.json, each with its own set and reset inputs.
+def memoryBits(count: int) -> List[dict]:
+    builder = CircuitBuilder()
+    for bit in range(count):
+        column = (bit % 10) * 4
+        row = (bit // 10) * 2
+        setInput = builder.add('input', column, row, savedState=bit % 2 == 0)
+        resetInput = builder.add('input', column, row + 1)
+        latch = builder.add('nor', column + 1, row + 1, [resetInput])
+        setGate = builder.add('or', column + 1, row, [latch, setInput])
+        output = builder.add('nand', column + 2, row, [setGate])
+        builder.connect(output, latch)
+    return builder.blocks
+
+# An input feeding a long line of 10-bar timers
+def timerChain(length: int) -> List[dict]:
+    builder = CircuitBuilder()
+    previous = builder.add('input', 0, 0, savedState=True)
+    for index in range(length):
+        previous = builder.add('timer10', 1 + index % 100, index // 100, [previous])
+    return builder.blocks
+
+# Random gates that only take inputs from the blocks before them, so there are no loops
+def randomDag(size: int, seed: int = 0) -> List[dict]:
+    return randomGraph(size, seed, feedback=False)
+
+# Random gates wired up any old way, loops and all
+def randomFeedback(size: int, seed: int = 0) -> List[dict]:
+    return randomGraph(size, seed, feedback=True)
+
+def randomGraph(size: int, seed: int, feedback: bool) -> List[dict]:
+    generator = random.Random(seed)
+    builder = CircuitBuilder()
+    columns = max(1, int(size ** 0.5))
+    inputCount = max(1, size // 20)
+    for index in range(size):
+        column, row = index % columns, index // columns
+        if index < inputCount:
+            builder.add('input', column, row, savedState=generator.random() < 0.5)
+            continue
+        kind = generator.choice(['and', 'or', 'xor', 'nand', 'nor', 'xnor'])
+        sources = size if feedback else index
+        inputs = [generator.randrange(sources) for _ in range(generator.randint(1, 4))]
+        builder.add(kind, column, row, sorted(set(inputs) - {index}), savedState=generator.random() < 0.5)
+    return builder.blocks
+
+# Each generator along with how many blocks it makes per unit of its parameter, so that
+# circuits of roughly the same size can be made of every kind.
+generators: Dict[str, Callable[[int], List[dict]]] = {
+    'adder': rippleCarryAdder,
+    'counter': binaryCounter,
+    'memory': memoryBits,
+    'timers': timerChain,
+    'dag': randomDag,
+    'feedback': randomFeedback
+}
+blocksPerUnit = {
+    'adder': 7,
+    'counter': 3,
+    'memory': 5,
+    'timers': 1,
+    'dag': 1,
+    'feedback': 1
+}
+
+# Makes the named kind of circuit with roughly the given number of blocks
+def makeCircuit(name: str, size: int) -> List[dict]:
+    return generators[name](max(1, size // blocksPerUnit[name]))
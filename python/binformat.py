@@ -0,0 +1,169 @@
+# A compact binary format for circuits.  The JSON format is nice to read, but it's big and
+# slow for circuits with lots of blocks (a single 10-tick timer is a dozen lines of JSON).
+# This format is a short header followed by a handful of flat arrays, so it can be read with
+# a few bulk copies straight out of a memory-mapped file:
+#
+#   magic        4 bytes   b'SMLB'
+#   version      uint32    1
+#   count        uint32    number of interactables
+#   edgeCount    uint32    total number of inputs
+#   timerCount   uint32    number of timers
+#   slotCount    uint32    total number of slots in all the timers' delay lines
+#   kinds        uint8[count]          see kindCodes
+#   flags        uint8[count]          bit 0 is the saved state, bit 1 is set for probes
+#   x            int32[count]
+#   y            int32[count]
+#   inputCounts  uint32[count]
+#   inputs       uint32[edgeCount]     the indices of the inputs, in order, block by block
+#   delays       uint32[timerCount]    the delay of each timer, in ticks
+#   slots        bits[slotCount]       the delay lines, one bit per slot, packed lowest bit first
+#
+# All numbers are little-endian.  Like the JSON format, it holds the saved state but not the
+# current state of the simulation.  It has no room for subcircuits (see subcircuit.py); circuits
+# with those have to be saved as JSON.
+import mmap
+import struct
+import sys
+from array import array
+from typing import List
+from model import Interactable, Timer, deserialize, link
+
+extension = ".smlb"
+magic = b'SMLB'
+version = 1
+header = struct.Struct('<4sIIIII')
+
+kindCodes = {
+    "input": 0,
+    "timer": 1,
+    "and": 2,
+    "or": 3,
+    "xor": 4,
+    "nand": 5,
+    "nor": 6,
+    "xnor": 7
+}
+kindNames = {code: kind for kind, code in kindCodes.items()}
+
+def isBinary(content) -> bool:
+    return bytes(content[:len(magic)]) == magic
+
+def littleEndian(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def readArray(typecode: str, content, offset: int, count: int):
+    values = array(typecode)
+    values.frombytes(content[offset:offset + count * values.itemsize])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values, offset + count * values.itemsize
+
+# Packs a sequence of 0/1 bytes into bits, 8 to a byte, lowest bit first
+def packBits(bits: bytearray) -> bytes:
+    packed = bytearray((len(bits) + 7) // 8)
+    for index in range(len(packed)):
+        byte = 0
+        for bit, value in enumerate(bits[index * 8:index * 8 + 8]):
+            byte |= value << bit
+        packed[index] = byte
+    return bytes(packed)
+
+def serializeBinary(interactables: List[Interactable]) -> bytes:
+    if any(i.kind == 'instance' for i in interactables):
+        raise ValueError("Circuits with subcircuits can only be saved as JSON")
+    indexOf = {id(x): index for index, x in enumerate(interactables)}
+    kinds = bytearray()
+    flags = bytearray()
+    xs = array('i')
+    ys = array('i')
+    inputCounts = array('I')
+    inputs = array('I')
+    delays = array('I')
+    slots = bytearray()
+    for i in interactables:
+        if isinstance(i, Timer):
+            kinds.append(kindCodes["timer"])
+            flags.append(2 if i.probe else 0)
+            delays.append(i.delay)
+            slots.extend(i.delayLine)
+        else:
+            kinds.append(kindCodes[i.kind])
+            flags.append((1 if i.savedState else 0) | (2 if i.probe else 0))
+        xs.append(i.x)
+        ys.append(i.y)
+        inputCounts.append(len(i.inputs))
+        inputs.extend(indexOf[id(x)] for x in i.inputs)
+    return b''.join([
+        header.pack(magic, version, len(interactables), len(inputs), len(delays), len(slots)),
+        bytes(kinds),
+        bytes(flags),
+        littleEndian(xs),
+        littleEndian(ys),
+        littleEndian(inputCounts),
+        littleEndian(inputs),
+        littleEndian(delays),
+        packBits(slots)
+    ])
+
+def deserializeBinary(content) -> List[Interactable]:
+    with memoryview(content) as view:
+        return deserializeView(view)
+
+def deserializeView(content: memoryview) -> List[Interactable]:
+    fileMagic, fileVersion, count, edgeCount, timerCount, slotCount = header.unpack_from(content, 0)
+    if fileMagic != magic or fileVersion != version:
+        raise ValueError("Not a version {0} circuit file".format(version))
+    offset = header.size
+    kinds = bytes(content[offset:offset + count])
+    offset += count
+    flags = bytes(content[offset:offset + count])
+    offset += count
+    xs, offset = readArray('i', content, offset, count)
+    ys, offset = readArray('i', content, offset, count)
+    inputCounts, offset = readArray('I', content, offset, count)
+    inputs, offset = readArray('I', content, offset, edgeCount)
+    delays, offset = readArray('I', content, offset, timerCount)
+    slots = bytes(content[offset:offset + (slotCount + 7) // 8])
+
+    interactables = []
+    timerIndex = 0
+    slotIndex = 0
+    for index in range(count):
+        kind = kindNames[kinds[index]]
+        interactable = Interactable.kindToTypeMap[kind](kind, (xs[index], ys[index]))
+        if kind == "timer":
+            delay = delays[timerIndex]
+            timerIndex += 1
+            storage = [(slots[slot >> 3] >> (slot & 7)) & 1 == 1 for slot in range(slotIndex, slotIndex + delay + 1)]
+            slotIndex += delay + 1
+            interactable.loadState({
+                'kind': kind,
+                'seconds': delay // Timer.ticksPerSecond,
+                'ticks': delay % Timer.ticksPerSecond,
+                'timerTickStorage': storage
+            })
+        else:
+            interactable.loadState({'kind': kind, 'savedState': flags[index] & 1 == 1})
+        interactable.probe = flags[index] & 2 == 2
+        interactables.append(interactable)
+
+    edge = 0
+    for index in range(count):
+        for _ in range(inputCounts[index]):
+            link(interactables[inputs[edge]], interactables[index])
+            edge += 1
+    return interactables
+
+# Loads a circuit file in either format, memory-mapping it so big binary files don't have
+# to be copied into memory before they're parsed.
+def loadFile(filename: str) -> List[Interactable]:
+    with open(filename, 'rb') as file:
+        if file.seek(0, 2) == 0:
+            return []
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            if isBinary(content):
+                return deserializeBinary(content)
+            return deserialize(content[:])
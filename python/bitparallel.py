@@ -0,0 +1,120 @@
+# Runs many scenarios of the same circuit at once.  Rather than a single bool per block, each
+# block gets an integer where bit N is its state in scenario N, so one pass over the circuit
+# advances every scenario by a tick and the gates turn into bitwise and/or/xor on whole words.
+# Python's integers don't have a size limit, so there can be as many scenarios as you like;
+# CPython does the work on them a machine word at a time.
+#
+# The main use is exhaustively checking a circuit against every combination of its inputs:
+#
+#   circuit = BitParallelCircuit.exhaustive(interactables)
+#   circuit.step(100)
+#   circuit.stateOf(output, scenario)
+#
+# where bit K of 'scenario' is the state of the K'th input.
+import operator
+from collections import deque
+from functools import reduce
+from typing import Iterable, List
+from model import Interactable, Input, Timer, LogicGate
+
+def _and(mask: int, values: List[int]) -> int:
+    return reduce(operator.and_, values, mask) if values else 0
+
+def _or(mask: int, values: List[int]) -> int:
+    return reduce(operator.or_, values, 0)
+
+def _xor(mask: int, values: List[int]) -> int:
+    return reduce(operator.xor, values, 0)
+
+# These are the bitwise versions of LogicGate.functions.  Note that the 'not' variants are
+# all off when there are no inputs, same as the originals.
+wordFunctions = {
+    "and": _and,
+    "or": _or,
+    "xor": _xor,
+    "nand": lambda mask, values: mask ^ _and(mask, values) if values else 0,
+    "nor": lambda mask, values: mask ^ _or(mask, values) if values else 0,
+    "xnor": lambda mask, values: mask ^ _xor(mask, values) if values else 0
+}
+
+class BitParallelCircuit:
+    def __init__(self, interactables: Iterable[Interactable], scenarioCount: int):
+        self.interactables: List[Interactable] = list(interactables)
+        self.scenarioCount = scenarioCount
+        self.mask = (1 << scenarioCount) - 1
+        self.indexOf = {id(x): i for i, x in enumerate(self.interactables)}
+        if any(x.kind == 'instance' for x in self.interactables):
+            raise ValueError("BitParallelCircuit doesn't run subcircuits; flatten the circuit with subcircuit.FlatCircuit first")
+
+        self.gates = []
+        self.timers = []
+        for index, x in enumerate(self.interactables):
+            inputIndices = [self.indexOf[id(input)] for input in x.inputs]
+            if isinstance(x, LogicGate):
+                self.gates.append((index, wordFunctions[x.kind], inputIndices))
+            elif isinstance(x, Timer):
+                self.timers.append((index, inputIndices[0] if inputIndices else None))
+
+        # Every scenario starts out in whatever state the interactables are in now
+        self.state = [self.broadcast(x.currentState) for x in self.interactables]
+        self.prevState = [self.broadcast(x.prevState) for x in self.interactables]
+        self.timerStorage = [deque((self.broadcast(b) for b in self.interactables[index].delayLine), maxlen=len(self.interactables[index].delayLine)) for index, _ in self.timers]
+
+    # Makes a circuit with one scenario for each combination of the given inputs (all the Inputs
+    # in the circuit if it isn't given).  Bit K of the scenario number is the state of inputs[K].
+    @classmethod
+    def exhaustive(cls, interactables: Iterable[Interactable], inputs: List[Input] = None):
+        interactables = list(interactables)
+        if inputs is None:
+            inputs = [x for x in interactables if isinstance(x, Input)]
+        circuit = cls(interactables, 1 << len(inputs))
+        for bit, input in enumerate(inputs):
+            circuit.setInput(input, circuit.countingPattern(bit))
+        return circuit
+
+    def broadcast(self, state: bool) -> int:
+        return self.mask if state else 0
+
+    # The bit pattern where scenario N gets bit K of N, e.g. 0b10101010... for K = 0.
+    def countingPattern(self, bit: int) -> int:
+        run = 1 << bit
+        block = ((1 << run) - 1) << run
+        pattern = 0
+        for start in range(0, self.scenarioCount, run * 2):
+            pattern |= block << start
+        return pattern & self.mask
+
+    # Sets the current state of an input in each scenario; bit N is the state for scenario N.
+    def setInput(self, input: Input, bits: int):
+        self.state[self.indexOf[id(input)]] = bits & self.mask
+
+    def step(self, ticks: int = 1):
+        mask = self.mask
+        for _ in range(ticks):
+            # apply
+            prevState = self.state[:]
+            state = self.state
+            for (index, _), storage in zip(self.timers, self.timerStorage):
+                storage.appendleft(storage[0])
+                state[index] = storage[-1]
+
+            # calculate
+            for index, function, inputIndices in self.gates:
+                state[index] = function(mask, [prevState[i] for i in inputIndices])
+            for (_, source), storage in zip(self.timers, self.timerStorage):
+                storage[0] = prevState[source] if source is not None else 0
+            self.prevState = prevState
+
+    def stateOf(self, interactable: Interactable, scenario: int) -> bool:
+        return (self.state[self.indexOf[id(interactable)]] >> scenario) & 1 == 1
+
+    def states(self, scenario: int) -> List[bool]:
+        return [(word >> scenario) & 1 == 1 for word in self.state]
+
+    # Copies the state of one scenario onto the interactables, e.g. to look at it in the UI.
+    def store(self, scenario: int):
+        for x, word, prevWord in zip(self.interactables, self.state, self.prevState):
+            x.currentState = (word >> scenario) & 1 == 1
+            x.prevState = (prevWord >> scenario) & 1 == 1
+        for (index, _), storage in zip(self.timers, self.timerStorage):
+            self.interactables[index].timerTickStorage = [(word >> scenario) & 1 == 1 for word in storage]
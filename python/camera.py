@@ -0,0 +1,69 @@
+# Where the window is looking: the circuit is laid out in its own coordinates (the ones saved in
+# the file), and the camera maps them onto the screen with a pan and a zoom.
+#
+#   screen = (world - (x, y)) * zoom
+#
+# so (x, y) is the point of the circuit at the top left corner of the window.  It doesn't need
+# pygame, so it can be tested and used on its own.
+from typing import Iterable, Tuple
+from model import Interactable
+
+class Camera:
+    minZoom = 1 / 32
+    maxZoom = 4
+
+    def __init__(self, x: float = 0, y: float = 0, zoom: float = 1):
+        self.x = x
+        self.y = y
+        self.zoom = zoom
+
+    # Anything cached in screen coordinates has to be redrawn when this changes
+    def key(self) -> Tuple[float,float,float]:
+        return (self.x, self.y, self.zoom)
+
+    def toScreen(self, x: float, y: float) -> Tuple[int,int]:
+        return (int(round((x - self.x) * self.zoom)), int(round((y - self.y) * self.zoom)))
+
+    def toWorld(self, pos: Tuple[float,float]) -> Tuple[float,float]:
+        return (pos[0] / self.zoom + self.x, pos[1] / self.zoom + self.y)
+
+    # Like toWorld, but rounded to whole units, which is what blocks' positions are
+    def toWorldPoint(self, pos: Tuple[float,float]) -> Tuple[int,int]:
+        x, y = self.toWorld(pos)
+        return (int(round(x)), int(round(y)))
+
+    # The size of something on the screen, given its size in the circuit
+    def scale(self, length: float) -> int:
+        return max(1, int(round(length * self.zoom)))
+
+    # Moves the view by a distance on the screen, e.g. the distance the mouse was dragged
+    def pan(self, rel: Tuple[float,float]):
+        self.x -= rel[0] / self.zoom
+        self.y -= rel[1] / self.zoom
+
+    # Zooms in (factor > 1) or out, keeping the point under pos where it is
+    def zoomAt(self, pos: Tuple[float,float], factor: float):
+        worldX, worldY = self.toWorld(pos)
+        self.zoom = min(Camera.maxZoom, max(Camera.minZoom, self.zoom * factor))
+        self.x = worldX - pos[0] / self.zoom
+        self.y = worldY - pos[1] / self.zoom
+
+    # The part of the circuit that's on a screen of the given size, as (left, top, right, bottom)
+    def visibleArea(self, size: Tuple[int,int]) -> Tuple[float,float,float,float]:
+        return (self.x, self.y, self.x + size[0] / self.zoom, self.y + size[1] / self.zoom)
+
+    # Zooms and pans so all the blocks fit on a screen of the given size, but never zooms in past 1:1
+    def fit(self, interactables: Iterable[Interactable], size: Tuple[int,int]):
+        interactables = list(interactables)
+        if not interactables:
+            self.x = self.y = 0
+            self.zoom = 1
+            return
+        half = Interactable.size // 2
+        left = min(i.x for i in interactables) - half
+        top = min(i.y for i in interactables) - half
+        right = max(i.x for i in interactables) + half
+        bottom = max(i.y for i in interactables) + half
+        self.zoom = min(1, max(Camera.minZoom, min(size[0] / (right - left), size[1] / (bottom - top))))
+        self.x = (left + right) / 2 - size[0] / self.zoom / 2
+        self.y = (top + bottom) / 2 - size[1] / self.zoom / 2
@@ -0,0 +1,231 @@
+# Runs a circuit by writing a Python function specially for it and compiling that.  singleStep
+# spends most of its time calling apply() and calculate() and looking up LogicGate.functions;
+# the generated function has none of that, just one line per gate, like
+#
+#   b12 = not (a3 & a7)
+#
+# for a NAND, where aN is the state of block N at the start of the tick and bN is its state after
+# it.  The ticks go back and forth between the a's and the b's so nothing needs copying.  Timers
+# use their own delay lines, so a timer is an appendleft and a read of its last slot.
+#
+# The function only depends on the shape of the circuit (the kinds of blocks and what's wired to
+# what), not on the states or the positions, so the functions are cached by a hash of that.
+# They can also be cached on disk, since compiling a big one takes a while.  Each shape is a file
+# there, so the folder gets pruned (the ones used longest ago first) to keep it under
+# maxCacheBytes.
+import hashlib
+import json
+import marshal
+import os
+import sys
+from collections import OrderedDict
+from typing import Callable, Iterable, List
+from model import Interactable, Input, Timer
+
+maxCachedFunctions = 16
+cachedFunctions = OrderedDict() # topology hash => step function, least recently used first
+maxCacheBytes = 64*1024*1024 # for the files on disk
+
+# Where the code gets cached on disk by default: the user's cache folder, not the source tree
+def userCacheFolder() -> str:
+    if sys.platform == "win32":
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser(os.path.join("~", "Library", "Caches"))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join("~", ".cache"))
+    return os.path.join(base, "smlogicsim", "generated")
+
+# Everything the generated code depends on, in a form that can be hashed
+def topology(interactables: List[Interactable]) -> list:
+    indexOf = {id(x): index for index, x in enumerate(interactables)}
+    shape = []
+    for x in interactables:
+        if isinstance(x, Timer):
+            # A timer with only one slot needs different code; otherwise the length doesn't matter
+            kind = "timer" if len(x.delayLine) > 1 else "timer0"
+        elif isinstance(x, Input):
+            kind = "input"
+        elif x.kind == 'instance':
+            raise ValueError("Generated code doesn't run subcircuits; flatten the circuit with subcircuit.FlatCircuit first")
+        else:
+            kind = x.kind
+        shape.append([kind, [indexOf[id(input)] for input in x.inputs]])
+    return shape
+
+def topologyHash(shape: list) -> str:
+    return hashlib.sha256(json.dumps(shape, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+# The expression for the new state of a gate, given the names of its inputs' states
+def gateExpression(kind: str, inputs: List[str]) -> str:
+    if not inputs:
+        return "False"
+    operator = {"and": " & ", "nand": " & ", "or": " | ", "nor": " | ", "xor": " ^ ", "xnor": " ^ "}[kind]
+    expression = operator.join(inputs)
+    if kind in ("nand", "nor", "xnor"):
+        return "not (" + expression + ")"
+    return expression if len(inputs) == 1 else "(" + expression + ")"
+
+# One tick's worth of lines, reading the 'before' names and writing the 'after' ones
+def tickLines(shape: list, before: str, after: str) -> List[str]:
+    lines = []
+    timerIndex = 0
+    for index, (kind, inputs) in enumerate(shape):
+        if kind == "input":
+            continue
+        if kind in ("timer", "timer0"):
+            input = before + str(inputs[0]) if inputs else "False"
+            if kind == "timer":
+                lines.append("t{0}.appendleft({1}); {2}{3} = t{0}[-1]".format(timerIndex, input, after, index))
+            else:
+                lines.append("{2}{3} = t{0}[0]; t{0}[0] = {1}".format(timerIndex, input, after, index))
+            timerIndex += 1
+        else:
+            lines.append("{0}{1} = {2}".format(after, index, gateExpression(kind, [before + str(i) for i in inputs])))
+    return lines
+
+# Writes the source of a function step(states, delayLines, ticks) that runs 'ticks' ticks from the
+# given current states and timer delay lines (which it changes in place), and returns the lists
+# of current and previous states afterwards.
+def generateSource(shape: list) -> str:
+    count = len(shape)
+    timerCount = sum(1 for kind, inputs in shape if kind in ("timer", "timer0"))
+    a = "".join("a{0}, ".format(index) for index in range(count))
+    b = "".join("b{0}, ".format(index) for index in range(count))
+    indent = "    "
+    lines = ["def step(states, delayLines, ticks):"]
+    lines.append(indent + "if ticks <= 0: return None")
+    if count > 0:
+        # The inputs don't change, so they need to be in both sets
+        lines.append(indent + a + "= states")
+        lines.append(indent + b + "= states")
+    for timerIndex in range(timerCount):
+        lines.append(indent + "t{0} = delayLines[{0}]".format(timerIndex))
+    lines.append(indent + "for _ in range(ticks >> 1):")
+    lines += [indent * 2 + line for line in tickLines(shape, "a", "b") + tickLines(shape, "b", "a")]
+    lines.append(indent * 2 + "pass")
+    lines.append(indent + "if ticks & 1:")
+    lines += [indent * 2 + line for line in tickLines(shape, "a", "b")]
+    lines.append(indent * 2 + "return [" + b + "], [" + a + "]")
+    lines.append(indent + "return [" + a + "], [" + b + "]")
+    return "\n".join(lines) + "\n"
+
+def cacheFile(cacheFolder: str, key: str) -> str:
+    return os.path.join(cacheFolder, "{0}.{1}.step".format(key, sys.implementation.cache_tag))
+
+def loadCode(cacheFolder: str, key: str):
+    try:
+        with open(cacheFile(cacheFolder, key), 'rb') as file:
+            code = marshal.load(file)
+        # Pruning goes by when the files were last used
+        os.utime(cacheFile(cacheFolder, key))
+        return code
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+def saveCode(cacheFolder: str, key: str, code):
+    # It's only a cache, so it doesn't matter if it can't be written
+    try:
+        os.makedirs(cacheFolder, exist_ok=True)
+        with open(cacheFile(cacheFolder, key), 'wb') as file:
+            marshal.dump(code, file)
+        pruneCache(cacheFolder, maxCacheBytes)
+    except OSError:
+        pass
+
+# Deletes the cached code that was used longest ago until the rest fits in maxBytes
+def pruneCache(cacheFolder: str, maxBytes: int):
+    files = []
+    with os.scandir(cacheFolder) as entries:
+        for entry in entries:
+            if entry.name.endswith(".step") and entry.is_file():
+                info = entry.stat()
+                files.append((info.st_mtime, info.st_size, entry.path))
+    total = sum(size for modified, size, path in files)
+    for modified, size, path in sorted(files):
+        if total <= maxBytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+# Returns the step function for the circuit, from the cache if it's been made before
+def stepFunction(interactables: List[Interactable], cacheFolder: str = None) -> Callable:
+    shape = topology(interactables)
+    key = topologyHash(shape)
+    function = cachedFunctions.get(key)
+    if function is not None:
+        cachedFunctions.move_to_end(key)
+        return function
+
+    code = loadCode(cacheFolder, key) if cacheFolder is not None else None
+    if code is None:
+        code = compile(generateSource(shape), "<generated step {0}>".format(key[:12]), "exec")
+        if cacheFolder is not None:
+            saveCode(cacheFolder, key, code)
+    namespace = {}
+    exec(code, namespace)
+    function = namespace['step']
+
+    cachedFunctions[key] = function
+    if len(cachedFunctions) > maxCachedFunctions:
+        cachedFunctions.popitem(last=False)
+    return function
+
+# Works like CompiledCircuit: load() copies the states in, step() runs ticks and store() copies
+# them back out.  Timers' delay lines are shared rather than copied, so they're always up to date.
+class GeneratedCircuit:
+    def __init__(self, interactables: List[Interactable], cacheFolder: str = None):
+        self.interactables = list(interactables)
+        self.function = stepFunction(self.interactables, cacheFolder)
+        self.load()
+
+    def load(self):
+        self.states = [x.currentState for x in self.interactables]
+        self.prevStates = [x.prevState for x in self.interactables]
+        self.delayLines = [x.delayLine for x in self.interactables if isinstance(x, Timer)]
+
+    def step(self, ticks: int = 1):
+        result = self.function(self.states, self.delayLines, ticks)
+        if result is not None:
+            self.states, self.prevStates = result
+
+    def store(self):
+        for x, current, previous in zip(self.interactables, self.states, self.prevStates):
+            x.currentState = current
+            x.prevState = previous
+
+# A drop-in replacement for EventDrivenSimulator that uses a generated step function.  Call
+# invalidate() after changing anything; the next step makes (or finds) the function for the
+# circuit as it is then.
+class GeneratedSimulator:
+    def __init__(self, interactables: List[Interactable], cacheFolder: str = None):
+        # Keeps the list itself, so it sees blocks being added and removed
+        self.interactables = interactables
+        self.cacheFolder = cacheFolder
+        self.invalidate()
+
+    def invalidate(self):
+        self.circuit = None
+
+    def markChanged(self, interactable: Interactable):
+        self.invalidate()
+
+    # Any edit means a different function, so these are the same as invalidate()
+    def touched(self, interactables: Iterable[Interactable]):
+        self.invalidate()
+
+    def removed(self, interactable: Interactable):
+        self.invalidate()
+
+    # The generated code runs every block, so there's no telling which ones changed
+    def changedLastTick(self):
+        return None
+
+    def step(self, ticks: int = 1):
+        if self.circuit is None:
+            self.circuit = GeneratedCircuit(self.interactables, self.cacheFolder)
+        self.circuit.step(ticks)
+        self.circuit.store()
@@ -0,0 +1,147 @@
+# An event-driven way of running the simulation.  singleStep calls apply() and calculate() on
+# every interactable on every tick, but most circuits are pretty quiet - after a few ticks, only
+# a clock and a handful of gates are actually changing.  This keeps track of which interactables
+# might change on the next tick and only touches those, so a tick costs time in proportion to
+# how much is going on rather than how big the circuit is.
+#
+# It's tick-for-tick identical to singleStep.  The trick is that, after a tick, every gate and
+# input has currentState == prevState unless it's in the 'changed' set.  So on the next tick,
+# those are the only ones whose apply() does anything and the only ones whose outputs can
+# affect a calculate().  Timers are the exception because they shift on every tick whether
+# their input is doing anything or not, so they're active until their storage is all the same.
+# Timers can be very long, so rather than looking at the whole delay line to see if that's
+# happened, this keeps track of how many slots at the front of each one are the same as slot 0.
+#
+# What a block feeds into comes from its 'outputs', which link() and unlink() keep up to date, so
+# an edit only has to tell the simulator which blocks it touched (see touched() and removed())
+# rather than making it start over.
+from typing import List
+from model import Timer, singleStep
+
+def isTimer(interactable) -> bool:
+    return isinstance(interactable, Timer)
+
+# The number of slots at the start of the timer's delay line that match the first one
+def leadingRun(timer: Timer) -> int:
+    run = 0
+    first = timer.delayLine[0]
+    for slot in timer.delayLine:
+        if slot != first:
+            break
+        run += 1
+    return run
+
+class EventDrivenSimulator:
+    def __init__(self, interactables: List):
+        # Note that this keeps the list itself, not a copy, so it sees blocks added or removed
+        # from it, so long as invalidate() gets called afterwards.
+        self.interactables = interactables
+        self.invalidate()
+
+    # Call this after anything changes the wiring or when you're not sure what changed.  The
+    # next step will do a full tick and rebuild the bookkeeping.
+    def invalidate(self):
+        self.started = False
+        self.changed = set()
+        self.activeTimers = set()
+        self.pending = set() # blocks that need calculating on the next tick whatever their inputs do
+        self.timerRuns = {}
+        self.lastChanged = None
+
+    # The blocks the last tick applied or calculated, which are the only ones it can have changed,
+    # or None if it was a full tick.  Don't change the set; it belongs to the simulator.
+    def changedLastTick(self):
+        return self.lastChanged
+
+    # Call this after changing the state of an interactable outside of a tick, e.g. flipping an input.
+    def markChanged(self, interactable):
+        if not self.started:
+            return
+        if isTimer(interactable):
+            self.activeTimers.add(interactable)
+            self.timerRuns[id(interactable)] = leadingRun(interactable)
+        else:
+            self.changed.add(interactable)
+
+    # Call this after editing some blocks: adding them, rewiring them, changing their kind or their
+    # state.  They get applied and calculated on the next tick, and so does whatever their new
+    # states feed into, so nothing else needs looking at.
+    def touched(self, interactables):
+        if not self.started:
+            return
+        for x in interactables:
+            self.markChanged(x)
+            self.pending.add(x)
+
+    # Call this after taking a block out of the circuit (and out of the list).  Whatever it was
+    # wired into needs to be passed to touched() too.
+    def removed(self, interactable):
+        self.changed.discard(interactable)
+        self.activeTimers.discard(interactable)
+        self.pending.discard(interactable)
+        self.timerRuns.pop(id(interactable), None)
+
+    def fullStep(self):
+        singleStep(self.interactables)
+        self.started = True
+        self.lastChanged = None
+        self.pending = set()
+        self.changed = set(x for x in self.interactables if x.currentState != x.prevState and not isTimer(x))
+        self.timerRuns = {}
+        self.activeTimers = set()
+        for x in self.interactables:
+            if isTimer(x):
+                self.timerRuns[id(x)] = leadingRun(x)
+                if not self.isQuiescentTimer(x):
+                    self.activeTimers.add(x)
+
+    # Note that a 0-tick timer only has one slot, so its output can lag behind its storage
+    def isQuiescentTimer(self, timer: Timer) -> bool:
+        return timer.currentState == timer.prevState \
+            and timer.currentState == timer.delayLine[-1] \
+            and self.timerRuns[id(timer)] == len(timer.delayLine)
+
+    # Called after a timer has been applied and calculated
+    def updateTimerRun(self, timer: Timer):
+        delayLine = timer.delayLine
+        if len(delayLine) > 1 and delayLine[0] != delayLine[1]:
+            self.timerRuns[id(timer)] = 1
+        else:
+            self.timerRuns[id(timer)] = min(self.timerRuns[id(timer)] + 1, len(delayLine))
+
+    def step(self, ticks: int = 1):
+        for _ in range(ticks):
+            if not self.started:
+                self.fullStep()
+                continue
+
+            # apply
+            toggled = []
+            for x in self.changed:
+                if x.prevState != x.currentState:
+                    toggled.append(x)
+                x.apply()
+            for x in self.activeTimers:
+                if x.prevState != x.currentState:
+                    toggled.append(x)
+                x.apply()
+
+            # calculate
+            dirty = self.activeTimers | self.pending
+            self.pending = set()
+            for x in toggled:
+                dirty.update(x.outputs)
+            changed = set()
+            activeTimers = set()
+            for x in dirty:
+                x.calculate()
+                if isTimer(x):
+                    self.updateTimerRun(x)
+                    if not self.isQuiescentTimer(x):
+                        activeTimers.add(x)
+                elif x.currentState != x.prevState:
+                    changed.add(x)
+            self.changed = changed
+            self.activeTimers = activeTimers
+            dirty.update(toggled)
+            self.lastChanged = dirty
@@ -0,0 +1,53 @@
+# Jumps a circuit ahead to a far-off tick without simulating every tick in between.
+#
+# Nearly every circuit either settles down or falls into a repeating pattern (like a timer
+# loop) within a few hundred ticks.  Since the simulation is deterministic, once the complete
+# state of the circuit repeats, it's going to go around that same loop forever.  So this
+# simulates until it sees a repeat, then uses the length of the loop to skip all the laps of it
+# that fit before the tick we're asked for and simulates the rest.
+#
+# This assumes nothing changes the circuit from the outside while it runs, e.g. inputs being
+# flipped.
+import hashlib
+from typing import List
+from model import Interactable, snapshot
+from eventsim import EventDrivenSimulator
+from subcircuit import HierarchicalSimulator
+
+class FastForwardResult:
+    def __init__(self, ticks: int, simulatedTicks: int, transient: int, period: int):
+        self.ticks = ticks # The tick that the circuit is now at
+        self.simulatedTicks = simulatedTicks # How many ticks were actually simulated to get there
+        self.transient = transient # The tick at which the loop starts, None if it never repeated
+        self.period = period # The length of the loop; 1 means it settled down.  None if it never repeated
+
+digestSize = 16
+entryBytes = 64 + digestSize # roughly what an entry in the dict of seen states takes
+
+def digestOf(interactables: List[Interactable]) -> bytes:
+    return hashlib.blake2b(snapshot(interactables), digest_size=digestSize).digest()
+
+# Advances the circuit by the given number of ticks.  Each tick's state is remembered as a
+# fixed-size hash rather than a copy, and maxBytes caps how much memory those take; if the circuit
+# goes that long without repeating, it just falls back to simulating the rest of the ticks one
+# at a time.
+def fastForward(interactables: List[Interactable], ticks: int, maxBytes: int = 16*1024*1024) -> FastForwardResult:
+    simulator = HierarchicalSimulator(interactables, EventDrivenSimulator)
+    seen = {digestOf(interactables): 0} # hash of the state => the tick it was seen on
+    bytesUsed = entryBytes
+    for tick in range(1, ticks + 1):
+        simulator.step()
+        if bytesUsed > maxBytes:
+            continue
+        digest = digestOf(interactables)
+        if digest in seen:
+            transient = seen[digest]
+            period = tick - transient
+            # We're back where we were at 'transient', so going round the loop again gets us
+            # to the same place; only the part of a loop that's left over needs simulating
+            remaining = (ticks - tick) % period
+            simulator.step(remaining)
+            return FastForwardResult(ticks, tick + remaining, transient, period)
+        seen[digest] = tick
+        bytesUsed += entryBytes
+    return FastForwardResult(ticks, ticks, None, None)
@@ -0,0 +1,182 @@
+# Runs a circuit without the pygame window, e.g. for regression tests:
+#
+#   python3 headless.py mycircuit.json --reload --ticks 100
+#
+# loads mycircuit.json, simulates a reload, runs 100 ticks and prints the state of every block.
+# It only needs the model, so it doesn't need pygame or a display and it starts up in a few
+# milliseconds.
+import argparse
+import json
+import sys
+from typing import List
+from model import Interactable, reload, putOnLift, singleStep, loadCircuit, saveCircuit
+from eventsim import EventDrivenSimulator
+from fastforward import fastForward
+from profiler import Profiler
+from vcd import traceSteps
+from optimizer import OptimizedCircuit
+from codegen import GeneratedCircuit, GeneratedSimulator, userCacheFolder
+from subcircuit import Instance, FlatCircuit, hasSubcircuits
+
+# Generated code is cached here; None turns the disk cache off
+generatedCodeFolder = userCacheFolder()
+
+engines = ["event", "classic", "compiled", "generated"]
+
+# The classic engine runs subcircuits as they are; the others get a flattened copy of the circuit.
+def simulate(interactables: List[Interactable], ticks: int, engine: str = "event"):
+    if engine != "classic" and hasSubcircuits(interactables):
+        flat = FlatCircuit(interactables)
+        simulate(flat.netlist, ticks, engine)
+        flat.store()
+    elif engine == "classic":
+        for _ in range(ticks):
+            singleStep(interactables)
+    elif engine == "event":
+        EventDrivenSimulator(interactables).step(ticks)
+    elif engine == "compiled":
+        # numpy is only needed for this engine, so don't make everybody pay for loading it
+        from compiled import CompiledCircuit
+        circuit = CompiledCircuit(interactables)
+        circuit.step(ticks)
+        circuit.store()
+    elif engine == "generated":
+        circuit = GeneratedCircuit(interactables, generatedCodeFolder)
+        circuit.step(ticks)
+        circuit.store()
+    else:
+        raise ValueError("Unknown engine: " + engine)
+
+# Returns a function that runs one tick with the given engine and leaves the interactables
+# up to date, for when something needs to look at every tick.
+def tickFunction(interactables: List[Interactable], engine: str = "event"):
+    if engine != "classic" and hasSubcircuits(interactables):
+        flat = FlatCircuit(interactables)
+        stepNetlist = tickFunction(flat.netlist, engine)
+        def step():
+            stepNetlist()
+            flat.store()
+        return step
+    elif engine == "classic":
+        return lambda: singleStep(interactables)
+    elif engine == "event":
+        return EventDrivenSimulator(interactables).step
+    elif engine == "compiled":
+        from compiled import CompiledCircuit
+        circuit = CompiledCircuit(interactables)
+        def step():
+            circuit.step(1)
+            circuit.store()
+        return step
+    elif engine == "generated":
+        return GeneratedSimulator(interactables, generatedCodeFolder).step
+    else:
+        raise ValueError("Unknown engine: " + engine)
+
+def optimize(interactables: List[Interactable], observed: List[Interactable] = None) -> OptimizedCircuit:
+    circuit = OptimizedCircuit(interactables, observed)
+    stats = circuit.stats
+    sys.stderr.write("Simulating {0} of {1} blocks ({2} constant, {3} duplicates, {4} unused, {5} buffers in {6} timers)\n".format(
+        stats['simulated'], stats['blocks'], stats['constants'], stats['merged'], stats['removed'], stats['buffers'], stats['chains']))
+    return circuit
+
+def describeState(index: int, i: Interactable) -> dict:
+    state = {
+        'index': index,
+        'kind': i.kind,
+        'currentState': i.currentState,
+        'prevState': i.prevState
+    }
+    if hasattr(i, 'timerTickStorage'):
+        state['timerTickStorage'] = list(i.timerTickStorage)
+    if isinstance(i, Instance):
+        state['definition'] = i.definition.name
+        state['outputs'] = {port.name: port.currentState for port in i.ports}
+    return state
+
+def describeStates(interactables: List[Interactable]) -> List[dict]:
+    return [describeState(index, i) for index, i in enumerate(interactables)]
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Runs a Scrap Mechanic logic circuit without the UI and reports the final states.")
+    parser.add_argument("circuit", help="the circuit file, as saved by smlogic.py (JSON or binary)")
+    parser.add_argument("--ticks", type=int, default=0, help="the number of ticks to run")
+    event = parser.add_mutually_exclusive_group()
+    event.add_argument("--reload", action="store_true", help="simulate unloading and re-loading before running")
+    event.add_argument("--lift", action="store_true", help="simulate putting the build on the lift before running")
+    parser.add_argument("--engine", choices=engines, default="event", help="the simulation engine to use")
+    parser.add_argument("--fast-forward", action="store_true", help="skip ahead once the circuit starts repeating itself (ignores --engine)")
+    parser.add_argument("--profile", metavar="FILE", help="count how often each block toggles and time each part of the ticks, and write it to FILE (CSV if it ends in .csv, JSON otherwise; ignores --engine)")
+    parser.add_argument("--vcd", metavar="FILE", help="write a waveform of the probes' states on every tick to FILE, in VCD format")
+    parser.add_argument("--probe-all", action="store_true", help="with --vcd, trace every block, not just the ones marked as probes")
+    parser.add_argument("--optimize", action="store_true", help="simulate a reduced copy of the circuit (constants folded, duplicates merged, buffer chains turned into timers); with --vcd, blocks that aren't traced and don't affect the trace are left out, so their final states aren't updated")
+    parser.add_argument("--json", action="store_true", help="write the final states as JSON rather than text")
+    parser.add_argument("--save", metavar="FILE", help="also save the resulting circuit to FILE (binary if it ends in .smlb)")
+    args = parser.parse_args(argv)
+
+    interactables = loadCircuit(args.circuit)
+
+    if args.reload:
+        reload(interactables)
+    elif args.lift:
+        putOnLift(interactables)
+
+    # The optimizer only knows about plain blocks, so subcircuits get flattened first
+    flat = FlatCircuit(interactables) if args.optimize and hasSubcircuits(interactables) else None
+    def storeOptimized(circuit: OptimizedCircuit):
+        circuit.store()
+        if flat is not None:
+            flat.store()
+
+    if args.fast_forward:
+        result = fastForward(interactables, args.ticks)
+        if result.period is None:
+            sys.stderr.write("No repeating state found after {0} ticks\n".format(result.simulatedTicks))
+        else:
+            sys.stderr.write("Repeats every {0} ticks starting at tick {1}; simulated {2} ticks\n".format(result.period, result.transient, result.simulatedTicks))
+    elif args.profile is not None:
+        profiler = Profiler(interactables)
+        profiler.step(args.ticks)
+        profiler.save(args.profile)
+    elif args.vcd is not None:
+        probes = list(interactables) if args.probe_all else [i for i in interactables if i.probe] or list(interactables)
+        if args.optimize:
+            if flat is None:
+                circuit = optimize(interactables, probes)
+            else:
+                circuit = optimize(flat.netlist, [flat.standIn(source) for probe in probes for source in probe.sources()])
+            stepNetlist = tickFunction(circuit.netlist, args.engine)
+            def step():
+                stepNetlist()
+                circuit.ticks += 1
+                storeOptimized(circuit)
+        else:
+            step = tickFunction(interactables, args.engine)
+        with open(args.vcd, 'w') as file:
+            traceSteps(file, interactables, args.ticks, step, probes)
+    elif args.optimize:
+        circuit = optimize(interactables if flat is None else flat.netlist)
+        simulate(circuit.netlist, args.ticks, args.engine)
+        circuit.ticks += args.ticks
+        storeOptimized(circuit)
+    else:
+        simulate(interactables, args.ticks, args.engine)
+
+    states = describeStates(interactables)
+    if args.json:
+        json.dump(states, sys.stdout, indent=4)
+        sys.stdout.write("\n")
+    else:
+        for state in states:
+            if 'outputs' in state:
+                outputs = " ".join("{0}={1}".format(name, "on" if on else "off") for name, on in state['outputs'].items())
+                sys.stdout.write("{0} {1} {2}\n".format(state['index'], state['definition'], outputs))
+            else:
+                sys.stdout.write("{0} {1} {2}\n".format(state['index'], state['kind'], "on" if state['currentState'] else "off"))
+
+    if args.save is not None:
+        saveCircuit(args.save, interactables)
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+# Remembers what happened on each tick so the simulation can be run backwards.
+#
+# Keeping a copy of the whole circuit for every tick would eat memory fast, so instead this
+# records what changed on each tick: the blocks whose state changed (with the before and after
+# values) and, for each timer that shifted, the bit that fell off the end of its delay line and
+# the bit that went in the front.  Subcircuits keep their state in a vector (see subcircuit.py), so for
+# those it keeps the vector from before and after the tick if it changed.  That's enough to step
+# forwards and backwards one tick at a time.  Every so often it also keeps a full snapshot (a
+# checkpoint), so that seeking a long way goes from the nearest checkpoint rather than walking
+# through every tick.  When it goes over its memory budget, the oldest ticks are forgotten.
+#
+# Looking at every block after every tick would make recording cost as much as a full tick, so
+# step() can be told which blocks the simulator touched (EventDrivenSimulator's changedLastTick),
+# and then only those get compared.  Without that, it compares everything.
+#
+# Anything that changes the shape of the circuit (adding, removing or linking blocks, changing
+# a gate or timer, reloading...) makes the recorded deltas meaningless, so they have to be
+# forgotten.  For an edit, touched() and removed() do that and only update the copies of the
+# blocks that were edited; after anything bigger (reloading, a tick that wasn't recorded...), call
+# clear(), which reads the whole circuit again.  Flipping inputs between ticks is fine; that gets
+# recorded along with the next tick.
+from collections import deque
+from array import array
+from typing import Callable, Iterable, List, Optional
+from model import Interactable, Timer, BlockPositions, snapshot, restore
+from subcircuit import Instance
+
+class TickDelta:
+    def __init__(self, indices: array, before: bytes, after: bytes, timerIndices: array, timerBits: bytes, vectors: list):
+        self.indices = indices # the interactables whose state changed
+        self.before = before # their state before the tick, packed as currentState | prevState << 1
+        self.after = after # and after it
+        self.timerIndices = timerIndices # the timers that shifted, as indices into TickHistory.timers
+        self.timerBits = timerBits # for each of those: bit 0 is the slot that fell off the end, bit 1 the slot that went in
+        self.vectors = vectors # (instance, vector before, vector after) for the subcircuits that changed
+
+    def size(self) -> int:
+        return 64 + len(self.indices) * self.indices.itemsize + len(self.before) + len(self.after) \
+            + len(self.timerIndices) * self.timerIndices.itemsize + len(self.timerBits) \
+            + sum(64 + len(before) + len(after) for instance, before, after in self.vectors)
+
+def packState(interactable: Interactable) -> int:
+    return interactable.currentState | (interactable.prevState << 1)
+
+class TickHistory:
+    def __init__(self, interactables: List[Interactable], maxBytes: int = 64*1024*1024, checkpointInterval: int = 1000, tick: int = 0):
+        self.interactables = interactables
+        self.maxBytes = maxBytes
+        self.checkpointInterval = checkpointInterval
+        self.clear(tick)
+
+    # Forgets everything and starts recording from the circuit's current state.
+    def clear(self, tick: int = 0):
+        self.positions = BlockPositions(self.interactables)
+        self.timers = [x for x in self.interactables if isinstance(x, Timer)]
+        self.timerIndexOf = {id(x): index for index, x in enumerate(self.timers)}
+        self.instances = [x for x in self.interactables if isinstance(x, Instance)]
+        self.instanceIndexOf = {id(x): index for index, x in enumerate(self.instances)}
+        self.current = bytearray() # the blocks' packed states, as of self.tick
+        self.ends = bytearray() # the last slot of each timer's delay line, which the next shift drops
+        self.vectors = [] # a copy of each instance's vector
+        self.refresh()
+        self.deltas = deque()
+        self.firstTick = tick # the tick before deltas[0]
+        self.tick = tick
+        self.checkpoints = {tick: snapshot(self.interactables)}
+        self.bytesUsed = len(self.checkpoints[tick])
+
+    # Forgets the recorded ticks, but not the copies of the current state
+    def forget(self):
+        self.deltas.clear()
+        self.firstTick = self.tick
+        self.checkpoints = {}
+        self.bytesUsed = 0
+
+    # Call after editing some blocks: adding them (at the end of the list, in this order),
+    # rewiring them or changing their kind or state.  The history starts again from here.
+    def touched(self, interactables: Iterable[Interactable]):
+        self.forget()
+        for x in interactables:
+            if id(x) not in self.positions.slots:
+                self.positions.added(x)
+                self.current.append(packState(x))
+                if isinstance(x, Timer):
+                    self.timerIndexOf[id(x)] = len(self.timers)
+                    self.timers.append(x)
+                    self.ends.append(x.delayLine[-1])
+                elif isinstance(x, Instance):
+                    self.instanceIndexOf[id(x)] = len(self.instances)
+                    self.instances.append(x)
+                    self.vectors.append(bytes(x.state))
+            else:
+                self.current[self.positions.find(x)] = packState(x)
+                if isinstance(x, Timer):
+                    self.ends[self.timerIndexOf[id(x)]] = x.delayLine[-1]
+                elif isinstance(x, Instance):
+                    self.vectors[self.instanceIndexOf[id(x)]] = bytes(x.state)
+
+    # Call after deleting a block from the list.  The history starts again from here.
+    def removed(self, interactable: Interactable):
+        self.forget()
+        del self.current[self.positions.find(interactable)]
+        self.positions.removed(interactable)
+        # The order of the timers and subcircuits is only ours, so the last one fills the gap
+        if isinstance(interactable, Timer):
+            index = self.timerIndexOf.pop(id(interactable))
+            self.timers[index] = self.timers[-1]
+            self.timers.pop()
+            self.ends[index] = self.ends[-1]
+            self.ends.pop()
+            if index < len(self.timers):
+                self.timerIndexOf[id(self.timers[index])] = index
+        elif isinstance(interactable, Instance):
+            index = self.instanceIndexOf.pop(id(interactable))
+            self.instances[index] = self.instances[-1]
+            self.instances.pop()
+            self.vectors[index] = self.vectors[-1]
+            self.vectors.pop()
+            if index < len(self.instances):
+                self.instanceIndexOf[id(self.instances[index])] = index
+
+    # Re-reads the copies of the circuit's state, after it's been put back to a checkpoint
+    def refresh(self):
+        self.current = bytearray(packState(x) for x in self.interactables)
+        self.ends = bytearray(timer.delayLine[-1] for timer in self.timers)
+        self.vectors = [bytes(instance.state) for instance in self.instances]
+
+    @property
+    def lastTick(self) -> int:
+        return self.firstTick + len(self.deltas)
+
+    # Runs stepFunction (which should advance the circuit by one tick) and records what it did.
+    # changedBlocks, if given, is called afterwards for the blocks that tick could have changed,
+    # and may return None if it doesn't know.  If we'd stepped back, the ticks we'd stepped back
+    # over are forgotten.
+    def step(self, stepFunction: Callable[[], None], changedBlocks: Callable[[], Optional[Iterable[Interactable]]] = None):
+        if self.tick < self.lastTick:
+            self.truncate()
+        stepFunction()
+        candidates = changedBlocks() if changedBlocks is not None else None
+
+        if candidates is None:
+            indices = range(len(self.interactables))
+            timerIndices = range(len(self.timers))
+            instanceIndices = range(len(self.instances))
+        else:
+            indices = []
+            timerIndices = []
+            instanceIndices = []
+            for x in candidates:
+                indices.append(self.positions.find(x))
+                if id(x) in self.timerIndexOf:
+                    timerIndices.append(self.timerIndexOf[id(x)])
+                elif id(x) in self.instanceIndexOf:
+                    instanceIndices.append(self.instanceIndexOf[id(x)])
+
+        changed = array('I')
+        before = bytearray()
+        after = bytearray()
+        for index in indices:
+            state = packState(self.interactables[index])
+            if state != self.current[index]:
+                changed.append(index)
+                before.append(self.current[index])
+                after.append(state)
+                self.current[index] = state
+        timerBits = bytearray()
+        for index in timerIndices:
+            delayLine = self.timers[index].delayLine
+            timerBits.append(self.ends[index] | (delayLine[0] << 1))
+            self.ends[index] = delayLine[-1]
+        vectors = []
+        for index in instanceIndices:
+            instance = self.instances[index]
+            if instance.state != self.vectors[index]:
+                vectors.append((instance, self.vectors[index], bytes(instance.state)))
+                self.vectors[index] = vectors[-1][2]
+
+        delta = TickDelta(changed, bytes(before), bytes(after), array('I', timerIndices), bytes(timerBits), vectors)
+        self.deltas.append(delta)
+        self.bytesUsed += delta.size()
+        self.tick += 1
+        if self.tick % self.checkpointInterval == 0:
+            self.checkpoints[self.tick] = snapshot(self.interactables)
+            self.bytesUsed += len(self.checkpoints[self.tick])
+        self.evict()
+
+    # Forgets the ticks after the current one.
+    def truncate(self):
+        while self.lastTick > self.tick:
+            self.bytesUsed -= self.deltas.pop().size()
+        for tick in [tick for tick in self.checkpoints.keys() if tick > self.tick]:
+            self.bytesUsed -= len(self.checkpoints.pop(tick))
+
+    # Forgets the oldest ticks until we're under budget, but always keeps the current one.
+    def evict(self):
+        while self.bytesUsed > self.maxBytes and self.firstTick < self.tick:
+            self.bytesUsed -= self.deltas.popleft().size()
+            self.firstTick += 1
+            for tick in [tick for tick in self.checkpoints.keys() if tick < self.firstTick]:
+                self.bytesUsed -= len(self.checkpoints.pop(tick))
+
+    def backwardOne(self):
+        delta = self.deltas[self.tick - 1 - self.firstTick]
+        for index, state in zip(delta.indices, delta.before):
+            x = self.interactables[index]
+            x.currentState = state & 1 == 1
+            x.prevState = state & 2 == 2
+            self.current[index] = state
+        for index, bits in zip(delta.timerIndices, delta.timerBits):
+            delayLine = self.timers[index].delayLine
+            delayLine.popleft()
+            delayLine.append(bits & 1 == 1)
+            self.ends[index] = bits & 1
+        for instance, before, after in delta.vectors:
+            instance.state[:] = before
+            self.vectors[self.instanceIndexOf[id(instance)]] = before
+        self.tick -= 1
+
+    def forwardOne(self):
+        delta = self.deltas[self.tick - self.firstTick]
+        for index, state in zip(delta.indices, delta.after):
+            x = self.interactables[index]
+            x.currentState = state & 1 == 1
+            x.prevState = state & 2 == 2
+            self.current[index] = state
+        for index, bits in zip(delta.timerIndices, delta.timerBits):
+            delayLine = self.timers[index].delayLine
+            delayLine.appendleft(bits & 2 == 2)
+            self.ends[index] = delayLine[-1]
+        for instance, before, after in delta.vectors:
+            instance.state[:] = after
+            self.vectors[self.instanceIndexOf[id(instance)]] = after
+        self.tick += 1
+
+    # Steps back up to 'ticks' ticks; returns the number it actually went back.
+    def stepBack(self, ticks: int = 1) -> int:
+        start = self.tick
+        self.seek(max(self.firstTick, self.tick - ticks))
+        return start - self.tick
+
+    # Re-does ticks that were stepped back over; returns the number it actually went forward.
+    def stepForward(self, ticks: int = 1) -> int:
+        start = self.tick
+        self.seek(min(self.lastTick, self.tick + ticks))
+        return self.tick - start
+
+    # Puts the circuit back the way it was at the given tick, which must be between
+    # firstTick and lastTick.
+    def seek(self, tick: int):
+        if tick < self.firstTick or tick > self.lastTick:
+            raise ValueError("Tick {0} isn't in the history, which runs from {1} to {2}".format(tick, self.firstTick, self.lastTick))
+        # Start from a checkpoint if there's one that's closer than where we are now
+        nearest = min(self.checkpoints.keys(), key=lambda checkpoint: abs(checkpoint - tick), default=None)
+        if nearest is not None and abs(nearest - tick) < abs(self.tick - tick):
+            restore(self.interactables, self.checkpoints[nearest])
+            self.refresh()
+            self.tick = nearest
+        while self.tick > tick:
+            self.backwardOne()
+        while self.tick < tick:
+            self.forwardOne()
@@ -0,0 +1,483 @@
+# The simulation model - the interactables and what happens to them on a tick, a reload and so on.
+#
+# This deliberately doesn't import pygame or load any images; all of that lives in smlogic.py.
+# That way the model can be used for headless runs (see headless.py) and it loads in a few
+# milliseconds.
+import bisect
+import json
+import sys
+from collections import deque
+from typing import Iterable, List, Tuple
+
+def static_init(cls):
+    if getattr(cls, "static_init", None):
+        cls.static_init()
+    return cls
+
+# The interactables use __slots__ rather than a __dict__ each, which makes them about half the
+# size, and the kinds are interned so a million blocks share a handful of strings.  That matters
+# for circuits with millions of blocks.  Anything the UI needs to draw a block (rects, images) is
+# made when it's drawn, in smlogic.py, and never stored here.
+class Interactable:
+    __slots__ = ('kind', 'currentState', 'prevState', 'inputs', 'outputs', 'selected', 'probe', 'x', 'y', 'maxInputCount')
+    kindToTypeMap: dict = {}
+    size = 64 # All the images are 64x64
+
+    def __init__(self, kind: str, pos: Tuple[float,float]):
+        self.kind = sys.intern(kind)
+        self.currentState = False
+        self.prevState = False
+        self.inputs = [] # what's wired into this, in order
+        self.outputs = set() # what this is wired into; link and unlink keep it in step with the inputs
+        self.selected = False
+        self.probe = False # whether its state gets written to waveform traces; see vcd.py
+        self.x = int(pos[0]) # the center of the block
+        self.y = int(pos[1])
+        self.maxInputCount = -1
+
+    def loadState(self, state: dict):
+        self.probe = state.get('probe', False)
+
+    def saveState(self) -> dict:
+        state = {
+            'kind': self.kind,
+            'x': self.x,
+            'y': self.y
+        }
+        # Only written when it's set, so files without probes look just like they always did
+        if self.probe:
+            state['probe'] = True
+        return state
+
+    # returns true if pos is inside the drawn area of this thing
+    def containsPosition(self, pos):
+        half = Interactable.size // 2
+        return self.x - half <= pos[0] < self.x + half and self.y - half <= pos[1] < self.y + half
+
+    def move(self, pos):
+        self.x += pos[0]
+        self.y += pos[1]
+
+    def apply(self):
+        self.prevState = self.currentState
+
+    # Appends everything that affects what this does on the following ticks to buffer.
+    # See snapshot() below.
+    def saveSimulationState(self, buffer: bytearray):
+        buffer.append(self.currentState | (self.prevState << 1))
+
+    # The reverse of saveSimulationState; returns the offset just past what it read.
+    def loadSimulationState(self, buffer: bytes, offset: int) -> int:
+        self.currentState = buffer[offset] & 1 == 1
+        self.prevState = buffer[offset] & 2 == 2
+        return offset + 1
+
+    # What other blocks' inputs hold when they're wired from this one
+    def sources(self) -> list:
+        return [self]
+
+    def swapGate(self, dir: int): pass
+
+    def alternate(self): pass
+
+    def reload(self): pass
+
+    def putOnLift(self): pass
+
+    def paint(self): pass
+
+    def inputsChanged(self):
+        self.calculate()
+
+    def calculate(self): pass
+
+# LogicGate and Input both have a notion of a singled bit of saved state (either on or off).
+# This class consolodates that logic.
+class InteractableWithSingleBitSavedState(Interactable):
+    __slots__ = ('savedState',)
+
+    def __init__(self, kind: str, pos: Tuple[float,float]):
+        super().__init__(kind, pos)
+        self.savedState = False
+
+    #override
+    def saveState(self) -> dict:
+        state = super().saveState()
+        state['savedState'] = self.savedState
+        return state
+
+    # We don't offer an implementation of loadState because there are some backwards-compat
+    # shenanigans in Input, so we need specialized implementations in both subclasses
+
+    #override
+    def paint(self):
+        self.savedState = self.currentState
+
+@static_init
+class LogicGate(InteractableWithSingleBitSavedState):
+    __slots__ = ()
+    gates = ["and", "or", "xor", "nand", "nor", "xnor"]
+
+    # i = #inputs, a = #activatedInputs => bool
+    functions = {
+        "and": lambda i, a: i > 0 and i == a,
+        "or": lambda i, a: a > 0,
+        "xor": lambda i, a: a % 2 == 1,
+        "nand": lambda i, a: i > 0 and i != a,
+        "nor": lambda i, a: i > 0 and a == 0,
+        "xnor": lambda i, a: i > 0 and a % 2 == 0
+    }
+
+    @classmethod
+    def static_init(cls):
+        for gate in cls.gates:
+            Interactable.kindToTypeMap[gate] = cls
+
+    def __init__(self, kind: str, pos: Tuple[float,float]):
+        super().__init__(kind, pos)
+        self.maxInputCount = -1
+
+    #override
+    def loadState(self, serialized: dict):
+        super().loadState(serialized)
+        self.savedState = serialized['savedState'] if 'savedState' in serialized else False
+        self.currentState = self.savedState
+        self.prevState = False
+
+    #override
+    def calculate(self):
+        activatedInputs = sum([input.prevState for input in self.inputs])
+        self.currentState = LogicGate.functions[self.kind](len(self.inputs), activatedInputs)
+
+    #override
+    def inputsChanged(self):
+        self.calculate()
+
+    #override
+    def reload(self):
+        self.currentState = self.savedState
+        self.prevState = False
+
+    #override
+    def putOnLift(self):
+        self.currentState = len(self.inputs) > 0 and self.kind in ("nand", "nor", "xnor")
+        self.prevState = False
+        self.savedState = self.currentState
+
+    #override
+    def swapGate(self, dir: int):
+        i = LogicGate.gates.index(self.kind)
+        self.kind = LogicGate.gates[((i + dir) % 3) + (i - (i % 3))]
+        self.calculate()
+        self.savedState = self.currentState
+
+    #override
+    def alternate(self):
+        i = LogicGate.gates.index(self.kind)
+        self.kind = LogicGate.gates[(i + 3) % 6]
+        self.calculate()
+        self.savedState = self.currentState
+
+@static_init
+class Input(InteractableWithSingleBitSavedState):
+    __slots__ = ()
+
+    def __init__(self, kind: str, pos: Tuple[float,float]):
+        super().__init__("input", pos)
+        self.maxInputCount = 0
+        self.savedState = kind == "input-on" # input-on is for backwards compatability
+        self.currentState = self.savedState
+        self.prevState = False
+
+    @classmethod
+    def static_init(cls):
+        Interactable.kindToTypeMap['input-off'] = cls # input-off is for backwards compatability
+        Interactable.kindToTypeMap['input-on'] = cls # input-on is for backwards compatability
+        Interactable.kindToTypeMap['input'] = cls
+
+    #override
+    def loadState(self, serialized: dict):
+        super().loadState(serialized)
+        if 'savedState' in serialized:
+            # it's the modern style
+            self.savedState = serialized['savedState']
+        # else it should have been set in the constructor because 'kind' was input-on or off.
+        self.currentState = self.savedState
+        self.prevState = False
+
+    #override
+    def calculate(self):
+        pass # It just is what it is
+
+    def reload(self):
+        self.currentState = self.savedState
+        self.prevState = False
+
+    def putOnLift(self):
+        self.savedState = False
+        self.currentState = False
+        self.prevState = False
+
+    #override
+    def alternate(self):
+        self.currentState = not self.currentState
+
+    #override
+    def swapGate(self, dir: int):
+        self.currentState = not self.currentState
+
+# Timers hold a delay line with one slot per tick of delay, plus one more.  (A 9-tick timer, which
+# is what 'timer10' is, has 10 slots - every interactable has a 1-tick delay on top of the one
+# it's set for.)  Slot 0 is where the input goes in and the last slot is the output.  Timers can
+# be thousands of ticks long, so the slots are in a deque, which makes shifting everything along
+# by one a constant-time operation.
+@static_init
+class Timer(Interactable):
+    __slots__ = ('delayLine',)
+    ticksPerSecond = 40
+    legacyDelay = 9 # The delay of a 'timer10', which is all the simulator used to support
+
+    def __init__(self, kind: str, pos: Tuple[float,float]):
+        super().__init__(kind, pos)
+        self.delayLine = deque([False]*(Timer.legacyDelay + 1), maxlen=Timer.legacyDelay + 1)
+        self.maxInputCount = 1
+
+    # The delay of the timer in ticks, the same as in the game - seconds*40 + ticks.
+    @property
+    def delay(self) -> int:
+        return self.delayLine.maxlen - 1
+
+    # Changes the length of the timer.  If it gets shorter, whatever is at the far end falls off;
+    # if it gets longer, it's filled with False at the far end.
+    def setDelay(self, delay: int):
+        delay = max(0, delay)
+        self.delayLine = deque(list(self.delayLine)[:delay + 1] + [False]*(delay + 1 - len(self.delayLine)), maxlen=delay + 1)
+        self.kind = 'timer10' if delay == Timer.legacyDelay else 'timer'
+        self.currentState = self.delayLine[-1]
+
+    # The contents of the delay line as a list, slot 0 first.
+    @property
+    def timerTickStorage(self) -> List[bool]:
+        return list(self.delayLine)
+
+    @timerTickStorage.setter
+    def timerTickStorage(self, storage: List[bool]):
+        self.delayLine = deque(storage, maxlen=len(storage))
+
+    #override
+    def saveState(self) -> dict:
+        serialized = super().saveState()
+        if self.kind != 'timer10':
+            serialized['seconds'] = self.delay // Timer.ticksPerSecond
+            serialized['ticks'] = self.delay % Timer.ticksPerSecond
+        serialized['timerTickStorage'] = self.timerTickStorage
+        return serialized
+
+    #override
+    def loadState(self, serialized: dict):
+        super().loadState(serialized)
+        if self.kind == 'timer10':
+            delay = Timer.legacyDelay
+        else:
+            delay = serialized.get('seconds', 0) * Timer.ticksPerSecond + serialized.get('ticks', 0)
+        self.timerTickStorage = serialized['timerTickStorage'] if 'timerTickStorage' in serialized else [False]*(delay + 1)
+        self.setDelay(delay)
+        self.prevState = False
+
+    @classmethod
+    def static_init(cls):
+        Interactable.kindToTypeMap['timer10'] = cls
+        Interactable.kindToTypeMap['timer'] = cls
+
+    def calculate(self):
+        self.currentState = self.delayLine[-1]
+        self.delayLine[0] = len(self.inputs) > 0 and self.inputs[0].prevState
+
+    #override
+    def reload(self):
+        self.currentState = self.delayLine[-1]
+        self.prevState = False
+
+    #override
+    def putOnLift(self):
+        self.delayLine = deque([False]*self.delayLine.maxlen, maxlen=self.delayLine.maxlen)
+        self.currentState = False
+        self.prevState = False
+
+    #override
+    def swapGate(self, dir: int):
+        self.setDelay(self.delay + dir)
+
+    #override
+    def saveSimulationState(self, buffer: bytearray):
+        super().saveSimulationState(buffer)
+        buffer.extend(self.delayLine)
+
+    #override
+    def loadSimulationState(self, buffer: bytes, offset: int) -> int:
+        offset = super().loadSimulationState(buffer, offset)
+        length = self.delayLine.maxlen
+        self.delayLine = deque((b == 1 for b in buffer[offset:offset+length]), maxlen=length)
+        return offset + length
+
+    #override
+    def apply(self):
+        self.prevState = self.currentState
+        # The deque is full, so the last slot falls off the far end
+        self.delayLine.appendleft(self.delayLine[0])
+        self.currentState = self.delayLine[-1]
+
+def interactableFromDictionary(serialized: dict):
+    interactableType = Interactable.kindToTypeMap[serialized['kind']]
+    interactable = interactableType(serialized['kind'], (serialized['x'], serialized['y']))
+    interactable.loadState(serialized)
+    return interactable
+
+# Wiring.  Anything that changes inputs should go through these so that every block's outputs
+# stay right; each one only costs time in proportion to the number of wires at the blocks involved.
+def link(source, target: Interactable):
+    target.inputs.append(source)
+    source.outputs.add(target)
+
+def unlink(source, target: Interactable):
+    target.inputs.remove(source)
+    # The same block can be wired in more than once
+    if source not in target.inputs:
+        source.outputs.discard(target)
+
+def unlinkInputs(target: Interactable):
+    for source in target.inputs:
+        source.outputs.discard(target)
+    target.inputs.clear()
+
+# Takes out every wire going into or out of the block, e.g. before deleting it.  Returns the other
+# blocks it was wired into.
+def disconnect(interactable: Interactable) -> List[Interactable]:
+    consumers = []
+    for source in interactable.sources():
+        for consumer in source.outputs:
+            consumer.inputs[:] = [input for input in consumer.inputs if input is not source]
+            if consumer is not interactable:
+                consumers.append(consumer)
+        source.outputs.clear()
+    unlinkInputs(interactable)
+    return consumers
+
+# Where each block is in a list that blocks get appended to and deleted from, without looking
+# through the list and without renumbering every block after one that was deleted.  It remembers
+# each block's slot as of the last rebuild (new blocks get new slots at the end) and the slots
+# that have been deleted since, so a block's index is its slot less the deleted slots before it.
+class BlockPositions:
+    maxDeleted = 256 # deletions to put up with before starting again from the list
+
+    def __init__(self, interactables: List[Interactable]):
+        # Keeps the list itself, which whoever adds and deletes blocks changes first
+        self.interactables = interactables
+        self.rebuild()
+
+    def rebuild(self):
+        self.slots = {id(x): index for index, x in enumerate(self.interactables)}
+        self.slotCount = len(self.interactables)
+        self.deleted = [] # sorted
+
+    def find(self, interactable: Interactable) -> int:
+        slot = self.slots[id(interactable)]
+        return slot - bisect.bisect_left(self.deleted, slot)
+
+    # Call after appending a block to the list
+    def added(self, interactable: Interactable):
+        self.slots[id(interactable)] = self.slotCount
+        self.slotCount += 1
+
+    # Call after deleting a block from the list (get its index with find() first)
+    def removed(self, interactable: Interactable):
+        bisect.insort(self.deleted, self.slots.pop(id(interactable)))
+        if len(self.deleted) > BlockPositions.maxDeleted:
+            self.rebuild()
+
+def findItem(interactables, pos):
+    for i in interactables:
+        if i.containsPosition(pos):
+            return i
+    return None
+
+def singleStep(interactables: Iterable[Interactable]):
+    for i in interactables:
+        i.apply()
+    for i in interactables:
+        i.calculate()
+
+# Simulates an event like entering and coming back into Scrap Mechanic
+def reload(interactables: Iterable[Interactable]):
+    for i in interactables:
+        i.reload()
+
+def putOnLift(interactables: Iterable[Interactable]):
+    for i in interactables:
+        i.putOnLift()
+
+# Captures the simulation state (but not the saved state or the layout) of every interactable.
+# Two snapshots of the same circuit are equal exactly when the circuit will behave the same
+# from then on, so they can be hashed and compared to spot repeating states.
+def snapshot(interactables: Iterable[Interactable]) -> bytes:
+    buffer = bytearray()
+    for i in interactables:
+        i.saveSimulationState(buffer)
+    return bytes(buffer)
+
+def restore(interactables: Iterable[Interactable], snapshot: bytes):
+    offset = 0
+    for i in interactables:
+        offset = i.loadSimulationState(snapshot, offset)
+
+def serialize(interactables: Iterable[Interactable]) -> str:
+    if any(i.kind == 'instance' for i in interactables):
+        # Circuits with subcircuits need the definitions saving too; see subcircuit.py
+        import subcircuit
+        return subcircuit.serializeDesign(list(interactables))
+    indexOf = {id(x): index for index, x in enumerate(interactables)}
+    dicts = []
+    for i in interactables:
+        serialized = i.saveState()
+        serialized['inputs'] = [indexOf[id(x)] for x in i.inputs]
+        dicts.append(serialized)
+    return json.dumps(dicts, indent=4)
+
+# Takes either the JSON that serialize produces or the bytes of a binary file (see binformat.py).
+# The JSON can be a plain list of blocks, or an object with subcircuits in it (see subcircuit.py).
+def deserialize(content):
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        # Only load the binary support if it's actually needed
+        import binformat
+        if binformat.isBinary(content):
+            return binformat.deserializeBinary(content)
+        content = bytes(content).decode('utf-8')
+    listOfDicts = json.loads(content)
+    if isinstance(listOfDicts, dict):
+        import subcircuit
+        return subcircuit.deserializeDesign(listOfDicts)
+    iterables = []
+    for i in listOfDicts:
+        iterables.append(interactableFromDictionary(i))
+    iterableIndex = 0
+    for i in listOfDicts:
+        inputIndices = i['inputs']
+        for index in inputIndices:
+            link(iterables[index], iterables[iterableIndex])
+        iterableIndex += 1
+    return iterables
+
+# Loads a circuit from a file in either format.
+def loadCircuit(filename: str) -> List[Interactable]:
+    import binformat
+    return binformat.loadFile(filename)
+
+# Saves a circuit; files ending in binformat.extension get the binary format, anything else gets JSON.
+def saveCircuit(filename: str, interactables: List[Interactable]):
+    import binformat
+    if filename.endswith(binformat.extension):
+        with open(filename, 'wb') as file:
+            file.write(binformat.serializeBinary(interactables))
+    else:
+        with open(filename, 'w') as file:
+            file.write(serialize(interactables))
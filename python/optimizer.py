@@ -0,0 +1,286 @@
+# Makes a smaller circuit that behaves exactly the same, tick for tick, for simulating only -
+# the circuit you edit is left alone.  It does four things:
+#
+#   - Constant folding.  A gate with no inputs is always off, a gate whose inputs are all
+#     constant is constant, an AND with an input that's always off is always off, and so on.
+#     Constant inputs that don't decide a gate's output are dropped (an XOR with an input that's
+#     always on becomes an XNOR of the rest).  A block only counts as constant once it's settled,
+#     i.e. it's already in the state it'll stay in; otherwise it'd be wrong for a tick.
+#   - Merging duplicates.  Gates of the same kind with the same inputs and the same state are
+#     always going to be in the same state, so only one of them needs simulating.  Same for timers
+#     with the same input, delay and contents.
+#   - Removing dead blocks.  If you only care about some of the blocks (see 'observed'), anything
+#     they don't depend on can go.
+#   - Turning chains of buffers into timers.  A one-input AND, OR or XOR just repeats its input a
+#     tick later, so a chain of k of them is a k-tick delay, which is what a timer with a delay of
+#     k-1 is (timers add a tick of their own, like everything else).  The timer's delay line holds
+#     exactly the states the buffers would have been in, so nothing is lost.
+#
+# OptimizedCircuit keeps track of where each original block's state ended up, so store() can put
+# the states back into the original blocks, like CompiledCircuit does.
+from collections import deque
+from typing import Iterable, List
+from model import Interactable, LogicGate, Input, Timer, link
+from eventsim import EventDrivenSimulator
+
+bufferKinds = ("and", "or", "xor") # with a single input, these just pass it along
+
+# Where the state of one of the original blocks can be found in the optimized circuit
+class Source:
+    def __init__(self, node: Interactable = None, slot: int = None, constant: bool = None):
+        self.node = node # the block in the optimized circuit
+        self.slot = slot # for buffers that were turned into a timer, the slot in the timer's delay line
+        self.constant = constant # for blocks that were folded away, their state
+
+def copyOf(interactable: Interactable, kind: str) -> Interactable:
+    node = Interactable.kindToTypeMap[kind](kind, (interactable.x, interactable.y))
+    if isinstance(interactable, Timer):
+        node.timerTickStorage = interactable.timerTickStorage
+        node.kind = interactable.kind
+    else:
+        node.savedState = interactable.savedState
+    node.currentState = interactable.currentState
+    node.prevState = interactable.prevState
+    return node
+
+class OptimizedCircuit:
+    # 'observed' is the blocks whose states you want to be able to see; by default, all of them.
+    # The optimized circuit starts from the blocks' current states, so make it after reloading or
+    # whatever else you want to start from.
+    def __init__(self, interactables: Iterable[Interactable], observed: Iterable[Interactable] = None):
+        self.interactables: List[Interactable] = list(interactables)
+        if any(x.kind == 'instance' for x in self.interactables):
+            raise ValueError("OptimizedCircuit doesn't take subcircuits; flatten the circuit with subcircuit.FlatCircuit first")
+        self.observed = set(id(x) for x in (self.interactables if observed is None else observed))
+        self.kinds = {id(x): x.kind for x in self.interactables}
+        self.inputs = {id(x): list(x.inputs) for x in self.interactables}
+        self.constants = {} # id(block) => the state it's stuck in
+        self.merged = {} # id(block) => the block it's a duplicate of
+        self.foldConstants()
+        self.mergeDuplicates()
+        live = self.findLive()
+        chains = self.findChains(live)
+        self.build(live, chains)
+        self.simulator = EventDrivenSimulator(self.netlist)
+        # How many ticks the netlist has been run for.  step() keeps count, but if you run the
+        # netlist some other way (e.g. with CompiledCircuit), add them on yourself.
+        self.ticks = 0
+
+    # Follows the merges to the block that stands in for x
+    def representative(self, x: Interactable) -> Interactable:
+        while id(x) in self.merged:
+            x = self.merged[id(x)]
+        return x
+
+    def foldConstants(self):
+        consumers = {id(x): [] for x in self.interactables}
+        for x in self.interactables:
+            for input in x.inputs:
+                consumers[id(input)].append(x)
+        pending = deque(self.interactables)
+        while pending:
+            x = pending.popleft()
+            if id(x) not in self.constants and self.fold(x):
+                pending.extend(consumers[id(x)])
+
+    # Simplifies x as far as its constant inputs allow; returns True if it turned out to be constant
+    def fold(self, x: Interactable) -> bool:
+        inputs = self.inputs[id(x)]
+        if isinstance(x, Input):
+            return False # someone might flip it
+        if isinstance(x, Timer):
+            value = self.constants.get(id(inputs[0])) if inputs else False
+            if value is not None and x.currentState == value and all(slot == value for slot in x.delayLine):
+                self.constants[id(x)] = value
+                return True
+            return False
+
+        kind = self.kinds[id(x)]
+        variable = [input for input in inputs if id(input) not in self.constants]
+        if inputs and len(variable) == len(inputs):
+            return False
+        onCount = sum(1 for input in inputs if self.constants.get(id(input)) is True)
+        offCount = len(inputs) - len(variable) - onCount
+        value = None
+        if not variable:
+            value = LogicGate.functions[kind](len(inputs), onCount)
+        elif kind in ("and", "nand") and offCount > 0:
+            value = kind == "nand"
+        elif kind in ("or", "nor") and onCount > 0:
+            value = kind == "or"
+        if value is not None:
+            if x.currentState == value:
+                self.constants[id(x)] = value
+                return True
+            # It'll get there on the next tick, but it isn't there yet, so leave it be
+            return False
+
+        # The constant inputs don't decide it on their own, so they can go
+        if kind in ("xor", "xnor") and onCount % 2 == 1:
+            kind = "xnor" if kind == "xor" else "xor"
+        self.kinds[id(x)] = kind
+        self.inputs[id(x)] = variable
+        return False
+
+    # Two blocks with the same signature are in the same state now and always will be
+    def signature(self, x: Interactable):
+        inputs = tuple(sorted(id(self.representative(input)) for input in self.inputs[id(x)]))
+        if isinstance(x, Timer):
+            return ("timer", inputs, tuple(x.delayLine), x.currentState)
+        return (self.kinds[id(x)], inputs, x.currentState)
+
+    def mergeDuplicates(self):
+        # Merging some blocks can make the blocks they feed into duplicates, so keep going until
+        # nothing changes.
+        merging = True
+        while merging:
+            merging = False
+            seen = {}
+            for x in self.interactables:
+                if isinstance(x, Input) or id(x) in self.constants or id(x) in self.merged:
+                    continue
+                key = self.signature(x)
+                original = seen.setdefault(key, x)
+                if original is not x:
+                    self.merged[id(x)] = original
+                    merging = True
+
+    # The blocks that have to be simulated: the observed ones and everything they depend on
+    def findLive(self) -> dict:
+        live = {}
+        pending = [self.representative(x) for x in self.interactables if id(x) in self.observed and id(x) not in self.constants]
+        while pending:
+            x = pending.pop()
+            if id(x) in live:
+                continue
+            live[id(x)] = x
+            for input in self.inputs[id(x)]:
+                if id(input) not in self.constants:
+                    pending.append(self.representative(input))
+        return live
+
+    def isBuffer(self, x: Interactable) -> bool:
+        return isinstance(x, LogicGate) and self.kinds[id(x)] in bufferKinds and len(self.inputs[id(x)]) == 1
+
+    # Returns lists of buffers, each of which feeds the next and nothing else
+    def findChains(self, live: dict) -> List[List[Interactable]]:
+        consumers = {id(x): [] for x in live.values()}
+        for x in live.values():
+            for input in self.inputs[id(x)]:
+                if id(input) not in self.constants:
+                    consumers[id(self.representative(input))].append(x)
+
+        def following(x: Interactable):
+            fedTo = consumers[id(x)]
+            if self.isBuffer(x) and len(fedTo) == 1 and fedTo[0] is not x and self.isBuffer(fedTo[0]):
+                return fedTo[0]
+            return None
+
+        chains = []
+        continuations = set(id(following(x)) for x in live.values() if following(x) is not None)
+        for x in live.values():
+            # A loop of buffers has no start, so it's left alone
+            if not self.isBuffer(x) or id(x) in continuations:
+                continue
+            chain = [x]
+            while following(chain[-1]) is not None:
+                chain.append(following(chain[-1]))
+            if len(chain) > 1:
+                chains.append(chain)
+        return chains
+
+    def build(self, live: dict, chains: List[List[Interactable]]):
+        self.netlist: List[Interactable] = []
+        nodeOf = {} # id(block) => the block standing in for it in the netlist
+        slotOf = {} # id(buffer) => its slot in the timer that replaced its chain
+
+        for chain in chains:
+            timer = Timer('timer', (chain[-1].x, chain[-1].y))
+            timer.timerTickStorage = [buffer.currentState for buffer in chain]
+            timer.setDelay(len(chain) - 1)
+            timer.prevState = chain[-1].prevState
+            self.netlist.append(timer)
+            for slot, buffer in enumerate(chain):
+                nodeOf[id(buffer)] = timer
+                slotOf[id(buffer)] = slot
+
+        for x in live.values():
+            if id(x) not in nodeOf:
+                nodeOf[id(x)] = copyOf(x, self.kinds[id(x)])
+                self.netlist.append(nodeOf[id(x)])
+
+        # Gates that were about to become constant but hadn't yet can still have constant inputs
+        constantNodes = {}
+        def nodeFor(input: Interactable) -> Interactable:
+            if id(input) in self.constants:
+                value = self.constants[id(input)]
+                if value not in constantNodes:
+                    constantNodes[value] = Input("input-on" if value else "input-off", (input.x, input.y))
+                    self.netlist.append(constantNodes[value])
+                return constantNodes[value]
+            return nodeOf[id(self.representative(input))]
+
+        for x in live.values():
+            if id(x) in slotOf:
+                if slotOf[id(x)] == 0:
+                    link(nodeFor(self.inputs[id(x)][0]), nodeOf[id(x)])
+            else:
+                for input in self.inputs[id(x)]:
+                    link(nodeFor(input), nodeOf[id(x)])
+
+        self.sources = {}
+        for x in self.interactables:
+            standIn = self.representative(x)
+            if id(x) in self.constants:
+                self.sources[id(x)] = Source(constant=self.constants[id(x)])
+            elif id(standIn) in nodeOf:
+                self.sources[id(x)] = Source(nodeOf[id(standIn)], slotOf.get(id(standIn)))
+            else:
+                self.sources[id(x)] = None # nobody's watching it, so it isn't simulated
+
+        self.stats = {
+            'blocks': len(self.interactables),
+            'simulated': len(self.netlist),
+            'constants': len(self.constants),
+            'merged': len(self.merged),
+            'removed': sum(1 for x in self.interactables if self.sources[id(x)] is None),
+            'chains': len(chains),
+            'buffers': sum(len(chain) for chain in chains)
+        }
+
+    # Copies the inputs' states into the optimized circuit, e.g. after they've been flipped.
+    # Anything else that changes the circuit means making a new OptimizedCircuit.
+    def load(self):
+        for x in self.interactables:
+            source = self.sources[id(x)]
+            if isinstance(x, Input) and source is not None and source.node is not None:
+                if source.node.currentState != x.currentState or source.node.prevState != x.prevState:
+                    source.node.currentState = x.currentState
+                    source.node.prevState = x.prevState
+                    self.simulator.markChanged(source.node)
+
+    def step(self, ticks: int = 1):
+        self.simulator.step(ticks)
+        self.ticks += ticks
+
+    # Copies the states back into the original blocks (other than the ones that were removed).
+    # Before the first tick there's nothing to copy; the originals are already right.
+    def store(self):
+        if self.ticks == 0:
+            return
+        for x in self.interactables:
+            source = self.sources[id(x)]
+            if source is None:
+                continue
+            if source.constant is not None:
+                x.currentState = source.constant
+                x.prevState = source.constant
+            elif source.slot is not None:
+                delayLine = source.node.delayLine
+                x.currentState = delayLine[source.slot]
+                x.prevState = delayLine[source.slot + 1] if source.slot + 1 < len(delayLine) else source.node.prevState
+            else:
+                x.currentState = source.node.currentState
+                x.prevState = source.node.prevState
+                if isinstance(x, Timer):
+                    x.delayLine = deque(source.node.delayLine, maxlen=source.node.delayLine.maxlen)
@@ -0,0 +1,98 @@
+# Finds out where the time goes and which blocks are busy.  It's opt-in: nothing in the model
+# knows about it, so it costs nothing until something runs ticks through Profiler.step instead
+# of singleStep or a simulator.
+#
+# Profiler.step does the same thing as model.singleStep, but it times the apply and calculate
+# halves of each tick and counts how many times each block changes state.  Anything else worth
+# timing (like drawing) can be added with addTime.  Blocks that never toggle are the stuck ones;
+# the ones that toggle on nearly every tick are the busy ones.
+import csv
+import json
+import time
+from collections import deque
+from typing import List, TextIO
+from model import Interactable
+
+class Profiler:
+    maxTickTimes = 100000 # only the most recent tick times are kept
+
+    def __init__(self, interactables: List[Interactable]):
+        # Keeps the list itself, not a copy, so it sees blocks being added and removed
+        self.interactables = interactables
+        self.clear()
+
+    def clear(self):
+        self.ticks = 0
+        self.toggles = {} # interactable => the number of ticks it changed state on
+        self.phaseTimes = {'apply': 0.0, 'calculate': 0.0} # phase => total seconds
+        self.tickTimes = deque(maxlen=Profiler.maxTickTimes) # seconds per tick
+
+    def step(self, ticks: int = 1):
+        for _ in range(ticks):
+            started = time.perf_counter()
+            for i in self.interactables:
+                i.apply()
+            applied = time.perf_counter()
+            for i in self.interactables:
+                i.calculate()
+            calculated = time.perf_counter()
+
+            # After apply, prevState is what currentState was before the tick
+            for i in self.interactables:
+                if i.currentState != i.prevState:
+                    self.toggles[i] = self.toggles.get(i, 0) + 1
+            self.ticks += 1
+            self.phaseTimes['apply'] += applied - started
+            self.phaseTimes['calculate'] += calculated - applied
+            self.tickTimes.append(calculated - started)
+
+    # Like singleStep, every tick can change any block
+    def changedLastTick(self):
+        return None
+
+    def addTime(self, phase: str, seconds: float):
+        self.phaseTimes[phase] = self.phaseTimes.get(phase, 0.0) + seconds
+
+    def togglesOf(self, interactable: Interactable) -> int:
+        return self.toggles.get(interactable, 0)
+
+    # The fraction of ticks the block changed state on, from 0 (stuck) to 1 (every tick)
+    def frequency(self, interactable: Interactable) -> float:
+        return self.togglesOf(interactable) / self.ticks if self.ticks > 0 else 0.0
+
+    def blockReport(self) -> List[dict]:
+        return [{
+            'index': index,
+            'kind': i.kind,
+            'x': i.x,
+            'y': i.y,
+            'toggles': self.togglesOf(i),
+            'frequency': self.frequency(i),
+            'currentState': i.currentState
+        } for index, i in enumerate(self.interactables)]
+
+    def report(self) -> dict:
+        return {
+            'ticks': self.ticks,
+            'phases': dict(self.phaseTimes),
+            'tickTimes': list(self.tickTimes),
+            'blocks': self.blockReport()
+        }
+
+    def writeJson(self, file: TextIO):
+        json.dump(self.report(), file, indent=4)
+
+    # One row per block; the tick and phase times are only in the JSON
+    def writeCsv(self, file: TextIO):
+        fields = ['index', 'kind', 'x', 'y', 'toggles', 'frequency', 'currentState']
+        writer = csv.DictWriter(file, fieldnames=fields, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(self.blockReport())
+
+    # Writes CSV if the filename ends in .csv, JSON otherwise
+    def save(self, filename: str):
+        with open(filename, 'w', newline='') as file:
+            if filename.lower().endswith('.csv'):
+                self.writeCsv(file)
+            else:
+                self.writeJson(file)
@@ -0,0 +1,124 @@
+# Runs the simulation at a chosen speed on a background thread, so the window stays responsive
+# however fast the circuit is going.
+#
+# The worker steps the circuit in batches while holding 'lock'.  Anything else that looks at or
+# changes the circuit (the UI's event handling and drawing) has to hold it too, by calling pause()
+# and resume(), so it always sees the circuit between ticks rather than halfway through one.
+import threading
+import time
+from typing import Callable
+
+class SimulationRunner:
+    # Ticks per second; None means as fast as it'll go.  Scrap Mechanic itself runs at 40.
+    speeds = [4, 40, 400, 4000, None]
+    batchTime = 0.01 # roughly how long, in seconds, the worker holds the lock for at a time
+    maxLag = 0.25 # if it falls further behind than this, in seconds, it gives up catching up
+
+    def __init__(self, runTicks: Callable[[int], None], speedIndex: int = 0):
+        self.runTicks = runTicks # advances the circuit by the given number of ticks
+        self.speedIndex = speedIndex
+        self.lock = threading.Lock()
+        # Without this, the worker tends to grab the lock straight back after each batch and the
+        # window never gets a look in.  pause() holds it while waiting for the lock, which keeps
+        # the worker out until resume().
+        self.turnstile = threading.Lock()
+        self.thread = None
+        self.running = False
+        self.ticksRun = 0 # every tick the runner has ever done
+        self.batchSize = 1
+        self.measuredAt = time.perf_counter()
+        self.measuredTicks = 0
+        self.measuredSpeed = 0.0
+        self.restartClock()
+
+    @property
+    def speed(self):
+        return SimulationRunner.speeds[self.speedIndex]
+
+    def speedLabel(self) -> str:
+        return "max" if self.speed is None else str(self.speed)
+
+    # Everything from here down to resume() should only be called between pause() and resume().
+
+    def start(self):
+        self.running = True
+        self.restartClock()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.work, daemon=True)
+            self.thread.start()
+
+    # The worker won't run any more ticks after this, though it might take a moment to exit.
+    def stop(self):
+        self.running = False
+
+    def faster(self):
+        self.setSpeedIndex(self.speedIndex + 1)
+
+    def slower(self):
+        self.setSpeedIndex(self.speedIndex - 1)
+
+    def setSpeedIndex(self, speedIndex: int):
+        self.speedIndex = max(0, min(len(SimulationRunner.speeds) - 1, speedIndex))
+        self.restartClock()
+
+    def pause(self):
+        self.turnstile.acquire()
+        self.lock.acquire()
+
+    def resume(self):
+        self.lock.release()
+        self.turnstile.release()
+
+    # The ticks per second it's actually managing, averaged over the last half second or so.
+    def achievedSpeed(self) -> float:
+        now = time.perf_counter()
+        if now - self.measuredAt >= 0.5:
+            self.measuredSpeed = (self.ticksRun - self.measuredTicks) / (now - self.measuredAt)
+            self.measuredAt = now
+            self.measuredTicks = self.ticksRun
+        return self.measuredSpeed if self.running else 0.0
+
+    # The ticks for a limited speed are counted from here
+    def restartClock(self):
+        self.clockStart = time.perf_counter()
+        self.clockTicks = self.ticksRun
+
+    def ticksDue(self) -> int:
+        if self.speed is None:
+            return self.batchSize
+        due = int((time.perf_counter() - self.clockStart) * self.speed) - (self.ticksRun - self.clockTicks)
+        if due > self.speed * SimulationRunner.maxLag:
+            # Way behind, e.g. because the circuit is too big to run this fast, so just carry on
+            # from here rather than trying to make up for it all at once.
+            self.restartClock()
+            due = 1
+        return min(due, self.batchSize)
+
+    def work(self):
+        while True:
+            with self.turnstile:
+                pass
+            with self.lock:
+                if not self.running:
+                    self.thread = None
+                    return
+                due = self.ticksDue()
+                if due > 0:
+                    started = time.perf_counter()
+                    self.runTicks(due)
+                    self.ticksRun += due
+                    self.adjustBatchSize(due, time.perf_counter() - started)
+                else:
+                    waitTime = (self.ticksRun - self.clockTicks + 1) / self.speed - (time.perf_counter() - self.clockStart)
+            if due <= 0:
+                time.sleep(max(0.0, min(waitTime, SimulationRunner.batchTime)))
+
+    # Aim for batches that take about batchTime, so the lock is held long enough to get some
+    # real work done but not so long that the window gets jerky.
+    def adjustBatchSize(self, ticks: int, elapsed: float):
+        if ticks < self.batchSize:
+            return
+        if elapsed < SimulationRunner.batchTime / 2:
+            self.batchSize *= 2
+        elif elapsed > SimulationRunner.batchTime * 2 and self.batchSize > 1:
+            self.batchSize //= 2
@@ -0,0 +1,407 @@
+# Lets scripts drive circuits over a local socket, so a test harness can set inputs, run ticks and
+# read the results without starting a new process for every question:
+#
+#   python3 server.py mycircuit.json --listen 8765
+#
+# loads mycircuit.json as the circuit "mycircuit" and listens on 127.0.0.1:8765 (give a path
+# rather than a port for a Unix socket).  The window can host the same server for the circuit
+# it's showing (smlogic.py mycircuit.json --serve 8765), where the circuit is called "gui".
+#
+# Each request is one line of JSON holding a batch of commands, which are run in order, and the
+# reply is one line of JSON with a result for each of them:
+#
+#   {"circuit": "mycircuit", "commands": [{"command": "set", "inputs": {"0": true}},
+#                                         {"command": "step", "ticks": 10},
+#                                         {"command": "read", "blocks": [3, 4]}]}
+#   {"results": [{}, {"tick": 10}, {"tick": 10, "blocks": [{"index": 3, ...}, {"index": 4, ...}]}]}
+#
+# The commands are load (a file, or a design in the file format), unload, circuits, set (inputs'
+# states), reload, lift, step, read (some blocks' states, or all of them), snapshot, restore and
+# save.  If one fails, the batch stops there and the reply has an "error" along with the results
+# of the ones before it.  An "id" in the request is copied into the reply.
+#
+# Anyone who can connect can run these, so the server only listens on the loopback interface
+# unless it's told otherwise, and load and save only get at files in the folder it was started in.
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import queue
+import socket
+import stat
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+from model import Interactable, Input, reload, putOnLift, snapshot, restore, deserialize, loadCircuit, saveCircuit
+from eventsim import EventDrivenSimulator
+from codegen import GeneratedSimulator
+from subcircuit import HierarchicalSimulator
+from headless import describeState, generatedCodeFolder
+
+maxLineLength = 1 << 26 # snapshots of big circuits make for long lines
+
+# A (host, port) for TCP or a path for a Unix socket
+Address = Union[Tuple[str,int], str]
+
+# "8765" and "localhost:8765" are TCP ports (on 127.0.0.1 if there's no host); anything else is
+# the path of a Unix socket.  Hosts other than this machine are refused unless allowRemote is set.
+def parseAddress(text: str, allowRemote: bool = False) -> Address:
+    host, colon, port = text.rpartition(':')
+    if not port.isdigit():
+        return text
+    host = host or "127.0.0.1"
+    if not allowRemote and not isLoopback(host):
+        raise ValueError("{0} isn't a loopback address, and anyone who could reach it could drive the circuits".format(host))
+    return (host, int(port))
+
+def isLoopback(host: str) -> bool:
+    try:
+        addresses = socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)
+    except socket.gaierror:
+        return False
+    return all(ipaddress.ip_address(address[4][0].split('%')[0]).is_loopback for address in addresses)
+
+# A circuit held by the server, and how to run it
+class Session:
+    engines = ["event", "generated"]
+
+    def __init__(self, interactables: List[Interactable], engine: str = "event"):
+        self.interactables = interactables
+        if engine == "event":
+            self.simulator = HierarchicalSimulator(interactables, EventDrivenSimulator)
+        elif engine == "generated":
+            self.simulator = HierarchicalSimulator(interactables, lambda blocks: GeneratedSimulator(blocks, generatedCodeFolder))
+        else:
+            raise ValueError("Unknown engine: " + engine)
+        self.tick = 0
+
+    def step(self, ticks: int):
+        self.simulator.step(ticks)
+        self.tick += ticks
+
+    # Called after some blocks' states were changed from outside, e.g. inputs being flipped
+    def touched(self, interactables: List[Interactable]):
+        self.simulator.touched(interactables)
+
+    # Called after the whole circuit jumped to a different state, e.g. a reload; 'tick' is the
+    # tick it jumped back to, if the count changed too
+    def jumped(self, tick: int = None):
+        self.simulator.invalidate()
+        if tick is not None:
+            self.tick = tick
+
+    def currentTick(self) -> int:
+        return self.tick
+
+# A circuit that belongs to something else, like the window, which says how to run ticks and
+# what to do when the states get changed from outside.
+class HostedSession(Session):
+    def __init__(self, interactables: List[Interactable], step: Callable[[int], None], touched: Callable[[List[Interactable]], None],
+                 jumped: Callable[[int], None], currentTick: Callable[[], int]):
+        self.interactables = interactables
+        self.runTicks = step
+        self.onTouched = touched
+        self.onJumped = jumped
+        self.getTick = currentTick
+
+    #override
+    def step(self, ticks: int):
+        self.runTicks(ticks)
+
+    #override
+    def touched(self, interactables: List[Interactable]):
+        self.onTouched(interactables)
+
+    #override
+    def jumped(self, tick: int = None):
+        self.onJumped(tick)
+
+    #override
+    def currentTick(self) -> int:
+        return self.getTick()
+
+# Batches waiting to be run by whoever owns the circuits.  The window calls runPending() between
+# frames, while it has the circuit to itself.
+class BatchQueue:
+    def __init__(self):
+        self.pending = queue.SimpleQueue()
+
+    def submit(self, function: Callable[[], dict]) -> Future:
+        future = Future()
+        self.pending.put((function, future))
+        return future
+
+    def runPending(self):
+        while True:
+            try:
+                function, future = self.pending.get_nowait()
+            except queue.Empty:
+                return
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(function())
+                except BaseException as e:
+                    future.set_exception(e)
+
+class ControlServer:
+    # 'submit' runs a batch somewhere the circuits can safely be touched and returns a Future for
+    # the reply.  By default that's a thread of its own, so batches run one at a time and a long
+    # one doesn't hold up the connections.  'folder' is where load and save can get at files; the
+    # current folder by default.
+    def __init__(self, sessions: Dict[str, Session] = None, submit: Callable[[Callable[[], dict]], Future] = None, folder: str = None):
+        self.sessions = {} if sessions is None else sessions
+        self.submit = submit if submit is not None else ThreadPoolExecutor(max_workers=1).submit
+        self.folder = os.path.realpath(folder if folder is not None else os.getcwd())
+        self.commands = {
+            'load': self.load,
+            'unload': self.unload,
+            'circuits': self.circuits,
+            'set': self.setInputs,
+            'reload': self.reload,
+            'lift': self.lift,
+            'step': self.step,
+            'read': self.read,
+            'snapshot': self.snapshot,
+            'restore': self.restore,
+            'save': self.save
+        }
+        # The fields each command has to have; a tuple is a choice of fields, one of which it needs
+        self.required = {
+            'load': ['circuit', ('file', 'design')],
+            'unload': ['circuit'],
+            'set': ['inputs'],
+            'restore': ['snapshot', 'tick'],
+            'save': ['file']
+        }
+
+    # Runs a batch and returns the reply.  This is all there is to the server apart from the
+    # sockets, so it can be used without them.
+    def runBatch(self, batch: dict) -> dict:
+        reply = {'results': []}
+        if 'id' in batch:
+            reply['id'] = batch['id']
+        try:
+            for command in batch.get('commands', []):
+                if 'circuit' not in command and 'circuit' in batch:
+                    command = dict(command, circuit=batch['circuit'])
+                handler = self.commands.get(command.get('command'))
+                if handler is None:
+                    raise ValueError("Unknown command: {0}".format(command.get('command')))
+                self.checkFields(command)
+                reply['results'].append(handler(command))
+        except Exception as e:
+            # Whatever went wrong, the client should hear about it rather than be cut off
+            reply['error'] = str(e)
+        return reply
+
+    def checkFields(self, command: dict):
+        for field in self.required.get(command['command'], []):
+            choices = field if isinstance(field, tuple) else (field,)
+            if not any(choice in command for choice in choices):
+                raise ValueError("Missing {0} in {1}".format(" or ".join(choices), command['command']))
+
+    # The session a command is for: the one it names, or the only one there is
+    def sessionFor(self, command: dict) -> Session:
+        name = command.get('circuit')
+        if name is None:
+            if len(self.sessions) != 1:
+                raise ValueError("Say which circuit: " + ", ".join(sorted(self.sessions)) if self.sessions else "No circuit is loaded")
+            return next(iter(self.sessions.values()))
+        session = self.sessions.get(name)
+        if session is None:
+            raise ValueError("No circuit called " + name)
+        return session
+
+    def blocksOf(self, session: Session, indices: Sequence[int]) -> List[Interactable]:
+        blocks = []
+        for index in indices:
+            if not 0 <= int(index) < len(session.interactables):
+                raise IndexError("There's no block {0}; there are {1}".format(index, len(session.interactables)))
+            blocks.append(session.interactables[int(index)])
+        return blocks
+
+    # A file a command names, relative to the folder, which it mustn't get out of
+    def pathFor(self, filename: str) -> str:
+        path = os.path.realpath(os.path.join(self.folder, filename))
+        if os.path.commonpath([self.folder, path]) != self.folder:
+            raise ValueError("{0} isn't in {1}".format(filename, self.folder))
+        return path
+
+    def load(self, command: dict) -> dict:
+        name = command['circuit']
+        if isinstance(self.sessions.get(name), HostedSession):
+            raise ValueError("{0} can't be replaced; it belongs to the window".format(name))
+        if 'file' in command:
+            interactables = loadCircuit(self.pathFor(command['file']))
+        else:
+            design = command['design']
+            interactables = deserialize(design if isinstance(design, str) else json.dumps(design))
+        self.sessions[name] = Session(interactables, command.get('engine', "event"))
+        return {'blocks': len(interactables)}
+
+    def unload(self, command: dict) -> dict:
+        name = command['circuit']
+        if isinstance(self.sessionFor(command), HostedSession):
+            raise ValueError("{0} can't be unloaded; it belongs to the window".format(name))
+        del self.sessions[name]
+        return {}
+
+    def circuits(self, command: dict) -> dict:
+        return {'circuits': {name: {'blocks': len(session.interactables), 'tick': session.currentTick()} for name, session in self.sessions.items()}}
+
+    # 'inputs' maps block numbers to the states to put them in
+    def setInputs(self, command: dict) -> dict:
+        session = self.sessionFor(command)
+        changed = []
+        for index, state in command['inputs'].items():
+            x = self.blocksOf(session, [index])[0]
+            if not isinstance(x, Input):
+                raise ValueError("Block {0} isn't an input".format(index))
+            if x.currentState != bool(state):
+                x.currentState = bool(state)
+                changed.append(x)
+        session.touched(changed)
+        return {}
+
+    def reload(self, command: dict) -> dict:
+        session = self.sessionFor(command)
+        reload(session.interactables)
+        session.jumped()
+        return {}
+
+    def lift(self, command: dict) -> dict:
+        session = self.sessionFor(command)
+        putOnLift(session.interactables)
+        session.jumped()
+        return {}
+
+    def step(self, command: dict) -> dict:
+        session = self.sessionFor(command)
+        ticks = int(command.get('ticks', 1))
+        if ticks < 0:
+            raise ValueError("Can't run a negative number of ticks")
+        session.step(ticks)
+        return {'tick': session.currentTick()}
+
+    # 'blocks' is the block numbers to read; all of them if it's left out
+    def read(self, command: dict) -> dict:
+        session = self.sessionFor(command)
+        indices = command.get('blocks')
+        if indices is None:
+            indices = range(len(session.interactables))
+        blocks = self.blocksOf(session, indices)
+        return {'tick': session.currentTick(), 'blocks': [describeState(int(index), x) for index, x in zip(indices, blocks)]}
+
+    def snapshot(self, command: dict) -> dict:
+        session = self.sessionFor(command)
+        return {'tick': session.currentTick(), 'snapshot': snapshot(session.interactables).hex()}
+
+    # Takes what snapshot returned, tick and all, so the tick count goes back too
+    def restore(self, command: dict) -> dict:
+        session = self.sessionFor(command)
+        state = bytes.fromhex(command['snapshot'])
+        tick = int(command['tick'])
+        if len(state) != len(snapshot(session.interactables)):
+            raise ValueError("That snapshot is of a different circuit")
+        restore(session.interactables, state)
+        session.jumped(tick)
+        return {'tick': session.currentTick()}
+
+    def save(self, command: dict) -> dict:
+        session = self.sessionFor(command)
+        saveCircuit(self.pathFor(command['file']), session.interactables)
+        return {}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    batch = json.loads(line)
+                    if not isinstance(batch, dict):
+                        raise ValueError("A request should be a JSON object")
+                except ValueError as e:
+                    reply = {'results': [], 'error': "Bad request: " + str(e)}
+                else:
+                    reply = await asyncio.wrap_future(self.submit(lambda: self.runBatch(batch)))
+                writer.write(json.dumps(reply).encode('utf-8') + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, asyncio.IncompleteReadError, ValueError):
+            pass # the client went away or sent something too long to be a request
+        finally:
+            writer.close()
+
+    async def listen(self, address: Address) -> asyncio.AbstractServer:
+        if isinstance(address, str):
+            # A socket left behind by a server that didn't shut down cleanly would stop us binding
+            if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+                os.unlink(address)
+            return await asyncio.start_unix_server(self.handle, path=address, limit=maxLineLength)
+        return await asyncio.start_server(self.handle, address[0], address[1], limit=maxLineLength)
+
+    def serveForever(self, address: Address):
+        async def serve():
+            server = await self.listen(address)
+            sys.stderr.write("Listening on {0}\n".format(address if isinstance(address, str) else "{0}:{1}".format(*address)))
+            async with server:
+                await server.serve_forever()
+        asyncio.run(serve())
+
+    # Serves on a background thread, e.g. alongside the window
+    def start(self, address: Address) -> threading.Thread:
+        thread = threading.Thread(target=self.serveForever, args=(address,), daemon=True)
+        thread.start()
+        return thread
+
+# Sends one batch to a server and waits for the reply; for scripts that don't want to deal with
+# sockets themselves.  Keep the connection (see connect) for lots of batches.
+def connect(address: Address) -> socket.socket:
+    if isinstance(address, str):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    connection.connect(address)
+    return connection
+
+def request(connection: socket.socket, batch: dict) -> dict:
+    connection.sendall(json.dumps(batch).encode('utf-8') + b"\n")
+    reply = bytearray()
+    while not reply.endswith(b"\n"):
+        received = connection.recv(1 << 16)
+        if not received:
+            raise ConnectionError("The server closed the connection")
+        reply += received
+    return json.loads(reply)
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Holds circuits in memory and runs batches of commands on them sent over a local socket.")
+    parser.add_argument("circuits", nargs="*", help="circuit files to load, named after the file (mycircuit.json is \"mycircuit\")")
+    parser.add_argument("--listen", required=True, metavar="ADDRESS", help="a port (on 127.0.0.1), host:port, or the path of a Unix socket")
+    parser.add_argument("--allow-remote", action="store_true", help="let --listen be on a host other than this machine; there's no authentication, so only do this on a network you trust")
+    parser.add_argument("--folder", help="the folder that load and save commands can get at files in; the current folder by default")
+    parser.add_argument("--engine", choices=Session.engines, default="event", help="the simulation engine for the circuits loaded here")
+    args = parser.parse_args(argv)
+
+    try:
+        address = parseAddress(args.listen, args.allow_remote)
+    except ValueError as e:
+        parser.error(str(e))
+    if not isinstance(address, str) and not isLoopback(address[0]):
+        sys.stderr.write("Warning: anyone who can reach {0} can run and load circuits, and read and write files in the folder\n".format(address[0]))
+
+    server = ControlServer(folder=args.folder)
+    for filename in args.circuits:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        server.sessions[name] = Session(loadCircuit(filename), args.engine)
+    try:
+        server.serveForever(address)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -12,12 +12,23 @@ import pygame.color as color
 import pygame.key as key
 import pygame.mouse as mouse
 import pygame as pygame
+import argparse
 import math
-import time
-import json
+import os
 import sys
-from enum import Enum
-from typing import TypeVar, Iterable, Tuple
+import time
+from typing import List, Tuple
+from eventsim import EventDrivenSimulator
+from codegen import GeneratedSimulator, userCacheFolder
+from history import TickHistory
+from runner import SimulationRunner
+from profiler import Profiler
+from vcd import VcdTrace
+from spatial import SpatialIndex
+from camera import Camera
+from server import ControlServer, HostedSession, BatchQueue, parseAddress
+from subcircuit import Instance, HierarchicalSimulator
+from model import static_init, Interactable, LogicGate, Input, Timer, BlockPositions, reload, putOnLift, loadCircuit, saveCircuit, link, unlink, unlinkInputs, disconnect
 
 BLACK = (0, 0, 0)
 RED = (255, 0, 0)
@@ -28,375 +39,297 @@ GRAY = (200, 200, 200)
 DARKGRAY = (100, 100, 100)
 YELLOW = (255,255,0)
 
-def static_init(cls):
-    if getattr(cls, "static_init", None):
-        cls.static_init()
-    return cls
+def addSavedOnIndicator(screen: pygame.Surface):
+    tLen = 15
+    draw.polygon(screen, BLUE, ((63-tLen, 0), (63,tLen), (63,0), (63-tLen,0)))
+
+def addSavedOffIndicator(screen: pygame.Surface):
+    tLen = 15
+    draw.polygon(screen, BLUE, ((63-tLen, 0), (63,tLen), (63,0), (63-tLen,0)), 3)
 
 @static_init
 class Assets:
-    arrow = image.load("assets/arrow.png")
-    
+    # Relative to this file rather than the current directory so it can be launched from anywhere
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
+    arrow = None
+    gateImagesSavedOn = {}
+    gateImagesSavedOff = {}
+    inputImageSavedOn = None
+    inputImageSavedOff = None
+    labelFont = None # Needs pygame.init, so main sets it up
+    rotatedArrows = {} # whole degrees => the arrow rotated by that much
+    timerImages = {} # (bars, label) => image; see getTimerImage
+    heatOverlays = {} # heat level => a see-through tint; see getHeatOverlay
+    instanceImages = {} # subcircuit name => image; see getInstanceImage
+    scaledImages = {} # id(image) => the image at scaledSize; see getScaledImage
+    scaledSize = None
+
+    # Rotating is expensive and there are only so many angles worth telling apart, so
+    # the rotated arrows are cached by the nearest whole degree.
+    @classmethod
+    def rotatedArrow(cls, angle: float) -> pygame.Surface:
+        degrees = int(round(angle)) % 360
+        arrow = cls.rotatedArrows.get(degrees)
+        if arrow is None:
+            arrow = transform.rotate(cls.arrow, degrees)
+            cls.rotatedArrows[degrees] = arrow
+        return arrow
+
     @classmethod
     def static_init(cls):
+        cls.arrow = image.load(os.path.join(cls.folder, "arrow.png"))
         arrowRect = cls.arrow.get_rect()
         cls.arrow = transform.scale(cls.arrow, (int(arrowRect.width * .03), int(arrowRect.height * .03)))
 
-class Interactable:
-    hotkeyToTypeMap: dict = {}
-    kindToTypeMap: dict = {}
-
-    def __init__(self, kind: str, pos: Tuple[float,float]):
-        self.kind = kind
-        self.currentState = False
-        self.prevState = False
-        self.inputs = []
-        self.selected = False
-        self.rect = pygame.Rect(0,0,64,64) # All the images are 64x64
-        self.rect.move_ip((pos[0] - self.rect.width/2, pos[1] - self.rect.height/2)) # now it's the rect moved to the spot we want it
-        self.maxInputCount = -1
-
-    def loadState(self, state: dict): pass
-    def saveState(self) -> dict:
-        return {
-            'kind': self.kind,
-            'x': self.rect.centerx,
-            'y': self.rect.centery
-        }
-
-    def draw(self, screen: pygame.Surface):
-        draw.rect(screen, GRAY if self.currentState else DARKGRAY, self.rect)
-        screen.blit(self.get_image(), self.rect.topleft)
-        if (self.selected):
-            draw.rect(screen, GREEN, self.rect, 4)
-        else:
-            draw.rect(screen, BLUE, self.rect, 4)
-
-    def get_image(self) -> pygame.Surface: pass
-
-    # returns true if pos is inside the drawn area of this thing
-    def containsPosition(self, pos):
-        return self.rect.collidepoint(pos)
-
-    def move(self, pos):
-        self.rect.move_ip(pos[0], pos[1])
-
-    def apply(self):
-        self.prevState = self.currentState
-    
-    def swapGate(self, dir: int): pass
-
-    def alternate(self): pass
-
-    def reload(self): pass
-
-    def putOnLift(self): pass
-
-    def paint(self): pass
-
-    def inputsChanged(self):
-        self.calculate()
-    
-    def calculate(self): pass
-
-# LogicGate and Input both have a notion of a singled bit of saved state (either on or off).
-# This class consolodates that logic.
-class InteractableWithSingleBitSavedState(Interactable):
-    def __init__(self, kind: str, pos: Tuple[float,float]):
-        super().__init__(kind, pos)
-        self.savedState = False
-
-    @staticmethod
-    def addSavedOnIndicator(screen: pygame.Surface):
-        tLen = 15
-        draw.polygon(screen, BLUE, ((63-tLen, 0), (63,tLen), (63,0), (63-tLen,0)))
-
-    @staticmethod
-    def addSavedOffIndicator(screen: pygame.Surface):
-        tLen = 15
-        draw.polygon(screen, BLUE, ((63-tLen, 0), (63,tLen), (63,0), (63-tLen,0)), 3)
-
-    #override
-    def saveState(self) -> dict:
-        state = super().saveState()
-        state['savedState'] = self.savedState
-        return state
-
-    # We don't offer an implementation of loadState because there are some backwards-compat
-    # shenanigans in Input, so we need specialized implementations in both subclasses
-
-    #override
-    def paint(self):
-        self.savedState = self.currentState
-
-@static_init
-class LogicGate(InteractableWithSingleBitSavedState):
-    gates = ["and", "or", "xor", "nand", "nor", "xnor"]
-    imagesSavedOn = {}
-    imagesSavedOff = {}
-
-    # i = #inputs, a = #activatedInputs => bool
-    functions = {
-        "and": lambda i, a: i > 0 and i == a,
-        "or": lambda i, a: a > 0,
-        "xor": lambda i, a: a % 2 == 1,
-        "nand": lambda i, a: i > 0 and i != a,
-        "nor": lambda i, a: i > 0 and a == 0,
-        "xnor": lambda i, a: i > 0 and a % 2 == 0
-    }
-
-    @classmethod
-    def static_init(cls):
-        for gate in cls.gates:
-            Interactable.kindToTypeMap[gate] = cls
-            baseImage = image.load("assets/" + gate + "-black.png")
+        for gate in LogicGate.gates:
+            baseImage = image.load(os.path.join(cls.folder, gate + "-black.png"))
             imageSavedOn = pygame.Surface((64,64), constants.SRCALPHA, depth=32)
             imageSavedOn.blit(baseImage, baseImage.get_rect())
-            InteractableWithSingleBitSavedState.addSavedOnIndicator(imageSavedOn)
-            cls.imagesSavedOn[gate] = imageSavedOn
+            addSavedOnIndicator(imageSavedOn)
+            cls.gateImagesSavedOn[gate] = imageSavedOn
             imageSavedOff = pygame.Surface((64,64), constants.SRCALPHA, depth=32)
             imageSavedOff.blit(baseImage, baseImage.get_rect())
-            InteractableWithSingleBitSavedState.addSavedOffIndicator(imageSavedOff)
-            cls.imagesSavedOff[gate] = imageSavedOff
-        Interactable.hotkeyToTypeMap[constants.K_g] = lambda pos: LogicGate('and', pos)
-        Interactable.hotkeyToTypeMap[constants.K_l] = lambda pos: LogicGate('and', pos)        
-
-    #override
-    def get_image(self) -> pygame.Surface:
-        return LogicGate.imagesSavedOn[self.kind] if self.savedState else LogicGate.imagesSavedOff[self.kind]
-
-    def __init__(self, kind: str, pos: Tuple[float,float]):
-        super().__init__(kind, pos)
-        self.maxInputCount = -1
-
-    #override
-    def loadState(self, serialized: dict):
-        super().loadState(serialized)
-        self.savedState = serialized['savedState'] if 'savedState' in serialized else False
-        self.currentState = self.savedState
-        self.prevState = False
-
-    #override
-    def calculate(self):
-        activatedInputs = sum([input.prevState for input in self.inputs])
-        self.currentState = LogicGate.functions[self.kind](len(self.inputs), activatedInputs)
-
-    #override
-    def inputsChanged(self):
-        self.calculate()
-
-    #override
-    def reload(self):
-        self.currentState = self.savedState
-        self.prevState = False
-
-    #override
-    def putOnLift(self):
-        self.currentState = len(self.inputs) > 0 and self.kind in ("nand", "nor", "xnor")
-        self.prevState = False
-        self.savedState = self.currentState
-
-    #override
-    def swapGate(self, dir: int):
-        i = LogicGate.gates.index(self.kind)
-        self.kind = LogicGate.gates[((i + dir) % 3) + (i - (i % 3))]
-        self.calculate()
-        self.savedState = self.currentState
-
-    #override
-    def alternate(self):
-        i = LogicGate.gates.index(self.kind)
-        self.kind = LogicGate.gates[(i + 3) % 6]
-        self.calculate()
-        self.savedState = self.currentState
-
-@static_init
-class Input(InteractableWithSingleBitSavedState):
-    imageSavedOn = None
-    imageSavedOff = None
-
-    def __init__(self, kind: str, pos: Tuple[float,float]):
-        super().__init__("input", pos)
-        self.maxInputCount = 0
-        self.savedState = kind == "input-on" # input-on is for backwards compatability
-        self.currentState = self.savedState
-        self.prevState = False
-
-    @classmethod
-    def static_init(cls):
-        Interactable.hotkeyToTypeMap[constants.K_i] = lambda pos: Input('input', pos)
-        Interactable.kindToTypeMap['input-off'] = cls # input-off is for backwards compatability
-        Interactable.kindToTypeMap['input-on'] = cls # input-on is for backwards compatability
-        Interactable.kindToTypeMap['input'] = cls
-        cls.imageSavedOn = pygame.Surface((64,64), constants.SRCALPHA, depth=32)
-        draw.circle(cls.imageSavedOn, BLACK, (32,32), 24, 8)
-        InteractableWithSingleBitSavedState.addSavedOnIndicator(cls.imageSavedOn)
-        cls.imageSavedOff = pygame.Surface((64,64), constants.SRCALPHA, depth=32)
-        draw.circle(cls.imageSavedOff, BLACK, (32,32), 24, 8)
-        InteractableWithSingleBitSavedState.addSavedOffIndicator(cls.imageSavedOff)
-
-    #override
-    def loadState(self, serialized: dict):
-        super().loadState(serialized)
-        if 'savedState' in serialized:
-            # it's the modern style
-            self.savedState = serialized['savedState']
-        # else it should have been set in the constructor because 'kind' was input-on or off.
-        self.currentState = self.savedState
-        self.prevState = False
-
-    #override
-    def get_image(self) -> pygame.Surface:
-        return Input.imageSavedOn if self.savedState else Input.imageSavedOff
-
-    #override
-    def calculate(self):
-        pass # It just is what it is
-
-    def reload(self):
-        self.currentState = self.savedState
-        self.prevState = False
-
-    def putOnLift(self):
-        self.savedState = False
-        self.currentState = False
-        self.prevState = False
-
-    #override
-    def alternate(self):
-        self.currentState = not self.currentState
-    
-    #override
-    def swapGate(self, dir: int):
-        self.currentState = not self.currentState
-
-@static_init
-class Timer(Interactable):
-    def __init__(self, kind: str, pos: Tuple[float,float]):
-        super().__init__(kind, pos)
-        self.timerTickStorage = [False]*10
-        self.maxInputCount = 1
-
-    #override
-    def saveState(self) -> dict:
-        serialized = super().saveState()
-        serialized['timerTickStorage'] = self.timerTickStorage
-        return serialized
-
-    #override
-    def loadState(self, serialized: dict):
-        super().loadState(serialized)
-        self.timerTickStorage = serialized['timerTickStorage'] if 'timerTickStorage' in serialized else [False]*10
-        self.currentState = self.timerTickStorage[9]
-        self.prevState = False
-
-    @classmethod
-    def static_init(cls):
-        Interactable.kindToTypeMap['timer10'] = cls
-        Interactable.hotkeyToTypeMap[constants.K_t] = lambda pos: Timer('timer10', pos)
-
-    #override
-    def get_image(self):
+            addSavedOffIndicator(imageSavedOff)
+            cls.gateImagesSavedOff[gate] = imageSavedOff
+
+        cls.inputImageSavedOn = pygame.Surface((64,64), constants.SRCALPHA, depth=32)
+        draw.circle(cls.inputImageSavedOn, BLACK, (32,32), 24, 8)
+        addSavedOnIndicator(cls.inputImageSavedOn)
+        cls.inputImageSavedOff = pygame.Surface((64,64), constants.SRCALPHA, depth=32)
+        draw.circle(cls.inputImageSavedOff, BLACK, (32,32), 24, 8)
+        addSavedOffIndicator(cls.inputImageSavedOff)
+
+hotkeyToTypeMap = {
+    constants.K_g: lambda pos: LogicGate('and', pos),
+    constants.K_l: lambda pos: LogicGate('and', pos),
+    constants.K_i: lambda pos: Input('input', pos),
+    constants.K_t: lambda pos: Timer('timer10', pos)
+}
+
+# What's drawn without a camera, e.g. by the benchmarks: the circuit's coordinates, 1:1
+fixedCamera = Camera()
+
+# Below this zoom, blocks are too small to make anything out, so they're drawn as dots of their
+# color and the wires are drawn without arrows.
+detailZoom = 0.25
+
+# Where the block is on the screen
+def getRect(interactable: Interactable, camera: Camera = fixedCamera) -> pygame.Rect:
+    size = camera.scale(Interactable.size)
+    rect = pygame.Rect(0, 0, size, size)
+    rect.center = camera.toScreen(interactable.x, interactable.y)
+    return rect
+
+# Scaling is expensive, so the images are scaled once per zoom level and kept until it changes.
+# The images passed in are cached themselves, so their ids don't get reused.
+def getScaledImage(image: pygame.Surface, size: int) -> pygame.Surface:
+    if size == image.get_width():
+        return image
+    if size != Assets.scaledSize:
+        Assets.scaledImages.clear()
+        Assets.scaledSize = size
+    scaled = Assets.scaledImages.get(id(image))
+    if scaled is None:
+        scaled = transform.smoothscale(image, (size, size))
+        Assets.scaledImages[id(image)] = scaled
+    return scaled
+
+# There's only room for 10 bars, so longer timers show a sample of their slots.  Returns
+# the bars as a bit mask (bit i is bar i) along with how many there are.
+def getTimerBars(timer: Timer) -> Tuple[int,int]:
+    length = len(timer.delayLine)
+    bars = 0
+    for i in range(min(10, length)):
+        slot = i if length <= 10 else i * (length - 1) // 9
+        if timer.delayLine[slot]:
+            bars |= 1 << i
+    return bars, min(10, length)
+
+def getTimerLabel(timer: Timer) -> str:
+    if timer.delay == Timer.legacyDelay:
+        return None
+    seconds, ticks = divmod(timer.delay, Timer.ticksPerSecond)
+    return "{0}s {1}t".format(seconds, ticks) if seconds > 0 else "{0}t".format(ticks)
+
+# Timer images are cached by what's drawn on them, since there are only so many combinations
+def getTimerImage(timer: Timer) -> pygame.Surface:
+    key = (getTimerBars(timer), getTimerLabel(timer))
+    image = Assets.timerImages.get(key)
+    if image is None:
+        (bars, barCount), labelText = key
         image = pygame.Surface((64,64), constants.SRCALPHA, depth=32)
         timerbox = pygame.Rect(6, 7, 64-12, 64-11)
         draw.rect(image, BLACK, timerbox, 2)
-        for i in range(10):
+        for i in range(barCount):
             y = timerbox.bottom - 4 - i*5
             x_left = timerbox.left + 7
             x_right = timerbox.right - 7
-            if self.timerTickStorage[i]:
+            if bars & (1 << i):
                 draw.line(image, LIGHTBLUE, (x_left, y), (x_right, y), 4)
-        return image
+        if Assets.labelFont is not None and labelText is not None:
+            label = Assets.labelFont.render(labelText, True, RED)
+            image.blit(label, ((64 - label.get_width()) // 2, 64 - label.get_height()))
+        Assets.timerImages[key] = image
+    return image
+
+# A box with the subcircuit's name in it and a notch on the left for each input port
+def getInstanceImage(instance: Instance) -> pygame.Surface:
+    image = Assets.instanceImages.get(instance.definition.name)
+    if image is None:
+        image = pygame.Surface((64,64), constants.SRCALPHA, depth=32)
+        draw.rect(image, BLACK, pygame.Rect(6, 6, 64-12, 64-12), 2)
+        inputCount = len(instance.definition.inputs)
+        for number in range(inputCount):
+            y = 64 * (number + 1) // (inputCount + 1)
+            draw.line(image, BLACK, (0, y), (10, y), 4)
+        if Assets.labelFont is not None:
+            # Long names get cut short to fit in the box
+            name = instance.definition.name
+            label = Assets.labelFont.render(name, True, BLACK)
+            while label.get_width() > 64-16 and len(name) > 1:
+                name = name[:-1]
+                label = Assets.labelFont.render(name + "..", True, BLACK)
+            image.blit(label, ((64 - label.get_width()) // 2, (64 - label.get_height()) // 2))
+        Assets.instanceImages[instance.definition.name] = image
+    return image
+
+def getImage(interactable: Interactable) -> pygame.Surface:
+    if isinstance(interactable, Instance):
+        return getInstanceImage(interactable)
+    elif isinstance(interactable, LogicGate):
+        return Assets.gateImagesSavedOn[interactable.kind] if interactable.savedState else Assets.gateImagesSavedOff[interactable.kind]
+    elif isinstance(interactable, Input):
+        return Assets.inputImageSavedOn if interactable.savedState else Assets.inputImageSavedOff
+    else:
+        return getTimerImage(interactable)
+
+# Everything that affects what drawInteractable draws, so we can tell when a block needs redrawing
+def getVisualKey(interactable: Interactable):
+    key = (interactable.x, interactable.y, interactable.kind, interactable.currentState, getattr(interactable, 'savedState', None), interactable.selected, interactable.probe)
+    if isinstance(interactable, Timer):
+        key += (getTimerBars(interactable), interactable.delay)
+    elif isinstance(interactable, Instance):
+        key += tuple(port.currentState for port in interactable.ports)
+    return key
+
+def drawInteractable(screen: pygame.Surface, interactable: Interactable, camera: Camera = fixedCamera):
+    rect = getRect(interactable, camera)
+    if camera.zoom < detailZoom:
+        draw.rect(screen, GREEN if interactable.selected else GRAY if interactable.currentState else DARKGRAY, rect)
+        return
+    draw.rect(screen, GRAY if interactable.currentState else DARKGRAY, rect)
+    screen.blit(getScaledImage(getImage(interactable), rect.width), rect.topleft)
+    if interactable.probe:
+        draw.circle(screen, YELLOW, (rect.left + camera.scale(12), rect.bottom - camera.scale(12)), camera.scale(5))
+    if isinstance(interactable, Instance):
+        for port in interactable.ports:
+            draw.circle(screen, LIGHTBLUE if port.currentState else BLUE, camera.toScreen(port.x - 10, port.y), camera.scale(5))
+    if (interactable.selected):
+        draw.rect(screen, GREEN, rect, camera.scale(4))
+    else:
+        draw.rect(screen, BLUE, rect, camera.scale(4))
+
+# What a wire dragged from the block comes from: the block itself, or for a subcircuit, whichever
+# of its output ports is nearest to where the drag started (None if it hasn't got any).
+def getWireSource(interactable: Interactable, pos: Tuple[int,int]):
+    if not isinstance(interactable, Instance):
+        return interactable
+    return min(interactable.ports, key=lambda port: abs(port.y - pos[1]), default=None)
+
+# Connecting or disconnecting a block saves its state, like painting it.  For a subcircuit, that's
+# only the blocks at its ports.
+def paintConnected(interactable: Interactable):
+    if isinstance(interactable, Instance):
+        interactable.paintPorts()
+    else:
+        interactable.paint()
+
+# The heatmap shows how often each block toggles, in steps from cool blue to hot red.  Blocks
+# that never toggle (level 0) don't get tinted at all, so stuck ones stand out.
+heatLevels = 10
+
+def getHeatLevel(frequency: float) -> int:
+    return 0 if frequency == 0 else 1 + min(heatLevels - 1, int(frequency * heatLevels))
+
+def getHeatOverlay(level: int) -> pygame.Surface:
+    overlay = Assets.heatOverlays.get(level)
+    if overlay is None:
+        fraction = (level - 1) / (heatLevels - 1)
+        overlay = pygame.Surface((Interactable.size, Interactable.size), constants.SRCALPHA, depth=32)
+        overlay.fill((int(255 * fraction), 0, int(255 * (1 - fraction)), 140))
+        Assets.heatOverlays[level] = overlay
+    return overlay
+
+def drawLineWithArrows(screen: pygame.Surface, pos1: Tuple[float,float], pos2: Tuple[float,float], color: draw, width: int = 3, arrows: bool = True):
+    draw.line(screen, color, pos1, pos2, width)
+    if not arrows:
+        return
 
-    def calculate(self):
-        self.currentState = self.timerTickStorage[9]
-        self.timerTickStorage[0] = len(self.inputs) > 0 and self.inputs[0].prevState
-
-    #override
-    def reload(self):
-        self.currentState = self.timerTickStorage[9]
-        self.prevState = False
-
-    #override
-    def putOnLift(self):
-        self.timerTickStorage = [False]*10
-        self.currentState = False
-        self.prevState = False
-
-    #override
-    def apply(self):
-        self.prevState = self.currentState
-        for i in range(9):
-            self.timerTickStorage[9-i] = self.timerTickStorage[8-i]
-        self.currentState = self.timerTickStorage[9]
-
-def drawLineWithArrows(screen: pygame.Surface, pos1: Tuple[float,float], pos2: Tuple[float,float], color: draw):
-    draw.line(screen, color, pos1, pos2, 3)
-    
     # get counterclockwise degrees for rotation; image is already rotated 180
     deltaX = pos2[0] - pos1[0]
     deltaY = pos2[1] - pos1[1]
     angle = -math.degrees(math.atan2(deltaY, deltaX)) - 180
     
-    arrow = Assets.arrow
-    arrow = transform.rotate(arrow, angle)
+    arrow = Assets.rotatedArrow(angle)
     arrowRect = arrow.get_rect()
     arrowRect.move_ip((pos2[0] + pos1[0] - arrowRect.width)/2, (pos2[1] + pos1[1] - arrowRect.height)/2)
     screen.blit(arrow, arrowRect)
 
-def interactableFromDictionary(serialized: dict):
-    interactableType = Interactable.kindToTypeMap[serialized['kind']]
-    interactable = interactableType(serialized['kind'], (serialized['x'], serialized['y']))
-    interactable.loadState(serialized)
-    return interactable
-
-def findItem(interactables, pos):
-    for i in interactables:
-        if i.containsPosition(pos):
-            return i
-    return None
-
-def singleStep(interactables: Iterable[Interactable]):
-    for i in interactables:
-        i.apply()
-    for i in interactables:
-        i.calculate()
-
-# Simulates an event like entering and coming back into Scrap Mechanic
-def reload(interactables: Iterable[Interactable]):
-    for i in interactables:
-        i.reload()
-
-def putOnLift(interactables: Iterable[Interactable]):
-    for i in interactables:
-        i.putOnLift()
-    
-def serialize(interactables: Iterable[Interactable]) -> str:
-    dicts = []
-    for i in interactables:
-        serialized = i.saveState()
-        inputIndices = []
-        for x in i.inputs:
-            inputIndices.append(interactables.index(x))
-        serialized['inputs'] = inputIndices
-        dicts.append(serialized)
-    return json.dumps(dicts, indent=4)
-
-def deserialize(jsonContent: str):
-    listOfDicts = json.loads(jsonContent)
-    iterables = []
-    for i in listOfDicts:
-        iterables.append(interactableFromDictionary(i))
-    iterableIndex = 0
-    for i in listOfDicts:
-        inputIndices = i['inputs']
-        for index in inputIndices:
-            iterables[iterableIndex].inputs.append(iterables[index])
-        iterableIndex += 1
-    return iterables
+# All the connections that can be seen, drawn onto one surface that's only redrawn when the
+# layout or the view changes or the state of one of those wires does.  (A wire's color comes
+# from the prevState of its input.)
+class WireLayer:
+    def __init__(self):
+        self.surface = None
+        self.wires = None # the (source, target) pairs that cross the screen
+        self.view = None
+        self.wireStates = None
+
+    # Call when blocks or connections are added, removed or moved
+    def invalidate(self):
+        self.surface = None
+        self.wires = None
+
+    # The wires whose bounding box overlaps the area; the rest can't be on the screen
+    def findWires(self, interactables: List[Interactable], area: Tuple[float,float,float,float]) -> list:
+        left, top, right, bottom = area
+        wires = []
+        for box in interactables:
+            for input in box.inputs:
+                if min(input.x, box.x) <= right and max(input.x, box.x) >= left and min(input.y, box.y) <= bottom and max(input.y, box.y) >= top:
+                    wires.append((input, box))
+        return wires
+
+    # Redraws the layer if it needs to be; returns True if it did
+    def refresh(self, size: Tuple[int,int], interactables: List[Interactable], camera: Camera = fixedCamera) -> bool:
+        view = (size,) + camera.key()
+        if self.wires is None or view != self.view:
+            self.wires = self.findWires(interactables, camera.visibleArea(size))
+            self.view = view
+            self.surface = None
+        wireStates = bytes(source.prevState for source, target in self.wires)
+        if self.surface is not None and wireStates == self.wireStates:
+            return False
+        self.wireStates = wireStates
+        self.surface = pygame.Surface(size)
+        self.surface.fill(BLACK)
+        width = camera.scale(3)
+        arrows = camera.zoom >= detailZoom
+        for source, target in self.wires:
+            drawLineWithArrows(self.surface, camera.toScreen(source.x, source.y), camera.toScreen(target.x, target.y),
+                               LIGHTBLUE if source.prevState else BLUE, width, arrows)
+        return True
 
 # define a main function
 def main():
+    parser = argparse.ArgumentParser(description="Edits and simulates Scrap Mechanic logic circuits.")
+    parser.add_argument("circuit", nargs="?", default='smlogicsim.json', help="the circuit file to edit (JSON, or binary if it ends in .smlb); it's saved on exit")
+    parser.add_argument("--serve", metavar="ADDRESS", help="let scripts drive the circuit through a port (on 127.0.0.1), host:port or Unix socket; see server.py")
+    args = parser.parse_args(sys.argv[1:])
+    try:
+        serveAddress = parseAddress(args.serve) if args.serve is not None else None
+    except ValueError as e:
+        parser.error(str(e))
 
     # initialize the pygame module
     pygame.init()
@@ -406,21 +339,56 @@ def main():
     pygame.display.set_icon(logo)
 
     sysfont = font.SysFont(None, 24)
+    Assets.labelFont = font.SysFont(None, 16)
 
     screen = pygame.display.set_mode((700,700), constants.RESIZABLE)
 
     interactables = []
-    filename = sys.argv[1] if len(sys.argv) > 1 else 'smlogicsim.json'
+    filename = args.circuit
     try:
-        jsonContent = ""
-        with open(filename, 'r') as file:
-            jsonContent = file.read()
-        interactables = deserialize(jsonContent)
+        interactables = loadCircuit(filename)
     except IOError:
         None
 
     pygame.display.set_caption("Scrap Mechanic Logic Gate Simulator - " + filename)
 
+    # Only re-evaluates the blocks that could be affected by the previous tick.  Edits tell it
+    # which blocks they touched, so it carries on from there; jumps like reloading or stepping
+    # back invalidate it, which makes the next tick a full one.  E swaps it for one that runs
+    # generated code, which is faster for busy circuits; that one makes its code again (or finds
+    # it in the cache) on the first tick after any edit.  Either way, subcircuits get flattened
+    # on the first tick after an edit too.
+    simulator = HierarchicalSimulator(interactables, EventDrivenSimulator)
+    generatedCode = False
+    generatedCodeFolder = userCacheFolder()
+
+    # Records each tick so F9 can step backwards.  Edits that change the shape of the circuit
+    # have to tell it which blocks they touched, like the simulator.
+    history = TickHistory(interactables)
+
+    # Where each block is in the list, so deleting one doesn't mean looking for it.  The blocks
+    # after it keep their order, so the numbers in the saved file only shift down by one.
+    positions = BlockPositions(interactables)
+
+    def addBlock(block: Interactable):
+        interactables.append(block)
+        positions.added(block)
+
+    def removeBlock(block: Interactable):
+        del interactables[positions.find(block)]
+        positions.removed(block)
+
+    # For finding what's under the mouse; has to be told about blocks being moved, added or removed.
+    spatialIndex = SpatialIndex(interactables)
+
+    # Drawing is cached, so has to be told about anything that moves or changes connections.
+    wireLayer = WireLayer()
+    lastVisible = None
+    lastVisualKeys = None
+    wasLinking = False
+    lastTickLabel = None
+    lastTickRect = pygame.Rect(0, 0, 0, 0)
+
     # define a variable to control the main loop
     closing = False
     running = False
@@ -430,16 +398,100 @@ def main():
     isMoving = False
     isLinking = False
     posAtStart = (0,0)
+    grabOffset = (0,0) # where in the selected block it was grabbed, for moving it
     tick = 0
-    lastTickTime = time.time()
+
+    # The mouse wheel zooms in and out around the mouse, dragging with the right (or middle)
+    # button pans, and Home fits the whole circuit in the window.  Everything the mouse does goes
+    # through camera.toWorld, since blocks' positions are in the circuit's coordinates.
+    camera = Camera()
+    isPanning = False
+    panButtons = (2, 3)
+    zoomStep = 1.25
+
+    # The screen rectangle in the circuit's coordinates, for the spatial index
+    def worldArea(rect: pygame.Rect) -> Tuple[float,float,float,float]:
+        left, top = camera.toWorld(rect.topleft)
+        right, bottom = camera.toWorld((rect.right - 1, rect.bottom - 1))
+        return (left, top, right, bottom)
+
+    def runTicks(count: int):
+        nonlocal tick
+        if runner.speed is None:
+            # Recording every tick would slow the fastest speed right down, so it just starts
+            # recording again from wherever each batch gets to.  F9 can't go back past that.
+            if trace is None:
+                stepper.step(count)
+                tick += count
+            else:
+                for _ in range(count):
+                    stepper.step()
+                    tick += 1
+                    trace.sample(tick)
+            history.clear(tick)
+        else:
+            for _ in range(count):
+                history.step(stepper.step, stepper.changedLastTick)
+                tick += 1
+                if trace is not None:
+                    trace.sample(tick)
+
+    # Runs the ticks on another thread when running.  The circuit must only be touched between
+    # pause() and resume(), so the loop below holds it for everything but waiting for the next frame.
+    runner = SimulationRunner(runTicks)
+
+    # H turns on the profiler, which counts toggles for the heatmap.  While it's on, it runs the
+    # ticks rather than the simulator, so it can time them.
+    profiler = None
+    stepper = simulator
+
+    # Shift-W writes the probes' states on every tick to a VCD file, until it's pressed again
+    trace = None
+    traceFile = None
+
+    # --serve lets scripts drive the circuit over a socket, as the circuit "gui" (see server.py).
+    # Their batches are run between frames, like the keyboard's edits, and their ticks are
+    # recorded like the runner's.
+    commandQueue = None
+    if args.serve is not None:
+        def serverJumped(jumpedTo: int = None):
+            nonlocal tick
+            if jumpedTo is not None:
+                tick = jumpedTo
+            simulator.invalidate()
+            history.clear(tick)
+        commandQueue = BatchQueue()
+        hosted = HostedSession(interactables, runTicks, lambda blocks: simulator.touched(blocks), serverJumped, lambda: tick)
+        ControlServer({"gui": hosted}, commandQueue.submit).start(serveAddress)
+
+    def stopTrace():
+        nonlocal trace, traceFile
+        if trace is not None:
+            trace.close()
+            traceFile.close()
+            trace = None
+            traceFile = None
+
+    def drawBox(box: Interactable):
+        drawInteractable(screen, box, camera)
+        if profiler is not None:
+            level = getHeatLevel(profiler.frequency(box))
+            if level > 0:
+                rect = getRect(box, camera)
+                screen.blit(getScaledImage(getHeatOverlay(level), rect.width), rect)
+    clock = pygame.time.Clock()
+    framesPerSecond = 60
      
     # main loop
     while not closing:
+        runner.pause()
+        if commandQueue is not None:
+            commandQueue.runPending()
         # event handling, gets all event from the event queue
         for event in pygame.event.get():
             if event.type == constants.MOUSEBUTTONDOWN:
                 if event.button == 1:
-                    selectedNow = findItem(interactables, event.pos)
+                    selectedNow = spatialIndex.find(camera.toWorld(event.pos))
                     if selected is not None: selected.selected = False
                     if selectedNow is None:
                         selected = None
@@ -447,24 +499,34 @@ def main():
                         selectedNow.selected = True
                         selected = selectedNow
                         posAtStart = event.pos
-            elif event.type == constants.MOUSEBUTTONUP:
+                        grabX, grabY = camera.toWorldPoint(event.pos)
+                        grabOffset = (grabX - selected.x, grabY - selected.y)
+                elif event.button in panButtons:
+                    isPanning = True
+            elif event.type == constants.MOUSEBUTTONUP and event.button in panButtons:
+                isPanning = False
+            elif event.type == constants.MOUSEBUTTONUP and event.button == 1:
                 if isLinking:
-                    target = findItem(interactables, event.pos)
-                    if target is not None and target is not selected and target.maxInputCount != 0:
-                        if selected in target.inputs:
+                    target = spatialIndex.find(camera.toWorld(event.pos))
+                    source = getWireSource(selected, camera.toWorld(posAtStart))
+                    if target is not None and target is not selected and source is not None and target.maxInputCount != 0:
+                        if target in source.outputs:
                             # the connection is already there - undo it
-                            target.inputs.remove(selected)
+                            unlink(source, target)
                         else:
                             # If the connection already goes the other way, reverse it.
-                            if target in selected.inputs:
-                                selected.inputs.remove(target)
+                            if selected in target.outputs:
+                                unlink(target, selected)
                                 selected.inputsChanged()
                             if target.maxInputCount == 1:
-                                target.inputs.clear()
-                            target.inputs.append(selected)
+                                unlinkInputs(target)
+                            link(source, target)
                         target.inputsChanged()
-                        target.paint()
-                        selected.paint()
+                        paintConnected(target)
+                        paintConnected(selected)
+                        simulator.touched([target, selected])
+                        history.touched([target, selected])
+                        wireLayer.invalidate()
                 isLinking = False
                 isMoving = False
             elif event.type == constants.MOUSEMOTION:
@@ -478,92 +540,219 @@ def main():
                         isMoving = keyboardModifiers in (constants.KMOD_SHIFT, constants.KMOD_LSHIFT, constants.KMOD_RSHIFT)
                         isLinking = keyboardModifiers == 0
                     if isMoving:
-                        selected.move(event.rel)
+                        x, y = camera.toWorldPoint(event.pos)
+                        selected.move((x - grabOffset[0] - selected.x, y - grabOffset[1] - selected.y))
+                        spatialIndex.update(selected)
+                        wireLayer.invalidate()
+                if isPanning:
+                    camera.pan(event.rel)
+            elif event.type == constants.MOUSEWHEEL:
+                camera.zoomAt(mouse.get_pos(), zoomStep ** event.y)
             elif event.type == constants.KEYDOWN:
                 if event.key == constants.K_DELETE and selected is not None:
-                    interactables.remove(selected)
-                    for i in interactables:
-                        if selected in i.inputs:
-                            i.inputs.remove(selected)
-                            i.inputsChanged()
+                    removeBlock(selected)
+                    spatialIndex.remove(selected)
+                    wireLayer.invalidate()
+                    consumers = disconnect(selected)
+                    for i in consumers:
+                        i.inputsChanged()
+                    simulator.removed(selected)
+                    simulator.touched(consumers)
+                    history.removed(selected)
+                    history.touched(consumers)
+                    if trace is not None:
+                        trace.edited([selected])
                     selected = None
-                elif event.key == constants.K_LEFT and selected is not None:
-                    selected.swapGate(-1)
-                elif event.key == constants.K_RIGHT and selected is not None:
-                    selected.swapGate(1)
-                elif event.key == constants.K_UP and selected is not None:
-                    selected.alternate()
-                elif event.key == constants.K_DOWN and selected is not None:
+                elif event.key in (constants.K_LEFT, constants.K_RIGHT) and selected is not None:
+                    dir = -1 if event.key == constants.K_LEFT else 1
+                    # Shift makes timers longer or shorter by a whole second rather than a tick
+                    if isinstance(selected, Timer) and event.mod in (constants.KMOD_SHIFT, constants.KMOD_LSHIFT, constants.KMOD_RSHIFT):
+                        dir *= Timer.ticksPerSecond
+                    selected.swapGate(dir)
+                    simulator.touched([selected])
+                    # Flipping an input is just a change of state, which the history copes with
+                    if not isinstance(selected, Input): history.touched([selected])
+                elif event.key in (constants.K_UP, constants.K_DOWN) and selected is not None:
                     selected.alternate()
+                    simulator.touched([selected])
+                    if not isinstance(selected, Input): history.touched([selected])
                 elif event.key == constants.K_F10 and not running:
-                    singleStep(interactables)
+                    history.step(stepper.step, stepper.changedLastTick)
                     tick += 1
+                    if trace is not None:
+                        trace.sample(tick)
+                elif event.key == constants.K_F9 and not running:
+                    tick -= history.stepBack()
+                    simulator.invalidate()
                 elif event.key == constants.K_F4:
                     tick = 0
                     running = False
+                    runner.stop()
+                    # The trace can't go back to tick 0, so that's the end of it
+                    stopTrace()
                     if event.mod in (constants.KMOD_SHIFT, constants.KMOD_LSHIFT, constants.KMOD_RSHIFT):
                         putOnLift(interactables)
                     else:
                         reload(interactables)
+                    simulator.invalidate()
+                    history.clear(tick)
                 elif event.key == constants.K_F5:
                     running = True
+                    runner.start()
                 elif event.key == constants.K_F6:
                     running = False
+                    runner.stop()
+                elif event.key in (constants.K_EQUALS, constants.K_PLUS, constants.K_KP_PLUS):
+                    runner.faster()
+                elif event.key in (constants.K_MINUS, constants.K_KP_MINUS):
+                    runner.slower()
+                elif event.key == constants.K_h:
+                    if event.mod in (constants.KMOD_SHIFT, constants.KMOD_LSHIFT, constants.KMOD_RSHIFT):
+                        if profiler is not None:
+                            base = os.path.splitext(filename)[0]
+                            profiler.save(base + "-profile.json")
+                            profiler.save(base + "-profile.csv")
+                    elif profiler is None:
+                        profiler = Profiler(interactables)
+                        stepper = profiler
+                    else:
+                        # The profiler's ticks went past the simulator, so it starts over
+                        profiler = None
+                        stepper = simulator
+                        simulator.invalidate()
+                elif event.key == constants.K_w:
+                    if event.mod in (constants.KMOD_SHIFT, constants.KMOD_LSHIFT, constants.KMOD_RSHIFT):
+                        if trace is None:
+                            traceFile = open(os.path.splitext(filename)[0] + ".vcd", 'w')
+                            trace = VcdTrace(traceFile, interactables, tick=tick)
+                        else:
+                            stopTrace()
+                    elif selected is not None:
+                        selected.probe = not selected.probe
+                        if trace is not None:
+                            trace.edited()
+                elif event.key == constants.K_e:
+                    generatedCode = not generatedCode
+                    if generatedCode:
+                        simulator = HierarchicalSimulator(interactables, lambda blocks: GeneratedSimulator(blocks, generatedCodeFolder))
+                        pygame.display.set_caption("Scrap Mechanic Logic Gate Simulator - " + filename + " (generated code)")
+                    else:
+                        simulator = HierarchicalSimulator(interactables, EventDrivenSimulator)
+                        pygame.display.set_caption("Scrap Mechanic Logic Gate Simulator - " + filename)
+                    if profiler is None:
+                        stepper = simulator
                 elif event.key == constants.K_s:
-                    with open(filename, 'w') as file:
-                        file.write(serialize(interactables))
+                    saveCircuit(filename, interactables)
                 elif event.key == constants.K_p:
                     if event.mod in (constants.KMOD_SHIFT, constants.KMOD_LSHIFT, constants.KMOD_RSHIFT):
                         for i in interactables:
                             i.paint()
                     elif selected is not None:
                         selected.paint()
-                elif event.key in Interactable.hotkeyToTypeMap.keys():
+                elif event.key == constants.K_HOME:
+                    camera.fit(interactables, screen.get_size())
+                elif event.key == constants.K_c and isinstance(selected, Instance):
+                    # Another one of the selected subcircuit, fresh from its definition
+                    selected.selected = False
+                    selected = Instance(selected.definition, camera.toWorldPoint(mouse.get_pos()))
+                    selected.selected = True
+                    addBlock(selected)
+                    spatialIndex.insert(selected)
+                    simulator.touched([selected])
+                    wireLayer.invalidate()
+                    history.touched([selected])
+                elif event.key in hotkeyToTypeMap.keys():
                     if selected is not None: selected.selected = False
-                    selected = Interactable.hotkeyToTypeMap[event.key](mouse.get_pos())
+                    selected = hotkeyToTypeMap[event.key](camera.toWorldPoint(mouse.get_pos()))
                     selected.selected = True
-                    interactables.append(selected)
+                    addBlock(selected)
+                    spatialIndex.insert(selected)
+                    simulator.touched([selected])
+                    wireLayer.invalidate()
+                    history.touched([selected])
 
             elif event.type == constants.QUIT:
                 closing = True
+                runner.stop()
 
         if running:
-            timenow = time.time()
-            if (timenow - lastTickTime > .25):
-                singleStep(interactables)
-                tick += 1
-                lastTickTime = timenow
-
-        screen.fill(BLACK)
-
-        tickImage = sysfont.render(str(tick), True, RED)
+            tickLabel = "{0}/{1} tps   {2}".format(int(runner.achievedSpeed()), runner.speedLabel(), tick)
+        else:
+            tickLabel = str(tick)
+        if trace is not None:
+            tickLabel = "REC   " + tickLabel
+        tickImage = sysfont.render(tickLabel, True, RED)
         tickRect = tickImage.get_rect()
         screenRect = screen.get_rect()
         tickRect.move_ip(screenRect.width - 10 - tickRect.width, 10)
-        screen.blit(tickImage, tickRect)
 
-        for box in interactables:
-            for input in box.inputs:
-                drawLineWithArrows(screen, input.rect.center, box.rect.center, LIGHTBLUE if input.prevState else BLUE)
-
-        for box in interactables:
-            box.draw(screen)
-
-        if isLinking:
-            mousePos = mouse.get_pos()
-            target = findItem(interactables, mousePos)
-            if target is None:
-                draw.line(screen, GRAY, selected.rect.center, mouse.get_pos(), 1)
-            else:
-                draw.line(screen, GREEN, selected.rect.center, target.rect.center, 1)
-
-        display.flip()
-        # display.update()
+        renderStarted = time.perf_counter()
+
+        # Only the blocks on the screen get looked at, let alone drawn
+        visible = spatialIndex.query(*camera.visibleArea(screen.get_size()))
+        visualKeys = [getVisualKey(box) for box in visible]
+        if profiler is not None:
+            visualKeys = [visualKey + (getHeatLevel(profiler.frequency(box)),) for visualKey, box in zip(visualKeys, visible)]
+        if wireLayer.refresh(screen.get_size(), interactables, camera) \
+        or isLinking \
+        or wasLinking \
+        or lastVisible is None \
+        or len(visible) != len(lastVisible) \
+        or any(box is not lastBox for box, lastBox in zip(visible, lastVisible)):
+            # Something big changed, so redraw the whole thing
+            screen.blit(wireLayer.surface, (0, 0))
+            screen.blit(tickImage, tickRect)
+
+            for box in visible:
+                drawBox(box)
+
+            if isLinking:
+                mousePos = mouse.get_pos()
+                target = spatialIndex.find(camera.toWorld(mousePos))
+                if target is None:
+                    draw.line(screen, GRAY, camera.toScreen(selected.x, selected.y), mousePos, 1)
+                else:
+                    draw.line(screen, GREEN, camera.toScreen(selected.x, selected.y), camera.toScreen(target.x, target.y), 1)
+
+            display.flip()
+        else:
+            # Only redraw the blocks that look different, plus whatever's underneath them
+            dirtyRects = []
+            for box, visualKey, lastVisualKey in zip(visible, visualKeys, lastVisualKeys):
+                if visualKey != lastVisualKey:
+                    dirtyRects.append(getRect(box, camera))
+                    if visualKey[:2] != lastVisualKey[:2]:
+                        lastRect = getRect(box, camera)
+                        lastRect.center = camera.toScreen(lastVisualKey[0], lastVisualKey[1])
+                        dirtyRects.append(lastRect)
+            if tickLabel != lastTickLabel:
+                dirtyRects.append(tickRect.union(lastTickRect))
+            for rect in dirtyRects:
+                screen.set_clip(rect)
+                screen.blit(wireLayer.surface, rect, rect)
+                screen.blit(tickImage, tickRect)
+                for box in spatialIndex.query(*worldArea(rect)):
+                    drawBox(box)
+            screen.set_clip(None)
+            if dirtyRects:
+                display.update(dirtyRects)
+
+        if profiler is not None:
+            profiler.addTime('render', time.perf_counter() - renderStarted)
+
+        lastVisible = visible
+        lastVisualKeys = visualKeys
+        wasLinking = isLinking
+        lastTickLabel = tickLabel
+        lastTickRect = tickRect
+
+        runner.resume()
+        clock.tick(framesPerSecond)
+
+    stopTrace()
 
     # Always just save on exit
-    savedState = serialize(interactables)
-    with open(filename, 'w') as file:
-        file.write(savedState)
+    saveCircuit(filename, interactables)
 
 # run the main function only if this module is executed as the main script
 # (if you import this as a module then nothing is executed)
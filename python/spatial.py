@@ -0,0 +1,83 @@
+# A spatial index over the interactables, so finding the block under the mouse doesn't mean
+# checking every block in the circuit.
+#
+# It's a uniform grid: space is cut into square cells and each cell knows which blocks overlap
+# it.  Blocks are all the same size, so with cells the size of a block, each block lands in at
+# most 4 cells and a point lookup only has to look at the handful of blocks in one cell.
+#
+# Whoever moves, adds or removes blocks has to tell the index (see update, insert and remove).
+from typing import Iterable, List, Tuple
+from model import Interactable
+
+class SpatialIndex:
+    def __init__(self, interactables: Iterable[Interactable] = (), cellSize: int = Interactable.size):
+        self.cellSize = cellSize
+        self.cells = {} # (column, row) => list of interactables overlapping that cell
+        self.cellsOf = {} # id(interactable) => the cells it's in
+        self.order = {} # id(interactable) => when it was inserted
+        self.nextOrder = 0
+        for i in interactables:
+            self.insert(i)
+
+    def cellRange(self, left: float, top: float, right: float, bottom: float):
+        for column in range(int(left // self.cellSize), int(right // self.cellSize) + 1):
+            for row in range(int(top // self.cellSize), int(bottom // self.cellSize) + 1):
+                yield (column, row)
+
+    def cellsFor(self, interactable: Interactable) -> List[Tuple[int,int]]:
+        half = Interactable.size // 2
+        # The block covers [x - half, x + half), so the right and bottom edges are exclusive
+        return list(self.cellRange(interactable.x - half, interactable.y - half, interactable.x + half - 1, interactable.y + half - 1))
+
+    def insert(self, interactable: Interactable):
+        self.order[id(interactable)] = self.nextOrder
+        self.nextOrder += 1
+        self.place(interactable)
+
+    def place(self, interactable: Interactable):
+        cells = self.cellsFor(interactable)
+        self.cellsOf[id(interactable)] = cells
+        for cell in cells:
+            self.cells.setdefault(cell, []).append(interactable)
+
+    def unplace(self, interactable: Interactable):
+        for cell in self.cellsOf.pop(id(interactable)):
+            contents = self.cells[cell]
+            contents.remove(interactable)
+            if not contents:
+                del self.cells[cell]
+
+    def remove(self, interactable: Interactable):
+        self.unplace(interactable)
+        del self.order[id(interactable)]
+
+    # Call after the interactable has moved
+    def update(self, interactable: Interactable):
+        if self.cellsOf[id(interactable)] != self.cellsFor(interactable):
+            self.unplace(interactable)
+            self.place(interactable)
+
+    # Returns the block at pos, or None.  If blocks overlap, the one that was added first wins,
+    # just like with model.findItem.
+    def find(self, pos: Tuple[float,float]):
+        found = None
+        for i in self.cells.get((int(pos[0] // self.cellSize), int(pos[1] // self.cellSize)), ()):
+            if i.containsPosition(pos) and (found is None or self.order[id(i)] < self.order[id(found)]):
+                found = i
+        return found
+
+    # Returns all the blocks that overlap the rectangle (right and bottom inclusive), in the
+    # order they were added, which is the order they get drawn in.
+    def query(self, left: float, top: float, right: float, bottom: float) -> List[Interactable]:
+        half = Interactable.size // 2
+        found = {}
+        # Zoomed right out, the rectangle can cover far more cells than there are blocks, so go
+        # through the cells that have something in them instead
+        columns = int(right // self.cellSize) - int(left // self.cellSize) + 1
+        rows = int(bottom // self.cellSize) - int(top // self.cellSize) + 1
+        cells = self.cells.values() if columns * rows > len(self.cells) else (self.cells.get(cell, ()) for cell in self.cellRange(left, top, right, bottom))
+        for contents in cells:
+            for i in contents:
+                if i.x - half <= right and i.x + half > left and i.y - half <= bottom and i.y + half > top:
+                    found[id(i)] = i
+        return sorted(found.values(), key=lambda i: self.order[id(i)])
@@ -0,0 +1,585 @@
+# Subcircuits - a circuit with a name and some named ports that can be dropped into other circuits
+# as many times as you like, like a memory bit or a full adder.
+#
+# The blocks are only kept once, in the Definition.  An Instance of it is a single block that holds
+# its position, what's wired to its inputs and its state vector: a bytearray with a byte for each
+# block of the definition (currentState | prevState << 1 | savedState << 2), followed by the slots
+# of the delay line for timers, or by the inner instance's own vector for subcircuits within
+# subcircuits.  So a thousand memory bits are a thousand small bytearrays, not a thousand copies of
+# every gate.
+#
+# Each definition is boiled down once into an indexed form (a Part per block: its kind, where its
+# state is in the vector and which parts feed it), and that's compiled into a pair of functions that
+# do the apply and calculate halves of a tick on a state vector.  All the instances of a definition
+# share those, so singleStep (and anything else that calls apply and calculate, like the profiler)
+# runs circuits with subcircuits as they are.
+#
+# The other engines need a flat list of plain blocks, so FlatCircuit makes one, again from the
+# indexed form, and store() copies the states back into the vectors.  HierarchicalSimulator does
+# that lazily: it only flattens on the first tick after something changed, and only if there are
+# any subcircuits.
+#
+# An input port is a block inside the subcircuit (a gate, or a timer with nothing wired to it) that
+# gets wired to whatever is connected to the instance: the first thing connected goes to the first
+# input port, and so on.  An output port is a block whose state can be wired out of the instance;
+# in the inputs of the blocks it's wired to, it's an OutputPort rather than the instance itself.
+#
+# On disk, a circuit with subcircuits is a JSON object rather than a list:
+#
+#   {"definitions": [{"name": "memorybit", "inputs": [["set", 0], ["reset", 1]],
+#                     "outputs": [["out", 3]], "blocks": [...]}],
+#    "blocks": [..., {"kind": "instance", "definition": "memorybit", "x": 100, "y": 200,
+#                     "state": "0004...", "inputs": [0, 4]},
+#               {"kind": "and", ..., "inputs": [[5, "out"]]}]}
+#
+# The blocks are in the usual format, plus instances; an input of [5, "out"] is the "out" port of
+# block 5.  Definitions only get saved if something uses them, and circuits without any subcircuits
+# are saved in the old format.
+import argparse
+import json
+import sys
+from typing import Callable, Dict, Iterable, List, Tuple
+from model import Interactable, Input, Timer, interactableFromDictionary, loadCircuit, saveCircuit, link
+from optimizer import copyOf
+
+# One block of a definition, in the form that simulating and flattening want
+class Part:
+    def __init__(self, kind: str, offset: int, x: int, y: int, probe: bool):
+        self.kind = kind # a gate kind, 'input', 'timer', 'timer10' or 'instance'
+        self.offset = offset # where its state is in the vector
+        self.x = x
+        self.y = y
+        self.probe = probe
+        self.length = 0 # for timers, the number of slots in the delay line; 0 for everything else
+        self.definition = None # for instances, what they're an instance of
+        self.inputs = [] # (part index, None) for a block, (part index, output port number) for an inner instance's port
+
+# Where in the circuit (or in another subcircuit) a subcircuit's output port is wired from
+class OutputPort:
+    __slots__ = ('instance', 'number', 'name', 'index', 'offset', 'outputs')
+
+    def __init__(self, instance: 'Instance', number: int):
+        self.instance = instance
+        self.number = number
+        self.name, self.index = instance.definition.outputs[number] # index is the port's block in the definition
+        self.offset = instance.definition.parts[self.index].offset
+        self.outputs = set() # what it's wired into, like Interactable.outputs
+
+    @property
+    def currentState(self) -> bool:
+        return self.instance.state[self.offset] & 1 == 1
+
+    @property
+    def prevState(self) -> bool:
+        return self.instance.state[self.offset] & 2 == 2
+
+    # Ports are spread down the right-hand side of the instance, which is where wires leave from
+    @property
+    def x(self) -> int:
+        return self.instance.x + Interactable.size // 2
+
+    @property
+    def y(self) -> int:
+        count = len(self.instance.ports)
+        return self.instance.y - Interactable.size // 2 + Interactable.size * (self.number + 1) // (count + 1)
+
+# Packs the blocks' states into a state vector, in the layout described at the top
+def encode(blocks: Iterable[Interactable]) -> bytearray:
+    buffer = bytearray()
+    for x in blocks:
+        if isinstance(x, (Timer, Instance)):
+            x.saveSimulationState(buffer)
+        else:
+            buffer.append(x.currentState | (x.prevState << 1) | (x.savedState << 2))
+    return buffer
+
+# Makes the block for a part, in the state at state[offset].  Inner instances are left whole.
+def makeBlock(part: Part, state: bytes, offset: int, pos: Tuple[float,float]) -> Interactable:
+    if part.definition is not None:
+        block = Instance(part.definition, pos)
+        block.state[:] = state[offset + 1:offset + 1 + part.definition.size]
+    elif part.length > 0:
+        block = Timer(part.kind, pos)
+        block.timerTickStorage = [slot == 1 for slot in state[offset + 1:offset + 1 + part.length]]
+        block.kind = part.kind
+    else:
+        block = Interactable.kindToTypeMap[part.kind](part.kind, pos)
+        block.savedState = state[offset] & 4 == 4
+    block.currentState = state[offset] & 1 == 1
+    block.prevState = state[offset] & 2 == 2
+    block.probe = part.probe
+    return block
+
+# The expression for the new state of a gate (as 0 or 1), given its inputs' states as 0 or 1
+def gateExpression(kind: str, terms: List[str]) -> str:
+    if not terms:
+        return "0"
+    operator = {"and": " & ", "nand": " & ", "or": " | ", "nor": " | ", "xor": " ^ ", "xnor": " ^ "}[kind]
+    expression = "(" + operator.join(terms) + ")"
+    return "(1 ^ " + expression + ")" if kind in ("nand", "nor", "xnor") else expression
+
+class Definition:
+    # 'inputs' and 'outputs' are the ports, as (name, index of the block) in order.  The blocks'
+    # states are what new instances start out with.
+    def __init__(self, name: str, blocks: List[Interactable], inputs: List[Tuple[str,int]], outputs: List[Tuple[str,int]]):
+        self.name = name
+        self.blocks = list(blocks)
+        self.inputs = [(portName, index) for portName, index in inputs]
+        self.outputs = [(portName, index) for portName, index in outputs]
+        self.checkPorts()
+        self.index()
+        self.initialState = bytes(encode(self.blocks))
+        self.functions = None # (apply, calculate), compiled the first time they're needed
+
+        # Flattened blocks are laid out around the instance the way they are around this
+        if self.blocks:
+            self.centerX = (min(x.x for x in self.blocks) + max(x.x for x in self.blocks)) // 2
+            self.centerY = (min(x.y for x in self.blocks) + max(x.y for x in self.blocks)) // 2
+        else:
+            self.centerX = self.centerY = 0
+
+    def checkPorts(self):
+        names = [portName for portName, index in self.inputs + self.outputs]
+        if len(set(names)) != len(names):
+            raise ValueError("The ports of {0} need different names".format(self.name))
+        for portName, index in self.inputs + self.outputs:
+            if not 0 <= index < len(self.blocks):
+                raise ValueError("Port {0} of {1} is block {2}, but there are only {3} blocks".format(portName, self.name, index, len(self.blocks)))
+            if isinstance(self.blocks[index], Instance):
+                raise ValueError("Port {0} of {1} can't be a subcircuit".format(portName, self.name))
+        for portName, index in self.inputs:
+            x = self.blocks[index]
+            if isinstance(x, Input) or (isinstance(x, Timer) and x.inputs):
+                raise ValueError("Input port {0} of {1} has to be a gate, or a timer with nothing wired to it".format(portName, self.name))
+
+    def index(self):
+        indexOf = {id(x): index for index, x in enumerate(self.blocks)}
+        def reference(input) -> Tuple[int,int]:
+            block, number = (input.instance, input.number) if isinstance(input, OutputPort) else (input, None)
+            if id(block) not in indexOf:
+                raise ValueError("Something in {0} is wired to a block that isn't part of it".format(self.name))
+            return (indexOf[id(block)], number)
+
+        self.parts = []
+        offset = 0
+        for x in self.blocks:
+            part = Part(x.kind, offset, x.x, x.y, x.probe)
+            part.inputs = [reference(input) for input in x.inputs]
+            if isinstance(x, Instance):
+                part.definition = x.definition
+                offset += 1 + x.definition.size
+            elif isinstance(x, Timer):
+                part.length = len(x.delayLine)
+                offset += 1 + part.length
+            else:
+                offset += 1
+            self.parts.append(part)
+        self.size = offset
+
+    # Where the state of whatever a part input refers to is in the vector
+    def stateOffset(self, reference: Tuple[int,int]) -> int:
+        index, number = reference
+        part = self.parts[index]
+        if number is None:
+            return part.offset
+        inner = part.definition
+        return part.offset + 1 + inner.parts[inner.outputs[number][1]].offset
+
+    # Writes apply(s, b) and calculate(s, b, e), which do the two halves of a tick for an instance
+    # whose vector starts at s[b].  e is the states of what's wired to the input ports, 0 or 1, or
+    # None for a port with nothing wired to it.
+    def generateSource(self) -> str:
+        def at(offset: int) -> str:
+            return "s[b+{0}]".format(offset)
+        def term(reference: Tuple[int,int]) -> str:
+            return "({0} >> 1 & 1)".format(at(self.stateOffset(reference)))
+
+        apply = ["def apply(s, b):"]
+        calculate = ["def calculate(s, b, e):"]
+        portOf = {index: number for number, (portName, index) in enumerate(self.inputs)}
+        for partIndex, part in enumerate(self.parts):
+            o = part.offset
+            port = portOf.get(partIndex)
+            if part.definition is not None:
+                drivers = [term(reference) for reference in part.inputs[:len(part.definition.inputs)]]
+                drivers += ["None"] * (len(part.definition.inputs) - len(drivers))
+                apply.append("    a{0}(s, b+{1})".format(partIndex, o + 1))
+                calculate.append("    c{0}(s, b+{1}, [{2}])".format(partIndex, o + 1, ", ".join(drivers)))
+                continue
+            apply.append("    {0} = {0} & 5 | ({0} & 1) << 1".format(at(o)))
+            if part.length > 0:
+                # Like the deque's appendleft: everything moves along a slot and slot 0 stays put
+                if part.length > 1:
+                    apply.append("    s[b+{0}:b+{1}] = s[b+{2}:b+{3}]".format(o + 2, o + 1 + part.length, o + 1, o + part.length))
+                calculate.append("    {0} = {0} & 6 | {1}".format(at(o), at(o + part.length)))
+                if part.inputs:
+                    input = term(part.inputs[0])
+                else:
+                    input = "(e[{0}] or 0)".format(port) if port is not None else "0"
+                calculate.append("    {0} = {1}".format(at(o + 1), input))
+            elif part.kind != "input":
+                terms = [term(reference) for reference in part.inputs]
+                if port is None:
+                    calculate.append("    {0} = {0} & 6 | {1}".format(at(o), gateExpression(part.kind, terms)))
+                else:
+                    calculate.append("    if e[{0}] is None: {1} = {1} & 6 | {2}".format(port, at(o), gateExpression(part.kind, terms)))
+                    calculate.append("    else: {0} = {0} & 6 | {1}".format(at(o), gateExpression(part.kind, terms + ["e[{0}]".format(port)])))
+        return "\n".join(apply + ["    pass"] + calculate + ["    pass"]) + "\n"
+
+    # The compiled (apply, calculate) pair, shared by every instance
+    def compiled(self) -> Tuple[Callable, Callable]:
+        if self.functions is None:
+            namespace = {}
+            for partIndex, part in enumerate(self.parts):
+                if part.definition is not None:
+                    namespace['a{0}'.format(partIndex)], namespace['c{0}'.format(partIndex)] = part.definition.compiled()
+            exec(compile(self.generateSource(), "<subcircuit {0}>".format(self.name), "exec"), namespace)
+            self.functions = (namespace['apply'], namespace['calculate'])
+        return self.functions
+
+    # Makes the blocks of an instance, wired up to each other (but not to anything outside)
+    def decode(self, state: bytes) -> List[Interactable]:
+        blocks = [makeBlock(part, state, part.offset, (part.x, part.y)) for part in self.parts]
+        for block, part in zip(blocks, self.parts):
+            for index, number in part.inputs:
+                link(blocks[index] if number is None else blocks[index].ports[number], block)
+        return blocks
+
+    # Makes plain blocks for an instance whose vector starts at state[base], laid out around (x, y),
+    # and adds them to netlist.  Returns what stands in for each part: its block, or for an inner
+    # instance, the list of what stands in for its parts.
+    def expand(self, state: bytes, base: int, x: int, y: int, netlist: List[Interactable]) -> list:
+        standIns = []
+        for part in self.parts:
+            pos = (x + part.x - self.centerX, y + part.y - self.centerY)
+            if part.definition is not None:
+                standIns.append(part.definition.expand(state, base + part.offset + 1, pos[0], pos[1], netlist))
+            else:
+                block = makeBlock(part, state, base + part.offset, pos)
+                netlist.append(block)
+                standIns.append(block)
+        for part, standIn in zip(self.parts, standIns):
+            inputs = [self.standInFor(standIns, reference) for reference in part.inputs]
+            if part.definition is None:
+                for input in inputs:
+                    link(input, standIn)
+            else:
+                part.definition.connectInputs(standIn, inputs)
+        return standIns
+
+    def standInFor(self, standIns: list, reference: Tuple[int,int]) -> Interactable:
+        index, number = reference
+        if number is None:
+            return standIns[index]
+        return standIns[index][self.parts[index].definition.outputs[number][1]]
+
+    # Wires the drivers of an expanded instance's input ports to them
+    def connectInputs(self, standIns: list, drivers: List[Interactable]):
+        for (portName, index), driver in zip(self.inputs, drivers):
+            link(driver, standIns[index])
+
+    # Copies the states of an expanded instance back into its vector
+    def storeExpansion(self, standIns: list, state: bytearray, base: int):
+        for part, standIn in zip(self.parts, standIns):
+            offset = base + part.offset
+            if part.definition is not None:
+                part.definition.storeExpansion(standIn, state, offset + 1)
+                continue
+            state[offset] = state[offset] & 4 | standIn.currentState | (standIn.prevState << 1)
+            if part.length > 0:
+                state[offset + 1:offset + 1 + part.length] = bytes(standIn.delayLine)
+
+class Instance(Interactable):
+    __slots__ = ('definition', 'state', 'ports')
+
+    def __init__(self, definition: Definition, pos: Tuple[float,float]):
+        super().__init__('instance', pos)
+        self.definition = definition
+        self.state = bytearray(definition.initialState)
+        self.maxInputCount = len(definition.inputs)
+        self.ports = [OutputPort(self, number) for number in range(len(definition.outputs))]
+
+    def port(self, name: str) -> OutputPort:
+        for port in self.ports:
+            if port.name == name:
+                return port
+        raise ValueError("{0} has no output port called {1}".format(self.definition.name, name))
+
+    #override
+    def sources(self) -> list:
+        return self.ports
+
+    #override
+    def saveState(self) -> dict:
+        state = super().saveState()
+        state['definition'] = self.definition.name
+        state['state'] = self.state.hex()
+        return state
+
+    #override
+    def loadState(self, state: dict):
+        super().loadState(state)
+        if 'state' in state:
+            vector = bytearray.fromhex(state['state'])
+            if len(vector) != self.definition.size:
+                raise ValueError("The state of an instance of {0} should be {1} bytes, not {2}".format(self.definition.name, self.definition.size, len(vector)))
+            self.state = vector
+
+    #override
+    def saveSimulationState(self, buffer: bytearray):
+        super().saveSimulationState(buffer)
+        buffer.extend(self.state)
+
+    #override
+    def loadSimulationState(self, buffer: bytes, offset: int) -> int:
+        offset = super().loadSimulationState(buffer, offset)
+        self.state[:] = buffer[offset:offset + self.definition.size]
+        return offset + self.definition.size
+
+    #override
+    def apply(self):
+        self.prevState = self.currentState
+        self.definition.compiled()[0](self.state, 0)
+
+    #override
+    def calculate(self):
+        drivers = [1 if driver.prevState else 0 for driver in self.inputs[:self.maxInputCount]]
+        self.definition.compiled()[1](self.state, 0, drivers + [None] * (self.maxInputCount - len(drivers)))
+
+    # Does something to each block inside, by making the blocks, changing them and packing them
+    # back up.  It's slow, but it's only for things the user does, like reloading.
+    def edit(self, change: Callable[[Interactable], None], indices: Iterable[int] = None):
+        blocks = self.definition.decode(self.state)
+        # Lifting depends on whether a gate has inputs, including the ones from outside.  The blocks
+        # are thrown away afterwards, so the drivers aren't told about them.
+        for (portName, index), driver in zip(self.definition.inputs, self.inputs):
+            blocks[index].inputs.append(driver)
+        for index in (range(len(blocks)) if indices is None else indices):
+            change(blocks[index])
+        self.state = encode(blocks)
+
+    #override
+    def reload(self):
+        self.prevState = False
+        self.edit(lambda x: x.reload())
+
+    #override
+    def putOnLift(self):
+        self.prevState = False
+        self.edit(lambda x: x.putOnLift())
+
+    #override
+    def paint(self):
+        self.edit(lambda x: x.paint())
+
+    # Wiring something to an instance (or from it) only saves the state of its ports, since
+    # that's where the wire actually goes.
+    def paintPorts(self):
+        self.edit(lambda x: x.paint(), sorted(set(index for portName, index in self.definition.inputs + self.definition.outputs)))
+
+def hasSubcircuits(interactables: Iterable[Interactable]) -> bool:
+    return any(isinstance(x, Instance) for x in interactables)
+
+# A flat copy of a circuit with subcircuits, for the engines that don't know about them.  Blocks
+# outside the subcircuits are copied, apart from timers' delay lines, which start out shared (and
+# get copied back by store() if an engine replaced them).  Make a new one after changing anything.
+class FlatCircuit:
+    def __init__(self, interactables: Iterable[Interactable]):
+        self.interactables = list(interactables)
+        self.netlist: List[Interactable] = []
+        self.standIns = [] # for each block, its copy, or for an instance, what Definition.expand returned
+        for x in self.interactables:
+            if isinstance(x, Instance):
+                self.standIns.append(x.definition.expand(x.state, 0, x.x, x.y, self.netlist))
+            else:
+                node = copyOf(x, x.kind)
+                node.probe = x.probe
+                if isinstance(x, Timer):
+                    node.delayLine = x.delayLine
+                self.netlist.append(node)
+                self.standIns.append(node)
+
+        self.indexOf = {id(x): index for index, x in enumerate(self.interactables)}
+        for x, standIn in zip(self.interactables, self.standIns):
+            inputs = [self.standIn(input) for input in x.inputs]
+            if isinstance(x, Instance):
+                x.definition.connectInputs(standIn, inputs)
+            else:
+                for input in inputs:
+                    link(input, standIn)
+
+    # The block in the netlist for a block outside the subcircuits or an output port
+    def standIn(self, x) -> Interactable:
+        if isinstance(x, OutputPort):
+            return self.standIns[self.indexOf[id(x.instance)]][x.index]
+        return self.standIns[self.indexOf[id(x)]]
+
+    # Copies the states back into the original blocks and the instances' vectors
+    def store(self):
+        for x, standIn in zip(self.interactables, self.standIns):
+            if isinstance(x, Instance):
+                x.definition.storeExpansion(standIn, x.state, 0)
+            else:
+                x.currentState = standIn.currentState
+                x.prevState = standIn.prevState
+                # Engines that store into a new delay line (compiled, optimized...) have
+                # stopped sharing it with the original
+                if isinstance(x, Timer) and standIn.delayLine is not x.delayLine:
+                    x.delayLine.clear()
+                    x.delayLine.extend(standIn.delayLine)
+
+# Wraps a simulator (EventDrivenSimulator, GeneratedSimulator...) so it can run circuits with
+# subcircuits: it flattens the circuit on the first tick after an invalidate(), runs the flat copy
+# and copies the states back after every step.  Circuits without subcircuits are run directly.
+class HierarchicalSimulator:
+    def __init__(self, interactables: List[Interactable], makeSimulator: Callable[[List[Interactable]], object]):
+        # Keeps the list itself, so it sees blocks being added and removed
+        self.interactables = interactables
+        self.makeSimulator = makeSimulator
+        self.invalidate()
+
+    def invalidate(self):
+        self.flat = None
+        self.simulator = None
+
+    def markChanged(self, interactable: Interactable):
+        self.invalidate()
+
+    # Edits are passed on to the simulator if it's running the circuit itself; a flat copy has to
+    # be made again, and so does one for a circuit that's just got its first subcircuit.
+    def touched(self, interactables: Iterable[Interactable]):
+        interactables = list(interactables)
+        if self.flat is None and self.simulator is not None and not hasSubcircuits(interactables):
+            self.simulator.touched(interactables)
+        else:
+            self.invalidate()
+
+    def removed(self, interactable: Interactable):
+        if self.flat is None and self.simulator is not None:
+            self.simulator.removed(interactable)
+        else:
+            self.invalidate()
+
+    # Storing a flat copy back touches everything
+    def changedLastTick(self):
+        return self.simulator.changedLastTick() if self.flat is None and self.simulator is not None else None
+
+    def step(self, ticks: int = 1):
+        if self.simulator is None:
+            if hasSubcircuits(self.interactables):
+                self.flat = FlatCircuit(self.interactables)
+                self.simulator = self.makeSimulator(self.flat.netlist)
+            else:
+                self.simulator = self.makeSimulator(self.interactables)
+        self.simulator.step(ticks)
+        if self.flat is not None:
+            self.flat.store()
+
+# The definitions the blocks use, inner ones first, so each can be loaded before it's needed
+def findDefinitions(blocks: Iterable[Interactable], found: Dict[str, Definition] = None) -> Dict[str, Definition]:
+    if found is None:
+        found = {}
+    for x in blocks:
+        if not isinstance(x, Instance):
+            continue
+        known = found.get(x.definition.name)
+        if known is None:
+            findDefinitions(x.definition.blocks, found)
+            # One inside it could have the same name
+            known = found.setdefault(x.definition.name, x.definition)
+        if known is not x.definition:
+            raise ValueError("There are two different subcircuits called " + x.definition.name)
+    return found
+
+def serializeBlocks(blocks: List[Interactable]) -> List[dict]:
+    indexOf = {id(x): index for index, x in enumerate(blocks)}
+    dicts = []
+    for x in blocks:
+        serialized = x.saveState()
+        serialized['inputs'] = [[indexOf[id(input.instance)], input.name] if isinstance(input, OutputPort) else indexOf[id(input)] for input in x.inputs]
+        dicts.append(serialized)
+    return dicts
+
+def deserializeBlocks(dicts: List[dict], definitions: Dict[str, Definition]) -> List[Interactable]:
+    blocks = []
+    for serialized in dicts:
+        if serialized['kind'] == 'instance':
+            definition = definitions.get(serialized['definition'])
+            if definition is None:
+                raise ValueError("Unknown subcircuit: " + serialized['definition'])
+            block = Instance(definition, (serialized['x'], serialized['y']))
+            block.loadState(serialized)
+        else:
+            block = interactableFromDictionary(serialized)
+        blocks.append(block)
+    for block, serialized in zip(blocks, dicts):
+        for input in serialized['inputs']:
+            link(blocks[input[0]].port(input[1]) if isinstance(input, list) else blocks[input], block)
+    return blocks
+
+def serializeDesign(interactables: List[Interactable]) -> str:
+    definitions = [{
+        'name': definition.name,
+        'inputs': [list(port) for port in definition.inputs],
+        'outputs': [list(port) for port in definition.outputs],
+        'blocks': serializeBlocks(definition.blocks)
+    } for definition in findDefinitions(interactables).values()]
+    return json.dumps({'definitions': definitions, 'blocks': serializeBlocks(interactables)}, indent=4)
+
+# Takes what json.loads made of a file in the format described at the top
+def deserializeDesign(design: dict) -> List[Interactable]:
+    definitions = {}
+    for serialized in design.get('definitions', []):
+        blocks = deserializeBlocks(serialized['blocks'], definitions)
+        definitions[serialized['name']] = Definition(serialized['name'], blocks,
+            [tuple(port) for port in serialized.get('inputs', [])], [tuple(port) for port in serialized.get('outputs', [])])
+    return deserializeBlocks(design['blocks'], definitions)
+
+def parsePort(text: str) -> Tuple[str,int]:
+    name, separator, index = text.partition('=')
+    if not separator or not index.isdigit():
+        raise argparse.ArgumentTypeError("expected NAME=INDEX, not " + text)
+    return (name, int(index))
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Makes and unpacks subcircuits.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    define = commands.add_parser("define", help="make a subcircuit out of a circuit and put an instance of it into another one")
+    define.add_argument("circuit", help="the circuit to put it in (made if it isn't there)")
+    define.add_argument("name", help="what to call the subcircuit")
+    define.add_argument("cell", help="the circuit file to make the subcircuit from")
+    define.add_argument("--input", type=parsePort, action="append", default=[], metavar="NAME=INDEX", help="an input port: the name and the number of the block it goes to (a gate, or a timer without an input)")
+    define.add_argument("--output", type=parsePort, action="append", default=[], metavar="NAME=INDEX", help="an output port: the name and the number of the block")
+    define.add_argument("--at", type=int, nargs=2, default=[100, 100], metavar=("X", "Y"), help="where to put the instance")
+    flatten = commands.add_parser("flatten", help="write a copy of a circuit with every subcircuit replaced by its blocks")
+    flatten.add_argument("circuit")
+    flatten.add_argument("output")
+    args = parser.parse_args(argv)
+
+    if args.command == "define":
+        try:
+            interactables = loadCircuit(args.circuit)
+        except FileNotFoundError:
+            interactables = []
+        if args.name in findDefinitions(interactables):
+            sys.stderr.write("{0} already has a subcircuit called {1}\n".format(args.circuit, args.name))
+            return 1
+        definition = Definition(args.name, loadCircuit(args.cell), args.input, args.output)
+        if args.name in findDefinitions(definition.blocks):
+            sys.stderr.write("{0} already has a subcircuit called {1} in it\n".format(args.cell, args.name))
+            return 1
+        interactables.append(Instance(definition, args.at))
+        try:
+            findDefinitions(interactables)
+        except ValueError as e:
+            sys.stderr.write(str(e) + "\n")
+            return 1
+        saveCircuit(args.circuit, interactables)
+    else:
+        saveCircuit(args.output, FlatCircuit(loadCircuit(args.circuit)).netlist)
+    return 0
+
+if __name__=="__main__":
+    # model.py imports this module by name, so use that copy of it, or its Instances wouldn't be ours
+    import subcircuit
+    sys.exit(subcircuit.main())
@@ -0,0 +1,173 @@
+# Tries a circuit with every combination of some saved states and inputs, to hunt down load-in
+# bugs - the ones that only show up when the game happened to save a gate in the wrong state.
+#
+#   python3 sweep.py mycircuit.json --saved 3 4 5 --inputs 0 --ticks 100
+#
+# runs the circuit with each of the 16 combinations of saved states for blocks 3, 4 and 5 and
+# on/off for input 0: it sets the saved states, reloads (or puts it on the lift, with --event
+# lift), flips the inputs, runs 100 ticks and looks at the outputs (the blocks marked as probes,
+# or --outputs).  The scenarios whose outputs differ from how the circuit is saved now (or from
+# --expected) are the suspicious ones.
+#
+# The scenarios are spread over several processes.  Each process is sent the circuit once, in the
+# compact binary format (or JSON, if it has subcircuits), when it starts; after that, it's only
+# sent lists of scenario numbers.
+# Bit i of a scenario number is the state of the i'th varied block (the saved ones first).
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Sequence
+from model import Interactable, Input, reload, putOnLift, snapshot, restore, serialize, deserialize, loadCircuit
+from binformat import serializeBinary
+from headless import engines, simulate
+from subcircuit import hasSubcircuits
+
+events = ["reload", "lift"]
+maxVaried = 24 # that's 16 million scenarios already
+
+# Each worker process's copy of the circuit, set up by initWorker
+worker = None
+
+class SweepWorker:
+    def __init__(self, circuit: bytes, saved: List[int], inputs: List[int], outputs: List[int], event: str, ticks: int, engine: str):
+        self.interactables = deserialize(circuit)
+        self.saved = [self.interactables[index] for index in saved]
+        self.inputs = [self.interactables[index] for index in inputs]
+        self.outputs = [self.interactables[index] for index in outputs]
+        self.event = event
+        self.ticks = ticks
+        self.engine = engine
+        self.savedStates = [getattr(x, 'savedState', None) for x in self.interactables]
+        self.start = snapshot(self.interactables)
+
+    def run(self, scenario: int) -> int:
+        restore(self.interactables, self.start)
+        for x, savedState in zip(self.interactables, self.savedStates):
+            if savedState is not None:
+                x.savedState = savedState
+        for bit, x in enumerate(self.saved):
+            x.savedState = scenario >> bit & 1 == 1
+        if self.event == "lift":
+            putOnLift(self.interactables)
+        else:
+            reload(self.interactables)
+        for bit, x in enumerate(self.inputs, len(self.saved)):
+            x.currentState = scenario >> bit & 1 == 1
+        simulate(self.interactables, self.ticks, self.engine)
+        outputs = 0
+        for bit, x in enumerate(self.outputs):
+            if x.currentState:
+                outputs |= 1 << bit
+        return outputs
+
+def initWorker(*args):
+    global worker
+    worker = SweepWorker(*args)
+
+def runScenarios(scenarios: List[int]) -> List[int]:
+    return [worker.run(scenario) for scenario in scenarios]
+
+class SweepResult:
+    def __init__(self, outputs: Dict[int, int], expected: int, outputCount: int):
+        self.outputs = outputs # scenario => its outputs, bit i being the i'th output
+        self.expected = expected
+        self.outputCount = outputCount
+
+    @property
+    def differing(self) -> List[int]:
+        return [scenario for scenario, outputs in self.outputs.items() if outputs != self.expected]
+
+# Runs the scenarios; by default, every combination of the varied blocks.  'saved' are the blocks
+# (gates or inputs) whose saved states get varied before the event, 'inputs' are the inputs that
+# get flipped on or off after it.  'outputs' defaults to the blocks marked as probes, or all of
+# them if there aren't any.  'expected' defaults to the outputs with the saved states and inputs
+# the way they are now.
+def sweep(interactables: List[Interactable], saved: Sequence[Interactable] = (), inputs: Sequence[Input] = (), event: str = "reload", ticks: int = 0,
+          outputs: Sequence[Interactable] = None, expected: int = None, scenarios: Sequence[int] = None, engine: str = "event", workers: int = None) -> SweepResult:
+    saved = list(saved)
+    inputs = list(inputs)
+    if any(not hasattr(x, 'savedState') for x in saved):
+        raise ValueError("Only gates and inputs have saved states")
+    if any(not isinstance(x, Input) for x in inputs):
+        raise ValueError("Only inputs can be flipped")
+    if len(saved) + len(inputs) > maxVaried:
+        raise ValueError("Too many blocks to vary ({0}); the most is {1}".format(len(saved) + len(inputs), maxVaried))
+    if event not in events:
+        raise ValueError("Unknown event: " + event)
+    if outputs is None:
+        outputs = [x for x in interactables if x.probe] or list(interactables)
+
+    indexOf = {id(x): index for index, x in enumerate(interactables)}
+    asSaved = 0
+    for bit, x in enumerate(saved + inputs):
+        if x.savedState:
+            asSaved |= 1 << bit
+    if scenarios is None:
+        scenarios = range(1 << (len(saved) + len(inputs)))
+    scenarios = list(scenarios)
+    if expected is None and asSaved not in scenarios:
+        scenarios.append(asSaved)
+
+    workers = workers or os.cpu_count() or 1
+    chunkSize = max(1, len(scenarios) // (workers * 8))
+    chunks = [scenarios[start:start + chunkSize] for start in range(0, len(scenarios), chunkSize)]
+    # The binary format is smaller, but it can't hold subcircuits
+    circuit = serialize(interactables).encode('utf-8') if hasSubcircuits(interactables) else serializeBinary(interactables)
+    arguments = (circuit, [indexOf[id(x)] for x in saved], [indexOf[id(x)] for x in inputs],
+                 [indexOf[id(x)] for x in outputs], event, ticks, engine)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=arguments) as executor:
+        for chunk, chunkOutputs in zip(chunks, executor.map(runScenarios, chunks)):
+            results.update(zip(chunk, chunkOutputs))
+    return SweepResult(results, results[asSaved] if expected is None else expected, len(outputs))
+
+def bitString(bits: int, count: int) -> str:
+    return "".join("1" if bits >> bit & 1 else "0" for bit in range(count))
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Runs a circuit with every combination of some saved states and inputs, and reports the ones that come out differently.")
+    parser.add_argument("circuit", help="the circuit file, as saved by smlogic.py (JSON or binary)")
+    parser.add_argument("--saved", nargs="+", type=int, default=[], metavar="INDEX", help="the blocks whose saved states to vary (their numbers, as headless.py prints them)")
+    parser.add_argument("--inputs", nargs="+", type=int, default=[], metavar="INDEX", help="the inputs to flip on and off after the event")
+    parser.add_argument("--event", choices=events, default="reload", help="what happens before the ticks run")
+    parser.add_argument("--ticks", type=int, default=0, help="the number of ticks to run after the event")
+    parser.add_argument("--outputs", nargs="+", type=int, metavar="INDEX", help="the blocks to compare (by default, the probes, or everything)")
+    parser.add_argument("--expected", metavar="BITS", help="the outputs that are right, like 0110 (by default, the outputs when nothing is changed)")
+    parser.add_argument("--engine", choices=engines, default="event", help="the simulation engine to use")
+    parser.add_argument("--workers", type=int, help="the number of processes to use (by default, one per CPU)")
+    parser.add_argument("--json", action="store_true", help="write the outputs of every scenario as JSON")
+    args = parser.parse_args(argv)
+
+    interactables = loadCircuit(args.circuit)
+    saved = [interactables[index] for index in args.saved]
+    inputs = [interactables[index] for index in args.inputs]
+    outputs = None if args.outputs is None else [interactables[index] for index in args.outputs]
+    expected = None if args.expected is None else int(args.expected[::-1], 2)
+    result = sweep(interactables, saved, inputs, args.event, args.ticks, outputs, expected, engine=args.engine, workers=args.workers)
+
+    varied = [("saved", index) for index in args.saved] + [("input", index) for index in args.inputs]
+    def describe(scenario: int) -> dict:
+        return {
+            'scenario': scenario,
+            'varied': {"{0} {1}".format(what, index): scenario >> bit & 1 == 1 for bit, (what, index) in enumerate(varied)},
+            'outputs': bitString(result.outputs[scenario], result.outputCount)
+        }
+
+    if args.json:
+        json.dump({
+            'expected': bitString(result.expected, result.outputCount),
+            'scenarios': [describe(scenario) for scenario in sorted(result.outputs)],
+            'differing': result.differing
+        }, sys.stdout, indent=4)
+        sys.stdout.write("\n")
+    else:
+        for scenario in result.differing:
+            settings = " ".join("{0} {1}={2}".format(what, index, "on" if scenario >> bit & 1 else "off") for bit, (what, index) in enumerate(varied))
+            sys.stdout.write("{0}: outputs {1}, expected {2}\n".format(settings, bitString(result.outputs[scenario], result.outputCount), bitString(result.expected, result.outputCount)))
+        sys.stderr.write("{0} of {1} scenarios differ\n".format(len(result.differing), len(result.outputs)))
+    return 1 if result.differing else 0
+
+if __name__=="__main__":
+    sys.exit(main())
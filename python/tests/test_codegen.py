@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+import codegen
+from model import LogicGate, singleStep, snapshot, deserialize, serialize, link
+from codegen import GeneratedCircuit, stepFunction, loadCode, topology, topologyHash
+
+# A chain of n gates of the given kind off a NOR loop, so each n is a different shape
+def chain(n: int, kind: str = 'or'):
+    clock = LogicGate('nor', (0, 0))
+    link(clock, clock)
+    blocks = [clock]
+    for index in range(n):
+        gate = LogicGate(kind, (index, 0))
+        link(blocks[-1], gate)
+        blocks.append(gate)
+    return blocks
+
+def cachedFiles(folder: str):
+    return [name for name in os.listdir(folder) if name.endswith(".step")]
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        codegen.cachedFunctions.clear()
+        self.addCleanup(codegen.cachedFunctions.clear)
+
+    def test_round_trip(self):
+        blocks = chain(5, 'xor')
+        stepFunction(blocks, self.folder.name)
+        self.assertEqual(len(cachedFiles(self.folder.name)), 1)
+        self.assertIsNotNone(loadCode(self.folder.name, topologyHash(topology(blocks))))
+
+        # Coming back from the disk, the code still has to run the circuit right
+        codegen.cachedFunctions.clear()
+        expected = deserialize(serialize(blocks))
+        for _ in range(7):
+            singleStep(expected)
+        circuit = GeneratedCircuit(blocks, self.folder.name)
+        circuit.step(7)
+        circuit.store()
+        self.assertEqual(snapshot(blocks), snapshot(expected))
+        self.assertEqual(len(cachedFiles(self.folder.name)), 1)
+
+    def test_stays_under_budget(self):
+        stepFunction(chain(1), self.folder.name)
+        size = os.path.getsize(os.path.join(self.folder.name, cachedFiles(self.folder.name)[0]))
+        saved = codegen.maxCacheBytes
+        codegen.maxCacheBytes = size * 20
+        self.addCleanup(setattr, codegen, 'maxCacheBytes', saved)
+        for n in range(2, 60):
+            stepFunction(chain(n), self.folder.name)
+        files = cachedFiles(self.folder.name)
+        self.assertLessEqual(sum(os.path.getsize(os.path.join(self.folder.name, name)) for name in files), codegen.maxCacheBytes)
+        self.assertLess(len(files), 58)
+        # The newest one is kept
+        self.assertIsNotNone(loadCode(self.folder.name, topologyHash(topology(chain(59)))))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+# Checks that the engines all agree with the classic one.  Run from the python folder with
+#
+#   python3 -m unittest discover tests
+import unittest
+from model import LogicGate, Timer, link
+from subcircuit import Definition, Instance, FlatCircuit
+from optimizer import OptimizedCircuit
+import headless
+
+# The generated engine shouldn't leave its code in the user's cache
+def setUpModule():
+    global savedCodeFolder
+    savedCodeFolder = headless.generatedCodeFolder
+    headless.generatedCodeFolder = None
+
+def tearDownModule():
+    headless.generatedCodeFolder = savedCodeFolder
+
+# A ring: an inverter, through a buffer in a subcircuit, into a timer and back to the inverter
+def ringWithInstance():
+    buffer = Definition("buffer", [LogicGate('or', (0, 0))], [("in", 0)], [("out", 0)])
+    inverter = LogicGate('nor', (0, 0))
+    instance = Instance(buffer, (100, 0))
+    timer = Timer('timer', (200, 0))
+    timer.setDelay(3)
+    link(inverter, instance)
+    link(instance.port("out"), timer)
+    link(timer, inverter)
+    return [inverter, instance, timer]
+
+def optimized(interactables, ticks: int, engine: str):
+    flat = FlatCircuit(interactables)
+    circuit = OptimizedCircuit(flat.netlist)
+    headless.simulate(circuit.netlist, ticks, engine)
+    circuit.ticks += ticks
+    circuit.store()
+    flat.store()
+
+class TestSubcircuitEngines(unittest.TestCase):
+    def check(self, run):
+        # Stopping and starting again in between is what catches state that wasn't stored
+        expected = ringWithInstance()
+        headless.simulate(expected, 17, "classic")
+        actual = ringWithInstance()
+        run(actual, 9)
+        run(actual, 8)
+        self.assertEqual(headless.describeStates(actual), headless.describeStates(expected))
+
+    def test_engines(self):
+        for engine in headless.engines:
+            with self.subTest(engine=engine):
+                self.check(lambda interactables, ticks: headless.simulate(interactables, ticks, engine))
+
+    def test_optimized(self):
+        for engine in headless.engines:
+            with self.subTest(engine=engine):
+                self.check(lambda interactables, ticks: optimized(interactables, ticks, engine))
+
+    def test_unflattened(self):
+        from compiled import CompiledCircuit
+        from bitparallel import BitParallelCircuit
+        from codegen import GeneratedCircuit
+        for makeCircuit in (CompiledCircuit, lambda x: BitParallelCircuit(x, 2), GeneratedCircuit, OptimizedCircuit):
+            with self.assertRaisesRegex(ValueError, "FlatCircuit"):
+                makeCircuit(ringWithInstance())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+from model import singleStep, snapshot
+from fastforward import fastForward
+from tests.test_engines import ringWithInstance
+
+class TestFastForward(unittest.TestCase):
+    def test_matches_simulating(self):
+        for ticks in (0, 5, 1000, 12345):
+            with self.subTest(ticks=ticks):
+                expected = ringWithInstance()
+                for _ in range(ticks):
+                    singleStep(expected)
+                actual = ringWithInstance()
+                result = fastForward(actual, ticks)
+                self.assertEqual(snapshot(actual), snapshot(expected))
+                self.assertLess(result.simulatedTicks, 100)
+
+    def test_gives_up_when_out_of_memory(self):
+        expected = ringWithInstance()
+        for _ in range(1000):
+            singleStep(expected)
+        actual = ringWithInstance()
+        result = fastForward(actual, 1000, maxBytes=0)
+        self.assertIsNone(result.period)
+        self.assertEqual(snapshot(actual), snapshot(expected))
+
+if __name__ == "__main__":
+    unittest.main()
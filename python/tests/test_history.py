@@ -0,0 +1,50 @@
+import unittest
+from model import LogicGate, Timer, BlockPositions, link, disconnect, snapshot
+from eventsim import EventDrivenSimulator
+from history import TickHistory
+
+# Rings of an inverter and a timer, so there's something going on everywhere
+def rings(count: int):
+    blocks = []
+    for index in range(count):
+        inverter = LogicGate('nor', (index, 0))
+        timer = Timer('timer', (index, 100))
+        timer.setDelay(index % 4)
+        link(inverter, timer)
+        link(timer, inverter)
+        blocks += [inverter, timer]
+    return blocks
+
+class TestEdits(unittest.TestCase):
+    def test_delete_keeps_order(self):
+        blocks = rings(10)
+        simulator = EventDrivenSimulator(blocks)
+        history = TickHistory(blocks)
+        positions = BlockPositions(blocks)
+        for _ in range(5):
+            history.step(simulator.step, simulator.changedLastTick)
+
+        order = list(blocks)
+        for doomed in (order[3], order[0], order[18], order[10]):
+            del blocks[positions.find(doomed)]
+            positions.removed(doomed)
+            order.remove(doomed)
+            consumers = disconnect(doomed)
+            simulator.removed(doomed)
+            simulator.touched(consumers)
+            history.removed(doomed)
+            history.touched(consumers)
+        self.assertEqual(blocks, order)
+        self.assertEqual([positions.find(x) for x in blocks], list(range(len(blocks))))
+
+        # Stepping back after the edit has to put the right states into the right blocks
+        snapshots = [snapshot(blocks)]
+        for _ in range(12):
+            history.step(simulator.step, simulator.changedLastTick)
+            snapshots.append(snapshot(blocks))
+        for tick in (7, 0, 12, 3):
+            history.seek(history.firstTick + tick)
+            self.assertEqual(snapshot(blocks), snapshots[tick])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+from model import LogicGate, Timer, link, loadCircuit, saveCircuit, serialize, deserialize, snapshot, singleStep
+from subcircuit import Definition, Instance, main
+
+def buffer(name: str = "buffer") -> Definition:
+    return Definition(name, [LogicGate('or', (0, 0))], [("in", 0)], [("out", 0)])
+
+# A subcircuit that passes its input through an instance of 'inner'
+def wrapping(name: str, inner: Definition) -> Definition:
+    gate = LogicGate('or', (0, 0))
+    instance = Instance(inner, (100, 0))
+    output = LogicGate('or', (200, 0))
+    link(gate, instance)
+    link(instance.port("out"), output)
+    return Definition(name, [gate, instance, output], [("in", 0)], [("out", 2)])
+
+class TestNestedDefinitions(unittest.TestCase):
+    def test_round_trip(self):
+        inner = buffer()
+        outer = wrapping("outer", inner)
+        clock = LogicGate('nor', (0, 0))
+        first = Instance(outer, (100, 0))
+        second = Instance(inner, (200, 0))
+        timer = Timer('timer', (300, 0))
+        link(clock, first)
+        link(first.port("out"), second)
+        link(second.port("out"), timer)
+        link(timer, clock)
+        blocks = [clock, first, second, timer]
+        loaded = deserialize(serialize(blocks))
+        self.assertIs(loaded[1].definition.blocks[1].definition, loaded[2].definition)
+        for _ in range(11):
+            singleStep(blocks)
+            singleStep(loaded)
+        self.assertEqual(snapshot(loaded), snapshot(blocks))
+
+    def test_same_name_inside(self):
+        outer = wrapping("cell", buffer("cell"))
+        with self.assertRaisesRegex(ValueError, "two different subcircuits called cell"):
+            serialize([Instance(outer, (0, 0))])
+
+    def test_define_refuses_a_name_inside(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cell = os.path.join(folder, "cell.json")
+            circuit = os.path.join(folder, "circuit.json")
+            saveCircuit(cell, [Instance(buffer("cell"), (0, 0))])
+            self.assertEqual(main(["define", circuit, "cell", cell]), 1)
+            self.assertFalse(os.path.exists(circuit))
+            self.assertEqual(main(["define", circuit, "wrapper", cell]), 0)
+            self.assertEqual([x.definition.name for x in loadCircuit(circuit)], ["wrapper"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import io
+import unittest
+from model import singleStep
+from vcd import VcdTrace, traceSteps
+from tests.test_engines import ringWithInstance
+
+# The values written for each signal name, in order, after the header
+def changes(text: str) -> dict:
+    header, dump = text.split("$enddefinitions $end\n")
+    names = {}
+    for line in header.splitlines():
+        if line.startswith("$var"):
+            parts = line.split()
+            names[parts[3]] = parts[4]
+    values = {name: [] for name in names.values()}
+    for line in dump.splitlines():
+        if line[:1] in ("0", "1", "x") and line[1:] in names:
+            values[names[line[1:]]].append(line[0])
+    return values
+
+class TestProbes(unittest.TestCase):
+    def test_instance(self):
+        blocks = ringWithInstance()
+        file = io.StringIO()
+        traceSteps(file, blocks, 40, probes=[blocks[1]])
+        values = changes(file.getvalue())
+        self.assertEqual(list(values), ["buffer_1_out"])
+        # The ring goes round every 12 ticks or so, so the port should have toggled a few times
+        self.assertGreater(len(values["buffer_1_out"]), 4)
+
+    def test_deleted(self):
+        blocks = ringWithInstance()
+        for block in blocks:
+            block.probe = True
+        file = io.StringIO()
+        trace = VcdTrace(file, blocks)
+        for tick in range(1, 6):
+            singleStep(blocks)
+            trace.sample(tick)
+        timer = blocks.pop()
+        trace.edited([timer])
+        blocks[0].probe = False
+        trace.edited()
+        for tick in range(6, 20):
+            singleStep(blocks)
+            trace.sample(tick)
+        trace.close()
+        values = changes(file.getvalue())
+        self.assertEqual(values["timer_2"][-1], "x")
+        self.assertEqual(values["nor_0"][-1], "x")
+        self.assertNotEqual(values["buffer_1_out"][-1], "x")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+# Writes waveforms of the blocks marked as probes to a Value Change Dump (.vcd) file, which
+# waveform viewers like GTKWave can open.  It's for seeing what happened over thousands of ticks
+# rather than just what the colors are right now.
+#
+# It's a pipeline of generators: each tick's number is sent to changeDetector, which compares
+# the probes with what they were last time and sends a line of text for each one that changed
+# to bufferedWriter, which writes them out in big chunks.  Nothing is kept beyond the probes'
+# last values and one chunk of text, so a trace can go on for as long as you like.
+#
+# Use VcdTrace directly from a loop that runs the ticks some other way, calling sample() after
+# every tick, or traceSteps to run a batch of ticks and trace them.
+#
+# A subcircuit's state is in its state vector rather than in the instance, so probing one traces
+# each of its output ports.
+import datetime
+import re
+from typing import Callable, Generator, Iterable, List, TextIO
+from model import Interactable, singleStep
+
+tickLength = 25 # milliseconds - Scrap Mechanic runs at 40 ticks a second
+
+# Short names for the signals, as VCD wants: '!', '"', ... '~', then '!!', '"!' and so on
+def identifier(index: int) -> str:
+    code = ""
+    while True:
+        code += chr(33 + index % 94)
+        index //= 94
+        if index == 0:
+            return code
+        index -= 1
+
+def bufferedWriter(file: TextIO, bufferSize: int = 64*1024) -> Generator[None, str, None]:
+    chunk = []
+    size = 0
+    try:
+        while True:
+            text = yield
+            chunk.append(text)
+            size += len(text)
+            if size >= bufferSize:
+                file.write("".join(chunk))
+                chunk = []
+                size = 0
+    finally:
+        file.write("".join(chunk))
+        file.flush()
+
+# One traced wire: a block, or one of a subcircuit's output ports.  'source' is what has the
+# currentState.
+class Signal:
+    def __init__(self, code: str, name: str, block: Interactable, source):
+        self.code = code
+        self.name = name
+        self.block = block
+        self.source = source
+        self.live = True # False once the block has been deleted, or stopped being a probe
+
+# Signals that aren't live go to x (unknown) until they are again
+def changeDetector(signals: List[Signal], target: Generator[None, str, None]) -> Generator[None, int, None]:
+    lastStates = [signal.source.currentState for signal in signals]
+    try:
+        while True:
+            tick = yield
+            changes = []
+            for index, signal in enumerate(signals):
+                if not signal.live:
+                    if lastStates[index] is not None:
+                        lastStates[index] = None
+                        changes.append("x{0}\n".format(signal.code))
+                elif signal.source.currentState != lastStates[index]:
+                    lastStates[index] = signal.source.currentState
+                    changes.append("{0}{1}\n".format(1 if lastStates[index] else 0, signal.code))
+            if changes:
+                target.send("#{0}\n".format(tick * tickLength) + "".join(changes))
+    finally:
+        target.close()
+
+# The signals for the probes, named after the block's kind and where it is in the circuit file
+# (and the port, for subcircuits)
+def findSignals(interactables: List[Interactable], probes: List[Interactable]) -> List[Signal]:
+    indexOf = {id(x): index for index, x in enumerate(interactables)}
+    signals = []
+    for probe in probes:
+        for source in probe.sources():
+            if source is probe:
+                name = "{0}_{1}".format(probe.kind, indexOf[id(probe)])
+            else:
+                name = re.sub(r"\W", "_", "{0}_{1}_{2}".format(probe.definition.name, indexOf[id(probe)], source.name))
+            signals.append(Signal(identifier(len(signals)), name, probe, source))
+    return signals
+
+class VcdTrace:
+    # If probes is None, it traces the interactables marked as probes, or all of them if none are.
+    # 'tick' is the tick the circuit is on now; the states as they are now get written as of then.
+    def __init__(self, file: TextIO, interactables: List[Interactable], probes: List[Interactable] = None, tick: int = 0):
+        # Whether unmarking a block as a probe stops tracing it
+        self.followsMarks = probes is None and any(i.probe for i in interactables)
+        if probes is None:
+            probes = [i for i in interactables if i.probe] or list(interactables)
+        self.signals = findSignals(interactables, probes)
+        self.removed = set() # ids of the blocks that have been deleted
+        self.lastTick = tick
+        writer = bufferedWriter(file)
+        next(writer)
+        writer.send(self.header(tick))
+        self.pipeline = changeDetector(self.signals, writer)
+        next(self.pipeline)
+
+    def header(self, tick: int) -> str:
+        lines = [
+            "$date {0} $end".format(datetime.datetime.now().isoformat(timespec='seconds')),
+            "$version Scrap Mechanic Logic Gate Simulator $end",
+            "$timescale 1 ms $end",
+            "$scope module circuit $end"
+        ]
+        for signal in self.signals:
+            lines.append("$var wire 1 {0} {1} $end".format(signal.code, signal.name))
+        lines += ["$upscope $end", "$enddefinitions $end", "#{0}".format(tick * tickLength), "$dumpvars"]
+        for signal in self.signals:
+            lines.append("{0}{1}".format(1 if signal.source.currentState else 0, signal.code))
+        lines.append("$end")
+        return "\n".join(lines) + "\n"
+
+    # Call after each tick.  Times in a VCD file can only go forwards, so if the circuit has been
+    # stepped backwards, nothing is written until it gets past where it was before.
+    def sample(self, tick: int):
+        if tick > self.lastTick:
+            self.pipeline.send(tick)
+            self.lastTick = tick
+
+    # Call after editing the circuit, with any blocks that were deleted.  Those (and blocks that
+    # were unmarked as probes, if it's tracing the marked ones) go to x.  The signals are fixed
+    # when the file starts, so blocks that weren't probes then need a new trace.
+    def edited(self, removed: Iterable[Interactable] = ()):
+        self.removed.update(id(x) for x in removed)
+        for signal in self.signals:
+            signal.live = id(signal.block) not in self.removed and (signal.block.probe or not self.followsMarks)
+
+    def close(self):
+        self.pipeline.close()
+
+# Runs 'ticks' ticks with stepFunction (singleStep if it's not given), tracing them to file
+def traceSteps(file: TextIO, interactables: List[Interactable], ticks: int, stepFunction: Callable[[], None] = None, probes: List[Interactable] = None):
+    if stepFunction is None:
+        stepFunction = lambda: singleStep(interactables)
+    trace = VcdTrace(file, interactables, probes)
+    try:
+        for tick in range(1, ticks + 1):
+            stepFunction()
+            trace.sample(tick)
+    finally:
+        trace.close()